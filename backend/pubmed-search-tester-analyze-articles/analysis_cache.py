@@ -0,0 +1,201 @@
+"""Content-addressed cache of Gemini responses.
+
+Keys are a SHA-256 over everything that determines a response (PMID, article
+content, final prompt, model and generation config), so a hit is only possible
+when the request to Gemini would have been byte-for-byte identical.
+
+Backends are selected with ANALYSIS_CACHE_BACKEND:
+  memory  in-process LRU with TTL (default)
+  sqlite  local SQLite file at ANALYSIS_CACHE_PATH
+  gcs     shared store in the ANALYSIS_CACHE_BUCKET Cloud Storage bucket
+  none    caching disabled
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(**parts):
+    """Hash the given parts into a stable hex cache key."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCache:
+    """Thread-safe in-memory LRU cache with per-entry TTL."""
+
+    def __init__(self, max_entries=1000, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created = entry
+            if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """Local on-disk cache in a single SQLite file.
+
+    Every prune_every writes (and on open) expired rows are deleted, and so are the
+    oldest rows beyond max_entries, so the file stays bounded on a long-lived instance.
+    """
+
+    def __init__(self, path, ttl_seconds=None, max_entries=None, prune_every=100):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+        with self._lock:
+            self._prune()
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+            return None
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        """Delete expired rows, then the oldest rows beyond max_entries; the caller holds the lock."""
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl_seconds,))
+        if self.max_entries:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+
+class GCSCache:
+    """Cache shared between instances, stored as one object per key in Cloud Storage."""
+
+    def __init__(self, bucket_name, prefix='analysis-cache', ttl_seconds=None):
+        # Optional dependency, only needed when the shared store is enabled
+        from google.cloud import storage
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._bucket = storage.Client().bucket(bucket_name)
+
+    def get(self, key):
+        blob = self._bucket.blob(f"{self.prefix}/{key}.json")
+        try:
+            entry = json.loads(blob.download_as_text())
+        except Exception:
+            return None
+        if self.ttl_seconds and time.time() - entry['created'] > self.ttl_seconds:
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        blob = self._bucket.blob(f"{self.prefix}/{key}.json")
+        blob.upload_from_string(
+            json.dumps({'value': value, 'created': time.time()}),
+            content_type='application/json'
+        )
+
+
+class AnalysisCache:
+    """Wraps a cache backend with hit/miss counters; backend errors never fail the caller."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Cache read failed: {str(e)}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            logger.error(f"Cache write failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def create_cache_from_env(prefix='ANALYSIS_CACHE'):
+    """Build an AnalysisCache from <prefix>_BACKEND / _TTL_SECONDS / _PATH / _BUCKET environment variables."""
+    backend_name = os.environ.get(f'{prefix}_BACKEND', 'memory').lower()
+    ttl = float(os.environ.get(f'{prefix}_TTL_SECONDS', str(7 * 24 * 3600))) or None
+    try:
+        if backend_name == 'memory':
+            backend = MemoryCache(int(os.environ.get(f'{prefix}_MAX_ENTRIES', '1000')), ttl)
+        elif backend_name == 'sqlite':
+            backend = SQLiteCache(os.environ.get(f'{prefix}_PATH', f'/tmp/{prefix.lower()}.sqlite'), ttl,
+                                  int(os.environ.get(f'{prefix}_MAX_ENTRIES', '50000')))
+        elif backend_name == 'gcs':
+            backend = GCSCache(os.environ[f'{prefix}_BUCKET'], prefix.lower().replace('_', '-'), ttl)
+        else:
+            backend = None
+    except Exception as e:
+        logger.error(f"Failed to initialise {backend_name} cache, caching disabled: {str(e)}")
+        backend = None
+    logger.info(f"{prefix} backend: {backend_name if backend else 'none'}")
+    return AnalysisCache(backend)
@@ -0,0 +1,190 @@
+"""Article text preprocessing before prompting.
+
+Modes:
+    full    the content column unchanged
+    clean   split into sections and drop references, acknowledgements,
+            disclosures and publisher boilerplate
+    window  clean, then keep the passages most relevant to the patient's
+            events within a token budget, in their original order
+
+Token counts are estimated at ~4 characters per token, which is close enough
+to compare modes and budgets without calling the tokenizer.
+"""
+import re
+
+from patient_matching import event_symbols, normalize_text
+
+TEXT_MODES = ('full', 'clean', 'window')
+CHARS_PER_TOKEN = 4
+MAX_PASSAGE_CHARS = 1500
+ELISION_MARKER = "[...]"
+
+SECTION_NAMES = {
+    'abstract': 'abstract',
+    'summary': 'abstract',
+    'background': 'introduction',
+    'introduction': 'introduction',
+    'methods': 'methods',
+    'materials and methods': 'methods',
+    'patients and methods': 'methods',
+    'methods and materials': 'methods',
+    'results': 'results',
+    'case report': 'results',
+    'case presentation': 'results',
+    'discussion': 'discussion',
+    'conclusion': 'conclusion',
+    'conclusions': 'conclusion',
+    'references': 'references',
+    'bibliography': 'references',
+    'literature cited': 'references',
+    'acknowledgements': 'acknowledgements',
+    'acknowledgments': 'acknowledgements',
+    'funding': 'acknowledgements',
+    'author contributions': 'disclosures',
+    'conflict of interest': 'disclosures',
+    'conflicts of interest': 'disclosures',
+    'competing interests': 'disclosures',
+    'disclosures': 'disclosures',
+    'data availability': 'disclosures',
+    'data availability statement': 'disclosures',
+    'supplementary material': 'supplementary',
+    'supplementary data': 'supplementary',
+}
+DROPPED_SECTIONS = {'references', 'acknowledgements', 'disclosures', 'supplementary'}
+# Sections kept ahead of any relevance ranking in window mode
+PINNED_SECTIONS = {'front', 'abstract'}
+
+HEADING_PATTERN = re.compile(
+    r'^\s*(?:\d+(?:\.\d+)*\.?\s+)?(' + '|'.join(sorted(map(re.escape, SECTION_NAMES), key=len, reverse=True)) + r')\s*:?\s*$',
+    re.IGNORECASE
+)
+BOILERPLATE_PATTERN = re.compile(
+    r'©|\bcopyright\b|all rights reserved|creative commons|this article is (?:licensed|distributed)|'
+    r'downloaded from|for personal use only|^\s*(?:doi|https?://)\S*\s*$',
+    re.IGNORECASE
+)
+QUERY_STOPWORDS = {'the', 'and', 'with', 'for', 'of', 'in', 'on', 'to', 'a', 'an', 'or', 'mutation', 'positive', 'negative'}
+
+
+def estimate_tokens(text):
+    return (len(text or '') + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_sections(text):
+    """Split article text into [(section, body)] on recognised heading lines; text before the first heading is 'front'."""
+    sections = []
+    name, lines = 'front', []
+    for line in (text or '').splitlines():
+        heading = HEADING_PATTERN.match(line)
+        if heading and len(line) < 60:
+            if any(l.strip() for l in lines):
+                sections.append((name, "\n".join(lines).strip()))
+            name, lines = SECTION_NAMES[heading.group(1).lower()], [line.strip()]
+        else:
+            lines.append(line)
+    if any(l.strip() for l in lines):
+        sections.append((name, "\n".join(lines).strip()))
+    return sections
+
+
+def split_passages(text):
+    """Split a section body into paragraphs, cutting very long ones at sentence boundaries."""
+    passages = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > MAX_PASSAGE_CHARS:
+            cut = paragraph.rfind('. ', 0, MAX_PASSAGE_CHARS)
+            cut = cut + 1 if cut > 0 else MAX_PASSAGE_CHARS
+            passages.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            passages.append(paragraph)
+    return passages
+
+
+def clean_sections(text):
+    """Sections with references, disclosures and boilerplate lines removed."""
+    kept = []
+    for name, body in split_sections(text):
+        if name in DROPPED_SECTIONS:
+            continue
+        body = "\n".join(line for line in body.splitlines() if not BOILERPLATE_PATTERN.search(line)).strip()
+        if body:
+            kept.append((name, body))
+    return kept
+
+
+def query_terms(disease, events_text):
+    """Gene/variant symbols and plain words from the patient's disease and events."""
+    symbols = set()
+    for event in (events_text or '').splitlines():
+        symbols |= event_symbols(event)
+    words = {
+        word for word in normalize_text(f"{disease or ''} {events_text or ''}").split()
+        if len(word) > 2 and word not in QUERY_STOPWORDS and word.upper() not in symbols
+    }
+    return symbols, words
+
+
+def passage_score(passage, symbols, words):
+    """Distinct query terms in a passage; gene and variant symbols weigh three times as much as words."""
+    passage_symbols = event_symbols(passage)
+    passage_words = set(normalize_text(passage).split())
+    return 3 * len(symbols & passage_symbols) + len(words & passage_words)
+
+
+def select_window(sections, disease, events_text, token_budget):
+    """Keep pinned passages, then the highest-scoring passages, until the budget is spent."""
+    symbols, words = query_terms(disease, events_text)
+    passages = [(name, passage) for name, body in sections for passage in split_passages(body)]
+    scored = [
+        (name not in PINNED_SECTIONS, -passage_score(passage, symbols, words), position)
+        for position, (name, passage) in enumerate(passages)
+    ]
+    kept, used = set(), 0
+    # Passages without any query term fill whatever budget is left, earliest first
+    for _, _, position in sorted(scored):
+        tokens = estimate_tokens(passages[position][1])
+        if used + tokens > token_budget:
+            continue
+        kept.add(position)
+        used += tokens
+    if not kept:
+        return "\n\n".join(body for _, body in sections)[:token_budget * CHARS_PER_TOKEN]
+
+    pieces, previous = [], -1
+    for position in sorted(kept):
+        if position != previous + 1:
+            pieces.append(ELISION_MARKER)
+        pieces.append(passages[position][1])
+        previous = position
+    if previous != len(passages) - 1:
+        pieces.append(ELISION_MARKER)
+    return "\n\n".join(pieces)
+
+
+def prepare_article_text(text, mode='full', disease=None, events_text=None, token_budget=6000):
+    """Return (prompt_text, report) for the selected mode; the report counts estimated tokens removed."""
+    text = text or ''
+    if mode not in TEXT_MODES:
+        raise ValueError(f"Unknown text mode: {mode}")
+    if mode == 'full':
+        prepared = text
+    else:
+        sections = clean_sections(text)
+        if mode == 'window' and sum(estimate_tokens(body) for _, body in sections) > token_budget:
+            prepared = select_window(sections, disease, events_text, token_budget)
+        else:
+            prepared = "\n\n".join(body for _, body in sections)
+        # Never send an empty article because the heading heuristics removed everything
+        if not prepared.strip():
+            prepared = text
+
+    original_tokens = estimate_tokens(text)
+    prompt_tokens = estimate_tokens(prepared)
+    return prepared, {
+        'mode': mode,
+        'original_tokens': original_tokens,
+        'prompt_tokens': prompt_tokens,
+        'removed_tokens': max(0, original_tokens - prompt_tokens),
+    }
@@ -0,0 +1,148 @@
+"""Offline batch pre-analysis of the article corpus.
+
+Runs the patient-independent extraction stage of the two-stage pipeline over
+every article in the corpus and writes the results as columnar part files
+keyed by PMID. Point PRECOMPUTED_EXTRACTIONS_PATH at the output directory and
+the interactive analyze-articles path only has to do patient matching.
+
+Usage:
+    python batch_extract.py --output ./extractions
+    python batch_extract.py --source corpus.jsonl --output ./extractions --workers 8
+    python batch_extract.py --source corpus.parquet --output ./extractions --limit 1000
+
+Sources are the BigQuery corpus table (default) or a local JSONL/Parquet
+export with `name` and `content` columns. Completed PMIDs are appended to a
+checkpoint file in the output directory, so an interrupted run resumes where
+it stopped.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import main
+from extraction_files import to_record, write_part
+
+logger = logging.getLogger(__name__)
+
+CORPUS_TABLE = "playground-439016.pmid_uscentral.pmid_embed_nonzero"
+CHECKPOINT_FILE = "_checkpoint.txt"
+
+
+def iter_bigquery_rows(table=CORPUS_TABLE, page_size=500):
+    """Stream (pmid, content) pairs from the corpus table page by page."""
+    rows = main.bq_client.list_rows(table, selected_fields=[
+        main.bigquery.SchemaField('name', 'STRING'),
+        main.bigquery.SchemaField('content', 'STRING'),
+    ], page_size=page_size)
+    for row in rows:
+        yield row['name'], row['content']
+
+
+def iter_local_rows(path):
+    """Stream (pmid, content) pairs from a JSONL or Parquet export."""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(columns=['name', 'content']):
+            for row in batch.to_pylist():
+                yield row['name'], row['content']
+    else:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row['name'], row['content']
+
+
+def load_checkpoint(output_dir):
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def run_batch(rows, output_dir, workers=4, flush_every=200, limit=None):
+    """Extract every not-yet-checkpointed article in rows and write part files to output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    done = load_checkpoint(output_dir)
+    logger.info(f"Resuming with {len(done)} PMIDs already extracted")
+
+    checkpoint = open(os.path.join(output_dir, CHECKPOINT_FILE), 'a')
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    buffer = []
+    parts = 0
+    submitted = 0
+    stats = {'extracted': 0, 'failed': 0, 'skipped': 0}
+
+    def flush():
+        nonlocal buffer, parts
+        if not buffer:
+            return
+        path = write_part(output_dir, f"part-{run_id}-{parts:05d}", buffer)
+        # Checkpoint only after the part holding these PMIDs is on disk
+        for record in buffer:
+            checkpoint.write(record['pmid'] + "\n")
+        checkpoint.flush()
+        logger.info(f"Wrote {len(buffer)} extractions to {path}")
+        buffer = []
+        parts += 1
+
+    def collect(futures):
+        for future in futures:
+            pmid = pending.pop(future)
+            try:
+                extraction = future.result()
+            except Exception as e:
+                logger.error(f"Extraction failed for {pmid}: {str(e)}")
+                extraction = None
+            if extraction is None:
+                stats['failed'] += 1
+                continue
+            stats['extracted'] += 1
+            buffer.append(to_record(pmid, extraction, main.EXTRACTION_PROMPT_VERSION, main.GEMINI_MODEL))
+            if len(buffer) >= flush_every:
+                flush()
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for pmid, content in rows:
+            pmid = str(pmid)
+            if pmid in done or not content:
+                stats['skipped'] += 1
+                continue
+            if limit is not None and submitted >= limit:
+                break
+            # Keep a bounded number of articles in flight so the corpus is never held in memory
+            if len(pending) >= workers * 2:
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(completed)
+            pending[executor.submit(main.extract_article, content, pmid)] = pmid
+            done.add(pmid)
+            submitted += 1
+        collect(list(pending))
+
+    flush()
+    checkpoint.close()
+    logger.info(f"Batch extraction finished: {stats}")
+    return stats
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Precompute patient-independent article extractions.")
+    parser.add_argument('--source', default='bigquery', help="'bigquery' or a path to a JSONL/Parquet export")
+    parser.add_argument('--output', required=True, help="Directory for part files and the checkpoint")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--flush-every', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=None, help="Maximum number of articles to extract in this run")
+    args = parser.parse_args()
+
+    rows = iter_bigquery_rows() if args.source == 'bigquery' else iter_local_rows(args.source)
+    run_batch(rows, args.output, args.workers, args.flush_every, args.limit)
+
+
+if __name__ == "__main__":
+    main_cli()
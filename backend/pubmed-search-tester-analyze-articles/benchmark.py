@@ -0,0 +1,506 @@
+"""Offline benchmark of the analyze-articles stream with stubbed Gemini and BigQuery.
+
+FakeGenaiClient and FakeBigQueryClient stand in for the cloud clients that
+main.py creates at import time. They answer from a synthetic corpus and a
+synthetic SJR table, with configurable latency and 429 injection. Every
+scenario (articles per request x concurrency) runs stream_response or
+stream_response_async end to end and records:
+
+  end-to-end time, time to the first analyzed article, articles per second,
+  peak traced memory, prompt-build and parse time (from the stream's metrics
+  summary), Gemini calls, 429s and failed articles.
+
+Results are written as a JSON report. Pass --baseline with an earlier report
+to print the change for each scenario.
+
+Usage:
+    python benchmark.py --output report.json
+    python benchmark.py --sizes 10,50 --concurrency 1,5,10 --latency 0.8 --error-rate 0.05 --output report.json
+    python benchmark.py --mode async --text-mode window --baseline previous.json --output report.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from context_cache import LocalCachesStub
+
+logger = logging.getLogger(__name__)
+
+CANCER_TYPES = ['acute myeloid leukemia', 'acute lymphoblastic leukemia', 'neuroblastoma', 'medulloblastoma', 'osteosarcoma']
+EVENTS = ['NRAS Q61K', 'KRAS G12D', 'FLT3-ITD', 'KMT2A::MLLT3', 'NPM1 mutation', 'TP53 R273H',
+          'ETV6::RUNX1', 'ALK F1174L', 'MYCN amplification', 'IDH1 R132H']
+PAPER_TYPES = ['clinical trial', 'review', 'case report', 'cohort study', 'preclinical study']
+FILLER = ("Patients were enrolled across participating centres and followed for event-free survival. "
+          "Samples were sequenced and variant allele frequencies were compared between cohorts. "
+          "Treatment response was assessed by minimal residual disease at the end of induction. ")
+
+DEFAULT_EVENTS_TEXT = "NRAS Q61K\nKMT2A::MLLT3"
+DEFAULT_DISEASE = "acute myeloid leukemia"
+
+
+def make_journal_table(count=500, seed=0):
+    """Synthetic SJR table rows: title, issn, sjr."""
+    rng = random.Random(seed)
+    return [
+        {
+            'title': f"Journal of Synthetic Oncology {i}",
+            'issn': f"{rng.randrange(10 ** 6, 10 ** 7)}X",
+            'sjr': round(rng.lognormvariate(0, 1.2), 3),
+        }
+        for i in range(count)
+    ]
+
+
+def make_article(pmid, rng, journals, article_chars):
+    """Synthetic article: a metadata header the fake model reads back, then sections padded to article_chars."""
+    journal = rng.choice(journals)
+    events = rng.sample(EVENTS, 2)
+    header = "\n".join([
+        f"Title: Study {pmid} of {events[0]} in {rng.choice(CANCER_TYPES)}",
+        f"Journal: {journal['title']}",
+        f"ISSN: {journal['issn']}",
+        f"Year: {rng.randint(2005, 2024)}",
+        f"Cancer: {rng.choice(CANCER_TYPES)}",
+        f"Paper type: {rng.choice(PAPER_TYPES)}",
+        f"Events: {'; '.join(events)}",
+    ])
+    sections = ['Abstract', 'Introduction', 'Methods', 'Results', 'Discussion']
+    body_chars = max(0, article_chars - len(header)) * 4 // 5
+    per_section = body_chars // len(sections)
+    parts = [header]
+    for section in sections:
+        text = (FILLER + f"The {events[rng.randrange(2)]} cohort was analysed separately. ") * (per_section // len(FILLER) + 1)
+        parts.append(f"{section}\n{text[:per_section]}")
+    references = "\n".join(
+        f"{i}. Author A, Author B. Reference {i}. {journal['title']}. {rng.randint(1990, 2024)};{rng.randint(1, 99)}:{rng.randint(1, 999)}."
+        for i in range(1, max(2, (article_chars - body_chars) // 90))
+    )
+    parts.append(f"References\n{references}")
+    return "\n\n".join(parts)
+
+
+def make_corpus(size, journals, article_chars=20000, seed=0):
+    """Synthetic corpus rows {'name', 'content'}, deterministic for a seed."""
+    rng = random.Random(seed)
+    return [{'name': str(30000000 + i), 'content': make_article(30000000 + i, rng, journals, article_chars)} for i in range(size)]
+
+
+class FakeRateLimitError(Exception):
+    """Injected quota error; looks like the SDK's 429 to rate_limiter.is_rate_limit_error."""
+
+    code = 429
+
+
+class FakeGeminiBackend:
+    """Latency, 429 injection and canned JSON shared by the sync and async fake clients."""
+
+    def __init__(self, latency=0.5, jitter=0.2, latency_per_1k_tokens=0.02, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.error_rate = error_rate
+        self.calls = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def begin_call(self, prompt):
+        """Seconds this call should take; raises an injected 429 instead with probability error_rate."""
+        with self._lock:
+            self.calls += 1
+            throttled = self._rng.random() < self.error_rate
+            if throttled:
+                self.throttled += 1
+            jitter = self._rng.uniform(0, self.jitter)
+        if throttled:
+            raise FakeRateLimitError("429 RESOURCE_EXHAUSTED: injected by benchmark")
+        return self.latency + jitter + self.latency_per_1k_tokens * len(prompt) / 4000
+
+    def respond(self, contents, config=None):
+        prompt = prompt_text(contents)
+        if '"event_matches"' in prompt:
+            body = matching_response(prompt)
+        else:
+            body = analysis_response(prompt, extraction='Do not consider any particular patient' in prompt)
+        text = json.dumps(body)
+        structured = config is not None and getattr(config, 'response_schema', None) is not None
+        if not structured:
+            text = f"```json\n{text}\n```"
+        cached = getattr(config, 'cached_content', None) if config is not None else None
+        prompt_tokens = len(prompt) // 4
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=len(text) // 4,
+            cached_content_token_count=1024 if cached else 0,
+            thoughts_token_count=None,
+            total_token_count=prompt_tokens + len(text) // 4,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+def prompt_text(contents):
+    if isinstance(contents, str):
+        return contents
+    parts = []
+    for content in contents:
+        for part in content.parts:
+            parts.append(part['text'] if isinstance(part, dict) else part.text)
+    return "\n".join(parts)
+
+
+def header_value(prompt, name):
+    match = re.search(rf'^{name}: (.*)$', prompt, re.MULTILINE)
+    return match.group(1).strip() if match else ''
+
+
+def analysis_response(prompt, extraction=False):
+    """article_metadata read back from the synthetic article header in the prompt."""
+    patient_context = prompt.split('<Article>')[0].lower()
+    events = [event for event in header_value(prompt, 'Events').split('; ') if event]
+    metadata = {
+        'title': header_value(prompt, 'Title'),
+        'year': header_value(prompt, 'Year'),
+        'journal_title': header_value(prompt, 'Journal'),
+        'journal_issn': header_value(prompt, 'ISSN'),
+        'cancer_focus': True,
+        'pediatric_focus': True,
+        'type_of_cancer': header_value(prompt, 'Cancer'),
+        'paper_type': header_value(prompt, 'Paper type'),
+        'drugs_tested': True,
+        'drug_results': ['partial response'],
+        'treatment_shown': False,
+        'cell_studies': False,
+        'mice_studies': False,
+        'case_report': False,
+        'series_of_case_reports': False,
+        'clinical_study': True,
+        'clinical_study_on_children': True,
+        'novelty': False,
+    }
+    if extraction:
+        metadata['actionable_events'] = events
+    else:
+        metadata['disease_match'] = metadata['type_of_cancer'].lower() in patient_context
+        metadata['actionable_events'] = [{'event': event, 'matches_query': event.lower() in patient_context} for event in events]
+    return {'article_metadata': metadata}
+
+
+def matching_response(prompt):
+    patient = prompt.split('Article title:')[0].lower()
+    article_events = re.findall(r'^\d+\. (.*)$', prompt.split('Article actionable events:')[-1], re.MULTILINE)
+    cancer = header_value(prompt, 'Article cancer type').lower()
+    return {'disease_match': bool(cancer) and cancer in patient, 'event_matches': [event.lower() in patient for event in article_events]}
+
+
+class FakeModels:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self.backend.begin_call(prompt_text(contents)))
+        return self.backend.respond(contents, config)
+
+    def embed_content(self, model, contents, config=None):
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=embed_text(text)) for text in contents])
+
+
+class FakeAsyncModels:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(self.backend.begin_call(prompt_text(contents)))
+        return self.backend.respond(contents, config)
+
+
+class FakeGenaiClient:
+    """Stand-in for genai.Client: models, aio.models and an in-process caches API."""
+
+    def __init__(self, backend):
+        self.models = FakeModels(backend)
+        self.aio = SimpleNamespace(models=FakeAsyncModels(backend))
+        self.caches = LocalCachesStub()
+
+
+def embed_text(text, dimensions=16):
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [byte / 255 for byte in digest[:dimensions]]
+
+
+class FakeQueryJob:
+    def __init__(self, rows, latency):
+        self.rows = rows
+        self.latency = latency
+
+    def result(self, page_size=None):
+        time.sleep(self.latency)
+        return self.rows
+
+
+class FakeBigQueryClient:
+    """Answers the queries main.py issues (VECTOR_SEARCH, content, snippets, embeddings, SJR) from synthetic data."""
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.corpus = {}
+        self.journals = []
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def load(self, corpus, journals):
+        self.corpus = {row['name']: row['content'] for row in corpus}
+        self.journals = journals
+
+    def query(self, query, job_config=None):
+        with self._lock:
+            self.queries += 1
+        parameters = {param.name: getattr(param, 'values', getattr(param, 'value', None))
+                      for param in getattr(job_config, 'query_parameters', None) or []}
+        if 'scimagojr' in query:
+            rows = self.journals
+        elif 'VECTOR_SEARCH' in query:
+            top_k = int(re.search(r'top_k\s*=>\s*(\d+)', query).group(1))
+            rows = [{'name': name, 'distance': 0.2 + 0.01 * rank} for rank, name in enumerate(list(self.corpus)[:top_k])]
+        elif 'ML.GENERATE_EMBEDDING' in query:
+            rows = [{'content': text, 'embedding': embed_text(text)} for text in parameters['texts']]
+        elif 'SUBSTR(content' in query:
+            rows = [{'name': pmid, 'content': self.corpus[pmid][:parameters['max_chars']]}
+                    for pmid in parameters['pmids'] if pmid in self.corpus]
+        elif 'UNNEST(@pmids)' in query:
+            rows = [{'name': pmid, 'content': self.corpus[pmid]} for pmid in parameters['pmids'] if pmid in self.corpus]
+        else:
+            raise ValueError(f"Benchmark BigQuery stub does not handle query: {query[:200]}")
+        return FakeQueryJob(rows, self.latency)
+
+
+def load_main(genai_client, bq_client):
+    """Import main.py with the cloud clients replaced by the fakes."""
+    from google import genai
+    from google.cloud import bigquery
+    os.environ.setdefault('CONTEXT_CACHE_BACKEND', 'local')
+    # The synthetic SJR table must not replace or be replaced by a real snapshot
+    snapshot_dir = tempfile.mkdtemp(prefix='benchmark-journals-')
+    os.environ['JOURNAL_SNAPSHOT_PATH'] = os.path.join(snapshot_dir, 'bundled.sqlite')
+    os.environ['JOURNAL_SNAPSHOT_CACHE_PATH'] = os.path.join(snapshot_dir, 'cache.sqlite')
+    real_genai, real_bigquery = genai.Client, bigquery.Client
+    genai.Client = lambda *args, **kwargs: genai_client
+    bigquery.Client = lambda *args, **kwargs: bq_client
+    try:
+        import main
+    finally:
+        genai.Client, bigquery.Client = real_genai, real_bigquery
+    return main
+
+
+def reset_state(main, vertex_rate):
+    """Fresh limiter, embedder, retrievers and caches, so scenarios do not warm each other up."""
+    import rate_limiter
+    rate_limiter.vertex_rate_limiter = rate_limiter.AdaptiveRateLimiter(
+        initial_rate=vertex_rate, max_rate=max(vertex_rate, rate_limiter.vertex_rate_limiter.max_rate), burst=max(5, int(vertex_rate))
+    )
+    main.query_embedder = main.create_query_embedder()
+    with main.retrievers_lock:
+        main.retrievers.clear()
+    main.analysis_cache = main.create_cache_from_env()
+    main.prefix_cache = main.create_prefix_cache(main.client, main.GEMINI_MODEL, backend='local')
+
+
+def run_stream(main, request_json, mode):
+    """Consume one stream; return (end-to-end seconds, seconds to first article, events)."""
+    options = main.parse_analysis_options(request_json)
+    args = (request_json['events_text'], request_json.get('methodology_content'), request_json.get('disease'), options)
+    start = time.perf_counter()
+    first = None
+    events = []
+
+    def collect(line):
+        nonlocal first
+        event = json.loads(line)
+        if first is None and event['type'] == 'article_analysis':
+            first = time.perf_counter() - start
+        events.append(event)
+
+    if mode == 'async':
+        async def consume():
+            async for line in main.stream_response_async(*args):
+                collect(line)
+        asyncio.run(consume())
+    else:
+        for line in main.stream_response(*args):
+            collect(line)
+    return time.perf_counter() - start, first, events
+
+
+def run_scenario(main, genai_backend, request_json, mode, repeat, vertex_rate, measure_memory):
+    """Run one scenario repeat times (plus a traced pass for memory) and summarise it."""
+    runs = []
+    for _ in range(repeat):
+        reset_state(main, vertex_rate)
+        calls, throttled = genai_backend.calls, genai_backend.throttled
+        elapsed, first, events = run_stream(main, request_json, mode)
+        summary = events[-1]['data'].get('metrics', {}) if events and events[-1]['type'] == 'metadata' else {}
+        analyzed = sum(1 for event in events if event['type'] == 'article_analysis')
+        runs.append({
+            'end_to_end_seconds': elapsed,
+            'time_to_first_article_seconds': first,
+            'analyzed': analyzed,
+            'failed': sum(1 for event in events if event['type'] == 'error'),
+            'gemini_calls': genai_backend.calls - calls,
+            'rate_limited': genai_backend.throttled - throttled,
+            'stages': summary.get('stages', {}),
+            'tokens': summary.get('tokens', {}),
+        })
+
+    peak_memory = None
+    if measure_memory:
+        # Tracing slows allocation down, so memory gets its own pass
+        reset_state(main, vertex_rate)
+        tracemalloc.start()
+        run_stream(main, request_json, mode)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def median(key):
+        values = [run[key] for run in runs if run[key] is not None]
+        return statistics.median(values) if values else None
+
+    def stage_seconds(stage):
+        return statistics.median(run['stages'].get(stage, {}).get('seconds', 0.0) for run in runs)
+
+    end_to_end = median('end_to_end_seconds')
+    last = runs[-1]
+    return {
+        'end_to_end_seconds': round(end_to_end, 4),
+        'time_to_first_article_seconds': None if median('time_to_first_article_seconds') is None else round(median('time_to_first_article_seconds'), 4),
+        'articles_per_second': round(last['analyzed'] / end_to_end, 3) if end_to_end else None,
+        'peak_memory_bytes': peak_memory,
+        'prompt_build_seconds': round(stage_seconds('prompt_build'), 4),
+        'parse_seconds': round(stage_seconds('parse'), 4),
+        'analyzed': last['analyzed'],
+        'failed': last['failed'],
+        'gemini_calls': last['gemini_calls'],
+        'rate_limited': last['rate_limited'],
+        'tokens': last['tokens'],
+        'stages': last['stages'],
+        'runs': [{key: run[key] for key in ('end_to_end_seconds', 'time_to_first_article_seconds', 'analyzed', 'failed')} for run in runs],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare_reports(report, baseline):
+    """Print the relative change of the timing metrics against a baseline report's matching scenarios."""
+    previous = {(r['mode'], r['articles'], r['concurrency']): r for r in baseline.get('results', [])}
+    for result in report['results']:
+        before = previous.get((result['mode'], result['articles'], result['concurrency']))
+        if before is None:
+            continue
+        changes = []
+        for key in ('end_to_end_seconds', 'time_to_first_article_seconds', 'prompt_build_seconds', 'parse_seconds', 'peak_memory_bytes'):
+            if before.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {100 * (result[key] - before[key]) / before[key]:+.1f}%")
+        print(f"{result['mode']} articles={result['articles']} concurrency={result['concurrency']}: {', '.join(changes)}")
+
+
+def run_benchmark(args):
+    genai_backend = FakeGeminiBackend(args.latency, args.jitter, args.latency_per_1k_tokens, args.error_rate, args.seed)
+    bq_client = FakeBigQueryClient(args.bq_latency)
+    journals = make_journal_table(args.journals, args.seed)
+    bq_client.load([], journals)
+    main = load_main(FakeGenaiClient(genai_backend), bq_client)
+    logging.getLogger().setLevel(args.log_level)
+    # Load the journal table up front so the first scenario does not pay for it
+    main.journal_store.index()
+
+    results = []
+    for size in args.sizes:
+        bq_client.load(make_corpus(size, journals, args.article_chars, args.seed), journals)
+        for concurrency in args.concurrency:
+            request_json = {
+                'events_text': args.events_text,
+                'disease': args.disease,
+                'concurrency': concurrency,
+                'top_k': size,
+                'bypass_cache': True,
+                'pipeline': args.pipeline,
+                'text_mode': args.text_mode,
+                'output_mode': args.output_mode,
+                'prerank': args.prerank,
+            }
+            logger.warning(f"Benchmarking {args.mode} stream: {size} articles, concurrency {concurrency}")
+            result = run_scenario(main, genai_backend, request_json, args.mode, args.repeat, args.vertex_rate, not args.no_memory)
+            results.append({'mode': args.mode, 'articles': size, 'concurrency': concurrency, **result})
+
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': results,
+    }
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the analyze-articles stream against stubbed Gemini and BigQuery.")
+    parser.add_argument('--sizes', type=parse_int_list, default=[10, 50], help="Articles per request, comma-separated")
+    parser.add_argument('--concurrency', type=parse_int_list, default=[1, 5, 10], help="Concurrency levels, comma-separated")
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.5, help="Base Gemini latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Extra uniform Gemini latency in seconds")
+    parser.add_argument('--latency-per-1k-tokens', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability of an injected 429 per Gemini call")
+    parser.add_argument('--bq-latency', type=float, default=0.2, help="Latency of each BigQuery job in seconds")
+    parser.add_argument('--vertex-rate', type=float, default=20.0, help="Initial rate limiter rate in requests per second")
+    parser.add_argument('--article-chars', type=int, default=20000)
+    parser.add_argument('--journals', type=int, default=500)
+    parser.add_argument('--pipeline', choices=['single', 'two_stage'], default='single')
+    parser.add_argument('--text-mode', default='full')
+    parser.add_argument('--output-mode', default='text')
+    parser.add_argument('--prerank', action='store_true')
+    parser.add_argument('--events-text', default=DEFAULT_EVENTS_TEXT)
+    parser.add_argument('--disease', default=DEFAULT_DISEASE)
+    parser.add_argument('--no-memory', action='store_true', help="Skip the traced pass that measures peak memory")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--baseline', default=None, help="Earlier report to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.warning(f"Wrote benchmark report to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare_reports(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main_cli()
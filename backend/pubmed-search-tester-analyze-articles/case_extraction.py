@@ -0,0 +1,191 @@
+"""Disease and typed actionable event extraction from patient case notes.
+
+One deterministic Gemini call returns {"disease", "events": [{"event", "type"}]}.
+Without Google Search grounding the output is constrained to CASE_SCHEMA;
+grounding cannot be combined with a response schema, so that path asks for
+raw JSON and parses it from the text. Results are cached under the hash of
+the whitespace-normalised case notes together with the prompt and settings.
+
+Shared by the extract-case function and the analyze-articles case pipeline;
+keep the copies identical.
+"""
+import hashlib
+import json
+import logging
+import re
+
+from google.genai import types
+
+from analysis_cache import make_cache_key
+from rate_limiter import call_with_rate_limit
+
+logger = logging.getLogger(__name__)
+
+CASE_PROMPT_VERSION = "v1"
+
+EVENT_TYPES = ['fusion', 'mutation', 'copy_number', 'marker', 'disease_status', 'therapy', 'disease_location', 'response', 'other']
+
+CASE_SCHEMA = types.Schema(
+    type='OBJECT',
+    properties={
+        'disease': types.Schema(type='STRING'),
+        'events': types.Schema(type='ARRAY', items=types.Schema(
+            type='OBJECT',
+            properties={
+                'event': types.Schema(type='STRING'),
+                'type': types.Schema(type='STRING', enum=EVENT_TYPES),
+            },
+            required=['event', 'type'],
+            property_ordering=['event', 'type'],
+        )),
+    },
+    required=['disease', 'events'],
+    property_ordering=['disease', 'events'],
+)
+
+DISEASE_INSTRUCTIONS = """Disease Extraction:
+
+Identify the primary disease the patient is diagnosed with and/or being treated for. Extract this disease name exactly as it is written in the notes. It should be the initial diagnosis.
+
+Examples:
+"A now almost 4-year-old female diagnosed with KMT2A-rearranged AML and CNS2 involvement..." -> AML
+"18 y/o boy, diagnosed in November 2021 with T-ALL with CNS1..." -> T-ALL
+"A 10-year-old patient with relapsed B-cell acute lymphoblastic leukemia (B-ALL) presented..." -> B-cell acute lymphoblastic leukemia (B-ALL)"""
+
+DEFAULT_EVENTS_INSTRUCTIONS = """Actionable Event Extraction:
+
+Identify all clinically relevant and actionable events, such as:
+* Specific genetic mutations or fusions, for example "KMT2A::MLLT3 fusion", "NRAS (p.Gln61Lys) mutation"
+* Immunophenotype data, for example "positive CD33", "positive CD123"
+* Disease status, for example "relapsed after HSCT", "refractory to protocol"
+* Specific therapies, for example "revumenib", "FLAG-Mylotarg"
+* Disease location, for example "CNS2 involvement", "femoral extramedullary disease"
+* Response to therapy, for example "MRD reduction to 0.1%"
+
+Focus on information that is directly relevant to potential therapy selection or clinical management. Avoid vague or redundant information like "very good clinical condition"."""
+
+
+def create_case_prompt(text, events_prompt=None):
+    """Single prompt asking for the disease and the typed actionable events as one JSON object."""
+    return f"""You are an expert pediatric oncologist and chair of the International Leukemia Tumor Board (iLTB). Analyze the patient case notes below and extract the primary disease and the actionable events.
+
+{DISEASE_INSTRUCTIONS}
+
+{events_prompt or DEFAULT_EVENTS_INSTRUCTIONS}
+
+Output format:
+Return a JSON object {{"disease": "...", "events": [{{"event": "...", "type": "..."}}]}} where disease is the disease name exactly as written in the case notes and each event is one actionable event, written as a short search term, with type one of: {', '.join(EVENT_TYPES)}.
+Return only the JSON object, with no other text or formatting. This output format replaces any other output format given above.
+
+Case notes:
+{text}"""
+
+
+def case_config(grounding=False):
+    """Deterministic config; schema-constrained JSON on the fast path, Google Search grounding otherwise."""
+    if grounding:
+        # Grounding cannot be combined with a response schema, so the JSON is parsed from text
+        structured = {'tools': [types.Tool(google_search=types.GoogleSearch())]}
+    else:
+        structured = {'response_mime_type': 'application/json', 'response_schema': CASE_SCHEMA}
+    return types.GenerateContentConfig(
+        **structured,
+        temperature=0,
+        top_p=0.95,
+        candidate_count=1,
+        max_output_tokens=2048,
+        response_modalities=["TEXT"],
+        safety_settings=[
+            types.SafetySetting(category=cat, threshold="OFF")
+            for cat in ["HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_DANGEROUS_CONTENT",
+                      "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_HARASSMENT"]
+        ]
+    )
+
+
+def normalize_case_notes(text):
+    """Whitespace-normalised case notes, so pasted copies of the same notes share a cache entry."""
+    return "\n".join(re.sub(r'\s+', ' ', line).strip() for line in text.strip().splitlines() if line.strip())
+
+
+def normalize_event(item):
+    """{'event', 'type'} from a typed event or a bare string; None if there is no event text."""
+    if isinstance(item, str):
+        item = {'event': item}
+    if not isinstance(item, dict) or not isinstance(item.get('event'), str):
+        return None
+    event = item['event'].strip().strip('"').strip()
+    if not event:
+        return None
+    event_type = str(item.get('type') or 'other').strip().lower()
+    return {'event': event, 'type': event_type if event_type in EVENT_TYPES else 'other'}
+
+
+def parse_case_extraction(response_text):
+    """Parse and normalise an extraction response; None if it has no disease or is not JSON."""
+    text = (response_text or '').strip()
+    fenced = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    elif '{' in text and '}' in text:
+        text = text[text.find('{'):text.rfind('}') + 1]
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError as e:
+        logger.error(f"Case extraction JSON parse error at position {e.pos}: {e.msg}")
+        return None
+    if not isinstance(result, dict) or not isinstance(result.get('disease'), str) or not result['disease'].strip():
+        logger.error("Case extraction response is missing the disease")
+        return None
+
+    events = []
+    seen = set()
+    for item in result.get('events') or []:
+        event = normalize_event(item)
+        if event and event['event'].lower() not in seen:
+            seen.add(event['event'].lower())
+            events.append(event)
+    return {'disease': result['disease'].strip(), 'events': events}
+
+
+def events_query_text(extraction):
+    """Retrieval query for an extraction: the disease, then one event per line."""
+    return "\n".join([extraction['disease']] + [item['event'] for item in extraction['events']])
+
+
+def extract_case(client, cache, model, text, events_prompt=None, grounding=False, use_cache=True, deadline=None, on_response=None):
+    """Extract the disease and events from case notes with one Gemini call; returns (extraction, cached).
+
+    use_cache=False skips the cache lookup; the fresh extraction is still cached. on_response,
+    if given, is called with the raw Gemini response (for usage metrics).
+    """
+    notes = normalize_case_notes(text)
+    cache_key = make_cache_key(
+        case_notes_sha256=hashlib.sha256(notes.encode('utf-8')).hexdigest(),
+        events_prompt=events_prompt or '',
+        grounding=grounding,
+        model=model,
+        prompt_version=CASE_PROMPT_VERSION,
+    )
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info("Case extraction cache hit")
+            return json.loads(cached), True
+
+    # Generate response using Gemini through the shared rate limiter
+    response = call_with_rate_limit(
+        lambda: client.models.generate_content(
+            model=model,
+            contents=[types.Content(role="user", parts=[{"text": create_case_prompt(notes, events_prompt)}])],
+            config=case_config(grounding),
+        ),
+        deadline=deadline,
+    )
+    if on_response is not None:
+        on_response(response)
+    extraction = parse_case_extraction(response.text)
+    if extraction is None:
+        raise ValueError("Could not extract the disease and events from the case notes")
+    cache.set(cache_key, json.dumps(extraction))
+    return extraction, False
@@ -0,0 +1,132 @@
+"""Vertex AI context caching for the static prefix shared by article prompts.
+
+Every article prompt in a request starts with the same methodology, patient
+context and schema description. PromptPrefixCache creates one cached-content
+entry per distinct prefix and model, reuses it across articles and requests
+until shortly before it expires, and returns None whenever caching is not
+possible (prefix below the minimum size, creation failure), in which case
+the caller sends the full prompt. Vertex AI only caches content of at least
+4096 tokens for the models used here; the shared prefix of a typical request
+is well below that, so caching is opt-in (CONTEXT_CACHE_BACKEND) and pays off
+only for methodologies long enough to pass the minimum.
+
+LocalCachesStub implements the part of client.caches used here, so the
+caching path can be exercised without Vertex AI.
+"""
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+
+
+class LocalCachesStub:
+    """In-process stand-in for client.caches: create(), get() and delete() by name."""
+
+    def __init__(self):
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def create(self, model, config=None):
+        name = f"cachedContents/local-{uuid.uuid4().hex[:12]}"
+        entry = SimpleNamespace(name=name, model=model, contents=config.contents, ttl=config.ttl)
+        with self._lock:
+            self.entries[name] = entry
+        return entry
+
+    def get(self, name):
+        with self._lock:
+            if name not in self.entries:
+                raise KeyError(f"Cached content not found: {name}")
+            return self.entries[name]
+
+    def delete(self, name):
+        with self._lock:
+            self.entries.pop(name, None)
+
+
+class PromptPrefixCache:
+    """Maps prompt prefixes to cached-content names, creating each entry once."""
+
+    def __init__(self, caches, model, ttl_seconds=3600, min_tokens=4096, refresh_margin_seconds=60):
+        self.caches = caches
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def key(self, prefix):
+        return hashlib.sha256(f"{self.model}\n{prefix}".encode('utf-8')).hexdigest()
+
+    def applies(self, prefix):
+        """Whether prefix is long enough to be cached."""
+        return (len(prefix) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN >= self.min_tokens
+
+    def get(self, prefix):
+        """Cached-content name for prefix, or None if the full prompt should be sent instead."""
+        if not self.applies(prefix):
+            with self._lock:
+                self.skipped += 1
+            return None
+
+        key = self.key(prefix)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Concurrent articles of one request wait for a single creation
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires_at'] - self.refresh_margin_seconds > time.monotonic():
+                with self._lock:
+                    self.reused += 1
+                return entry['name']
+            try:
+                cached = self.caches.create(
+                    model=self.model,
+                    config=types.CreateCachedContentConfig(
+                        contents=[types.Content(role="user", parts=[types.Part(text=prefix)])],
+                        ttl=f"{int(self.ttl_seconds)}s",
+                        display_name=f"prompt-prefix-{key[:12]}",
+                    ),
+                )
+            except Exception as e:
+                logger.warning(f"Context cache creation failed, sending full prompts: {str(e)}")
+                with self._lock:
+                    self.failed += 1
+                return None
+            self._entries[key] = {'name': cached.name, 'expires_at': time.monotonic() + self.ttl_seconds}
+            with self._lock:
+                self.created += 1
+            logger.info(f"Created context cache {cached.name} for a {len(prefix)} character prompt prefix")
+            return cached.name
+
+    def invalidate(self, prefix):
+        """Forget the entry for prefix, e.g. after the service reported it missing."""
+        with self._lock:
+            self._entries.pop(self.key(prefix), None)
+
+    def stats(self):
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused, 'skipped': self.skipped, 'failed': self.failed}
+
+
+def create_prefix_cache(client, model, backend='vertex', ttl_seconds=3600, min_tokens=4096):
+    """PromptPrefixCache over the Vertex caches API ('vertex'), the local stub ('local'), or None ('none')."""
+    if backend == 'vertex':
+        return PromptPrefixCache(client.caches, model, ttl_seconds, min_tokens)
+    if backend == 'local':
+        return PromptPrefixCache(LocalCachesStub(), model, ttl_seconds, min_tokens)
+    return None
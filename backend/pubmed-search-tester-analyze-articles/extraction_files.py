@@ -0,0 +1,79 @@
+"""Columnar files of precomputed article extractions, keyed by PMID.
+
+The batch job writes part files into a directory; the interactive function
+reads them back into a PMID -> extraction dict. Parquet is used when pyarrow
+is installed, otherwise parts are written as JSONL with the same columns.
+"""
+import json
+import logging
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Scalar columns stored next to the full extraction JSON for cheap filtering
+SCALAR_COLUMNS = ['title', 'year', 'journal_title', 'type_of_cancer', 'paper_type']
+
+
+def to_record(pmid, extraction, prompt_version, model):
+    record = {
+        'pmid': str(pmid),
+        'prompt_version': prompt_version,
+        'model': model,
+        'extraction': json.dumps(extraction),
+    }
+    for column in SCALAR_COLUMNS:
+        value = extraction.get(column)
+        record[column] = None if value is None else str(value)
+    return record
+
+
+def write_part(directory, part_name, records):
+    """Write one part file of extraction records and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    if pa is not None:
+        path = os.path.join(directory, f"{part_name}.parquet")
+        pq.write_table(pa.Table.from_pylist(records), path)
+    else:
+        path = os.path.join(directory, f"{part_name}.jsonl")
+        with open(path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    return path
+
+
+def iter_records(directory):
+    """Yield extraction records from every part file in a directory."""
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith('.parquet'):
+            if pq is None:
+                logger.error(f"Skipping {path}: pyarrow is not installed")
+                continue
+            for batch in pq.ParquetFile(path).iter_batches():
+                yield from batch.to_pylist()
+        elif name.endswith('.jsonl'):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def read_extractions(directory, prompt_version=None, model=None):
+    """Load a PMID -> extraction dict, keeping only records for the given prompt version and model."""
+    extractions = {}
+    if not directory or not os.path.isdir(directory):
+        return extractions
+    for record in iter_records(directory):
+        if prompt_version and record.get('prompt_version') != prompt_version:
+            continue
+        if model and record.get('model') != model:
+            continue
+        extractions[record['pmid']] = json.loads(record['extraction'])
+    return extractions
@@ -0,0 +1,185 @@
+"""Analysis runs as resumable jobs with their events persisted to SQLite.
+
+A job consumes an analysis stream in a background thread and stores every
+event under an increasing id, so the work carries on when the client
+disconnects. Clients follow a job from the last event id they saw: stored
+events are replayed first, then new ones are sent as they arrive. Submitting
+a request whose key matches a running job attaches to that job instead of
+starting another.
+
+The store is a local SQLite file, so a job can only be resumed on the
+instance running it. Jobs left 'running' by an earlier process can no longer
+make progress; they are marked 'interrupted' at startup, their stored events
+can still be replayed, and a resubmission starts a new job.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted'
+
+
+class JobStore:
+    """Jobs and their numbered events in a single SQLite file."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY, request_key TEXT NOT NULL, status TEXT NOT NULL,
+                created REAL NOT NULL, updated REAL NOT NULL, last_event_id INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                job_id TEXT NOT NULL, event_id INTEGER NOT NULL, event TEXT NOT NULL,
+                PRIMARY KEY (job_id, event_id)
+            );
+        """)
+        self._conn.commit()
+
+    def create(self, job_id, request_key):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT INTO jobs (job_id, request_key, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                               (job_id, request_key, RUNNING, now, now))
+            self._conn.commit()
+
+    def append(self, job_id, event_id, event):
+        with self._lock:
+            self._conn.execute("INSERT INTO events (job_id, event_id, event) VALUES (?, ?, ?)", (job_id, event_id, event))
+            self._conn.execute("UPDATE jobs SET last_event_id = ?, updated = ? WHERE job_id = ?", (event_id, time.time(), job_id))
+            self._conn.commit()
+
+    def set_status(self, job_id, status):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE job_id = ?", (status, time.time(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, status, created, updated, last_event_id FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'job_id': row[0], 'status': row[1], 'created': row[2], 'updated': row[3], 'last_event_id': row[4]}
+
+    def events_after(self, job_id, after_id, limit=500):
+        """Up to limit (event id, event JSON) pairs with ids above after_id, in order."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT event_id, event FROM events WHERE job_id = ? AND event_id > ? ORDER BY event_id LIMIT ?",
+                (job_id, after_id, limit)
+            ).fetchall()
+
+    def mark_interrupted(self):
+        with self._lock:
+            count = self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE status = ?",
+                                       (INTERRUPTED, time.time(), RUNNING)).rowcount
+            self._conn.commit()
+        return count
+
+    def purge(self, older_than):
+        """Delete finished jobs last updated before older_than, with their events."""
+        with self._lock:
+            self._conn.execute("DELETE FROM events WHERE job_id IN (SELECT job_id FROM jobs WHERE status != ? AND updated < ?)",
+                               (RUNNING, older_than))
+            count = self._conn.execute("DELETE FROM jobs WHERE status != ? AND updated < ?", (RUNNING, older_than)).rowcount
+            self._conn.commit()
+        return count
+
+
+class ActiveJob:
+    """A job running in this process; followers wait on its condition for new events."""
+
+    def __init__(self, job_id, request_key):
+        self.job_id = job_id
+        self.request_key = request_key
+        self.last_event_id = 0
+        self.done = False
+        self.condition = threading.Condition()
+
+
+class JobManager:
+    """Runs analysis streams as jobs and lets clients follow them from any event id."""
+
+    def __init__(self, store, retention_seconds=24 * 3600, heartbeat_seconds=15):
+        self.store = store
+        self.retention_seconds = retention_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._active = {}
+        self._lock = threading.Lock()
+        interrupted = store.mark_interrupted()
+        if interrupted:
+            logger.warning(f"Marked {interrupted} jobs of an earlier process as interrupted")
+
+    def submit(self, request_key, stream_factory):
+        """Start a job running stream_factory(), or attach to the running job with the same key; returns (job_id, attached)."""
+        with self._lock:
+            for job in self._active.values():
+                if job.request_key == request_key and not job.done:
+                    logger.info(f"Attaching duplicate submission to running job {job.job_id}")
+                    return job.job_id, True
+            job = ActiveJob(uuid.uuid4().hex, request_key)
+            self.store.create(job.job_id, request_key)
+            self._active[job.job_id] = job
+        threading.Thread(target=self._run, args=(job, stream_factory), name=f"analysis-job-{job.job_id[:8]}", daemon=True).start()
+        purged = self.store.purge(time.time() - self.retention_seconds)
+        if purged:
+            logger.info(f"Purged {purged} finished jobs")
+        return job.job_id, False
+
+    def _run(self, job, stream_factory):
+        status = COMPLETE
+        try:
+            for line in stream_factory():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                event['id'] = job.last_event_id + 1
+                self.store.append(job.job_id, event['id'], json.dumps(event))
+                with job.condition:
+                    job.last_event_id = event['id']
+                    job.condition.notify_all()
+        except Exception as e:
+            status = FAILED
+            logger.error(f"Job {job.job_id} failed: {str(e)}")
+        finally:
+            self.store.set_status(job.job_id, status)
+            with job.condition:
+                job.done = True
+                job.condition.notify_all()
+            with self._lock:
+                self._active.pop(job.job_id, None)
+            logger.info(f"Job {job.job_id} finished with status {status} after {job.last_event_id} events")
+
+    def status(self, job_id):
+        return self.store.get(job_id)
+
+    def follow(self, job_id, after_id=0):
+        """Yield the job's events after after_id as NDJSON lines until it finishes, with blank keep-alive lines while waiting."""
+        job = self._active.get(job_id)
+        while True:
+            # Read the done flag first, so events stored just before the job finished are not missed
+            done = job is None or job.done
+            rows = self.store.events_after(job_id, after_id)
+            for event_id, event in rows:
+                yield event + "\n"
+                after_id = event_id
+            if rows:
+                continue
+            if done:
+                return
+            with job.condition:
+                job.condition.wait_for(lambda: job.last_event_id > after_id or job.done, timeout=self.heartbeat_seconds)
+                waiting = job.last_event_id <= after_id and not job.done
+            if waiting:
+                yield "\n"
@@ -0,0 +1,157 @@
+"""Local journal title index used to resolve SJR scores for extracted journal titles.
+
+Titles are normalised (case, accents, punctuation, stopwords) and common
+NLM/ISO4 abbreviations are expanded, so "J Clin Oncol" and "Journal of
+Clinical Oncology" share one key. Lookups try the ISSN, then the exact
+normalised title, then a trigram similarity fallback.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+# Common NLM/ISO4 title word abbreviations, expanded before matching
+ABBREVIATIONS = {
+    'acad': 'academy',
+    'adv': 'advances',
+    'am': 'american',
+    'ann': 'annals',
+    'biochem': 'biochemistry',
+    'biol': 'biology',
+    'br': 'british',
+    'chem': 'chemistry',
+    'clin': 'clinical',
+    'commun': 'communications',
+    'curr': 'current',
+    'dis': 'disease',
+    'eur': 'european',
+    'exp': 'experimental',
+    'genet': 'genetics',
+    'haematol': 'haematology',
+    'hematol': 'hematology',
+    'immunol': 'immunology',
+    'int': 'international',
+    'j': 'journal',
+    'lett': 'letters',
+    'med': 'medicine',
+    'mol': 'molecular',
+    'natl': 'national',
+    'oncol': 'oncology',
+    'pathol': 'pathology',
+    'pediatr': 'pediatric',
+    'pharmacol': 'pharmacology',
+    'proc': 'proceedings',
+    'rep': 'reports',
+    'res': 'research',
+    'rev': 'reviews',
+    'sci': 'science',
+    'ther': 'therapy',
+    'transl': 'translational',
+}
+
+# Widely used acronyms that do not follow from abbreviation expansion
+COMMON_ALIASES = {
+    'nejm': 'new england journal medicine',
+    'n engl j med': 'new england journal medicine',
+    'jco': 'journal clinical oncology',
+    'pnas': 'proceedings national academy sciences united states america',
+    'jama': 'jama',
+}
+
+STOPWORDS = {'the', 'of', 'and', 'for', 'in', 'on', 'de', 'la'}
+
+
+def normalize_title(title):
+    """Normalise a journal title into a canonical matching key."""
+    if not title:
+        return ''
+    text = unicodedata.normalize('NFKD', str(title))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    text = text.replace('&', ' and ')
+    text = re.sub(r'[^a-z0-9]+', ' ', text).strip()
+    if text in COMMON_ALIASES:
+        return COMMON_ALIASES[text]
+    words = [ABBREVIATIONS.get(word, word) for word in text.split()]
+    return ' '.join(word for word in words if word not in STOPWORDS)
+
+
+def normalize_issn(issn):
+    """Normalise an ISSN to its 8 character form without hyphen."""
+    if not issn:
+        return ''
+    value = re.sub(r'[^0-9Xx]', '', str(issn)).upper()
+    return value if len(value) == 8 else ''
+
+
+def split_issns(value):
+    """Split the SCImago comma-separated ISSN column into normalised ISSNs."""
+    if not value:
+        return []
+    return [issn for issn in (normalize_issn(part) for part in str(value).split(',')) if issn]
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class JournalIndex:
+    """In-memory index from journal titles and ISSNs to SJR scores."""
+
+    def __init__(self, min_similarity=0.75):
+        self.min_similarity = min_similarity
+        self._by_title = {}
+        self._by_issn = {}
+        self._trigram_postings = defaultdict(set)
+        self._keys = []
+        self._gram_counts = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, title, sjr, issns=()):
+        """Add a journal. The first entry wins for duplicate keys (input is ordered by SJR desc)."""
+        key = normalize_title(title)
+        if not key:
+            return
+        entry = (title, float(sjr or 0))
+        if key not in self._by_title:
+            self._by_title[key] = entry
+            key_id = len(self._keys)
+            self._keys.append(key)
+            grams = trigrams(key)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._trigram_postings[gram].add(key_id)
+        for issn in issns:
+            self._by_issn.setdefault(normalize_issn(issn), entry)
+
+    def lookup(self, title=None, issn=None):
+        """Return (matched_title, sjr) for the best match, or None if nothing is similar enough."""
+        for value in split_issns(issn):
+            if value in self._by_issn:
+                return self._by_issn[value]
+
+        key = normalize_title(title)
+        if not key:
+            return None
+        if key in self._by_title:
+            return self._by_title[key]
+        return self._fuzzy_lookup(key)
+
+    def _fuzzy_lookup(self, key):
+        query_grams = trigrams(key)
+        overlap = defaultdict(int)
+        for gram in query_grams:
+            for key_id in self._trigram_postings.get(gram, ()):
+                overlap[key_id] += 1
+
+        best_id, best_score = None, 0.0
+        for key_id, shared in overlap.items():
+            # Dice coefficient over trigram sets
+            score = 2 * shared / (len(query_grams) + self._gram_counts[key_id])
+            if score > best_score:
+                best_id, best_score = key_id, score
+
+        if best_id is None or best_score < self.min_similarity:
+            return None
+        return self._by_title[self._keys[best_id]]
@@ -0,0 +1,258 @@
+"""On-disk snapshot of the SCImago journal table, loaded lazily into a JournalIndex.
+
+The journal table is stored as a small SQLite file. A snapshot can be bundled
+with the function source (build it before deploying) or written by the
+instance itself to a writable cache path. JournalImpactStore loads the
+newest valid snapshot on first use instead of querying BigQuery at import.
+It refreshes from BigQuery in a background thread once the snapshot is older
+than the maximum age, and only blocks on BigQuery when no snapshot exists
+at all.
+
+Each snapshot records its format, source table, creation time and a
+checksum of its rows; together they make up its version. A snapshot of
+another format or table is ignored.
+
+No snapshot is kept in the repository; build one into the function source
+as part of each deploy, with credentials that can read the journal table:
+    cd backend/pubmed-search-tester-analyze-articles
+    python journal_snapshot.py build --output journal_impact.sqlite
+    python journal_snapshot.py info --path journal_impact.sqlite
+    gcloud functions deploy ... --source .
+Without it, the first request on each instance waits for the BigQuery fetch
+(and requests arriving meanwhile wait with it).
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from google.cloud import bigquery
+
+from journal_index import JournalIndex, split_issns
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_TABLE = "gemini-med-lit-review.journal_rank.scimagojr_2023"
+SNAPSHOT_FORMAT = '1'
+
+
+def fetch_journal_rows(bq_client, table=JOURNAL_TABLE):
+    """(title, issn, sjr) rows of the journal table, highest SJR first."""
+    query = f"""
+    SELECT
+      `title`,
+      `issn`,
+      `sjr`
+    FROM
+      `{table}`
+    ORDER BY
+      sjr DESC
+    """
+    return [(row['title'], row['issn'], row['sjr']) for row in bq_client.query(query).result()]
+
+
+def rows_checksum(rows):
+    digest = hashlib.sha256()
+    for title, issn, sjr in rows:
+        digest.update(f"{title}\t{issn}\t{sjr}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_snapshot(path, rows, source_table=JOURNAL_TABLE):
+    """Write rows to a SQLite snapshot, replacing any existing file atomically; return the snapshot's metadata."""
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'source_table': source_table,
+        'created_at': str(int(time.time())),
+        'rows': str(len(rows)),
+        'checksum': rows_checksum(rows),
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    conn = sqlite3.connect(temp_path)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("CREATE TABLE journals (position INTEGER PRIMARY KEY, title TEXT, issn TEXT, sjr REAL)")
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+            conn.executemany("INSERT INTO journals VALUES (?, ?, ?, ?)",
+                             ((position, title, issn, sjr) for position, (title, issn, sjr) in enumerate(rows)))
+    finally:
+        conn.close()
+    # Readers either see the previous snapshot or the complete new one
+    os.replace(temp_path, path)
+    return meta
+
+
+def read_snapshot_meta(path, source_table=JOURNAL_TABLE):
+    """A snapshot's metadata, or None if it is missing, unreadable, or of another format or table."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Ignoring unreadable journal snapshot {path}: {str(e)}")
+        return None
+    if meta.get('format') != SNAPSHOT_FORMAT or meta.get('source_table') != source_table:
+        logger.warning(f"Ignoring journal snapshot {path} with format {meta.get('format')} of {meta.get('source_table')}")
+        return None
+    return meta
+
+
+def read_snapshot_rows(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT title, issn, sjr FROM journals ORDER BY position").fetchall()
+    finally:
+        conn.close()
+
+
+def snapshot_version(meta):
+    return f"{meta['source_table']}@{meta['created_at']}#{meta['checksum'][:12]}"
+
+
+def build_index(rows):
+    index = JournalIndex()
+    for title, issn, sjr in rows:
+        index.add(title, sjr, split_issns(issn))
+    return index
+
+
+class JournalImpactStore:
+    """Lazily loaded JournalIndex backed by bundled or cached snapshots, refreshed in the background."""
+
+    def __init__(self, fetch_rows, bundled_path=None, cache_path=None, max_age_seconds=7 * 24 * 3600,
+                 refresh=True, retry_seconds=300, source_table=JOURNAL_TABLE):
+        self.fetch_rows = fetch_rows
+        self.bundled_path = bundled_path
+        self.cache_path = cache_path
+        self.max_age_seconds = max_age_seconds
+        self.refresh_enabled = refresh
+        self.retry_seconds = retry_seconds
+        self.source_table = source_table
+        self._index = None
+        self._meta = None
+        self._source = None
+        self._last_failure = None
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def index(self):
+        """The current JournalIndex, loading a snapshot on first use and starting a refresh when it is stale."""
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._load()
+        if self.refresh_enabled and self._needs_refresh():
+            self.refresh()
+        return self._index
+
+    def _load(self):
+        candidates = []
+        for source, path in (('bundled', self.bundled_path), ('cache', self.cache_path)):
+            meta = read_snapshot_meta(path, self.source_table)
+            if meta:
+                candidates.append((int(meta['created_at']), source, path, meta))
+        if candidates:
+            _, source, path, meta = max(candidates)
+            start = time.monotonic()
+            self._install(build_index(read_snapshot_rows(path)), meta, source)
+            logger.info(f"Loaded {meta['rows']} journal impact records from {source} snapshot "
+                        f"{snapshot_version(meta)} in {time.monotonic() - start:.2f}s")
+            return
+        # No snapshot on disk: this is the only case that waits for BigQuery. _index stays None until the
+        # fetch finishes, so concurrent callers wait on the lock instead of scoring with an empty index.
+        logger.warning("No journal snapshot found, fetching the journal table from BigQuery")
+        self._refresh()
+        if self._index is None:
+            # BigQuery failed as well: score without SJR until a retry succeeds
+            self._index = JournalIndex()
+
+    def _install(self, index, meta, source):
+        self._meta = meta
+        self._source = source
+        # Set last: index() reads _index without the lock
+        self._index = index
+
+    def _needs_refresh(self):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return False
+        if self._last_failure is not None and time.time() - self._last_failure < self.retry_seconds:
+            return False
+        if self._meta is None:
+            return True
+        return time.time() - int(self._meta['created_at']) > self.max_age_seconds
+
+    def refresh(self, wait=False):
+        """Re-fetch the table from BigQuery in a background thread (or inline with wait=True)."""
+        if wait:
+            self._refresh()
+            return
+        with self._refresh_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh, name='journal-snapshot-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh(self):
+        try:
+            rows = self.fetch_rows()
+            index = build_index(rows)
+            meta = None
+            if self.cache_path:
+                try:
+                    meta = write_snapshot(self.cache_path, rows, self.source_table)
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning(f"Could not write journal snapshot {self.cache_path}: {str(e)}")
+            if meta is None:
+                meta = {'source_table': self.source_table, 'created_at': str(int(time.time())),
+                        'rows': str(len(rows)), 'checksum': rows_checksum(rows)}
+            self._install(index, meta, 'bigquery')
+            self._last_failure = None
+            logger.info(f"Refreshed {len(rows)} journal impact records, snapshot {snapshot_version(meta)}")
+        except Exception as e:
+            # Keep serving the previous snapshot; retry after retry_seconds
+            self._last_failure = time.time()
+            logger.error(f"Error refreshing journal impact data: {str(e)}")
+
+    def info(self):
+        """Version, size, origin and age of the snapshot in use, for responses and logs."""
+        meta = self._meta
+        if meta is None:
+            return {'version': None, 'rows': 0, 'source': None, 'age_seconds': None}
+        return {
+            'version': snapshot_version(meta),
+            'rows': int(meta['rows']),
+            'source': self._source,
+            'age_seconds': int(time.time() - int(meta['created_at'])),
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or inspect a journal impact snapshot.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('--output', default='journal_impact.sqlite')
+    build_parser.add_argument('--project', default='playground-439016')
+    build_parser.add_argument('--table', default=JOURNAL_TABLE)
+    info_parser = subparsers.add_parser('info')
+    info_parser.add_argument('--path', default='journal_impact.sqlite')
+    info_parser.add_argument('--table', default=JOURNAL_TABLE)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        written = write_snapshot(args.output, fetch_journal_rows(bigquery.Client(project=args.project), args.table), args.table)
+        print(f"Wrote {written['rows']} journals to {args.output}, version {snapshot_version(written)}")
+    else:
+        meta = read_snapshot_meta(args.path, args.table)
+        print(f"{args.path}: version {snapshot_version(meta)}, {meta['rows']} journals" if meta else f"{args.path}: no valid snapshot")
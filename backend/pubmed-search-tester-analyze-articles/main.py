@@ -1,42 +1,141 @@
 import functions_framework
+import functions_framework.aio
 from flask import jsonify, request, Response
+from starlette.responses import JSONResponse, Response as StarletteResponse, StreamingResponse
 from google import genai
 from google.genai import types
 from google.cloud import bigquery
+import asyncio
+import contextvars
+import hashlib
 import json
 import logging
-import time
 import math
-from datetime import datetime
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from analysis_cache import MemoryCache, create_cache_from_env, make_cache_key
+from article_text import TEXT_MODES, prepare_article_text
+from case_extraction import events_query_text, extract_case
+from context_cache import create_prefix_cache
+from extraction_files import read_extractions
+from jobs import INTERRUPTED, JobManager, JobStore
+from journal_snapshot import JournalImpactStore, fetch_journal_rows
+from metrics import (begin_request_metrics, record_article, record_cache, record_rate_limit_event, record_usage,
+                     render_prometheus, timed)
+from patient_matching import match_disease, match_events, normalize_text, split_events
+from prerank import prerank_hits
+from query_embedding import QueryEmbedder, bigquery_embed_batch
+from ranking import TopK, dedupe_hits
+from rate_limiter import RateLimitExceeded, add_observer, call_with_rate_limit, call_with_rate_limit_async, deadline_after, is_rate_limit_error
+from retrieval import BigQueryRetriever, LazyContentLoader, LocalVectorRetriever
+from scoring import FeatureTable, as_number, breakdown_at, rank_order, resolve_weights, score_articles, score_table
+from stream_compression import choose_encoding, compress_body, compress_stream, compress_stream_async
+from structured_logging import begin_request, log_payload, setup_logging
+from structured_output import (article_response_schema, create_missing_fields_prompt, merge_metadata,
+                               missing_fields, parse_article_metadata, repair_json_text)
+
+# Configure logging; records are queued and written by a background listener
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Global variable to store journal impact data
-journal_impact_data = {}
-
-def fetch_journal_impact_data():
-    """Fetch journal impact data from BigQuery and store in memory."""
-    global journal_impact_data
-    query = """
-    SELECT
-      `title`,
-      `sjr`
-    FROM
-      `gemini-med-lit-review.journal_rank.scimagojr_2023`
-    ORDER BY 
-      sjr DESC
-    """
-    try:
-        query_job = bq_client.query(query)
-        results = query_job.result()
-        
-        # Convert to dictionary for faster lookups
-        journal_impact_data = {row['title']: float(row['sjr']) for row in results}
-        logger.info(f"Loaded {len(journal_impact_data)} journal impact records")
-    except Exception as e:
-        logger.error(f"Error fetching journal impact data: {str(e)}")
+# Concurrency settings for article analysis
+DEFAULT_CONCURRENCY = int(os.environ.get('ANALYSIS_CONCURRENCY', '5'))
+MAX_CONCURRENCY = int(os.environ.get('ANALYSIS_MAX_CONCURRENCY', '20'))
+# Patients accepted by one batch request; they share the concurrency budget above
+MAX_BATCH_PATIENTS = int(os.environ.get('ANALYSIS_MAX_BATCH_PATIENTS', '20'))
+
+# Overall time budget for analyzing one request's articles
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('ANALYSIS_REQUEST_DEADLINE_SECONDS', '900'))
+
+# Gemini model used for article analysis
+GEMINI_MODEL = "gemini-2.0-flash-001"
+# 'text' scrapes JSON out of free-form output; 'structured' uses a JSON response schema (see structured_output.py)
+OUTPUT_MODES = ('text', 'structured')
+DEFAULT_OUTPUT_MODE = os.environ.get('GEMINI_OUTPUT_MODE', 'text')
+JSON_ONLY_INSTRUCTION = "IMPORTANT: Return ONLY the raw JSON object. Do not include any explanatory text, markdown formatting, or code blocks. The response should start with '{' and end with '}' with no other characters before or after."
+
+# Cache of validated Gemini responses, shared by all requests in this instance
+analysis_cache = create_cache_from_env()
+
+# Patient-independent article extractions keyed by PMID, reused across patients
+EXTRACTION_PROMPT_VERSION = "v1"
+extraction_store = create_cache_from_env('EXTRACTION_STORE')
+
+# Extractions precomputed by batch_extract.py, loaded on first use
+PRECOMPUTED_EXTRACTIONS_PATH = os.environ.get('PRECOMPUTED_EXTRACTIONS_PATH')
+precomputed_extractions = None
+precomputed_lock = threading.Lock()
+
+# 'single' analyzes an article in one call; 'two_stage' reuses a stored extraction and matches it to the patient
+PIPELINES = ('single', 'two_stage')
+# Pipeline used when a request does not choose one
+DEFAULT_PIPELINE = os.environ.get('ANALYSIS_PIPELINE', 'single')
+# How the two-stage pipeline matches an extraction to the patient (see match_patient)
+MATCH_MODES = ('llm', 'lookup', 'auto')
+
+# Retrieval backend: 'bigquery' (VECTOR_SEARCH) or 'local' (index exported with retrieval.py)
+RETRIEVAL_BACKEND = os.environ.get('RETRIEVAL_BACKEND', 'bigquery')
+LOCAL_INDEX_PATH = os.environ.get('LOCAL_INDEX_PATH')
+LOCAL_INDEX_TYPE = os.environ.get('LOCAL_INDEX_TYPE', 'auto')
+# Query embedding stage: 'bigquery' (corpus textembed model in its own job), 'vertex' (direct endpoint,
+# must be the model behind textembed) or 'inline' (embed inside the VECTOR_SEARCH job, no caching)
+QUERY_EMBEDDER = os.environ.get('QUERY_EMBEDDER', 'bigquery')
+TEXT_EMBEDDING_MODEL = os.environ.get('TEXT_EMBEDDING_MODEL', 'text-embedding-004')
+DEFAULT_TOP_K = 20
+MAX_TOP_K = 200
+
+# Cheap pre-ranking: score every retrieved hit from a content snippet, then analyze only the best max_articles
+DEFAULT_PRERANK = os.environ.get('ANALYSIS_PRERANK', 'false').lower() == 'true'
+PRERANK_SNIPPET_CHARS = int(os.environ.get('PRERANK_SNIPPET_CHARS', '2000'))
+
+# Running "best so far" ranking: emit rank_update events whenever the top_n ordering changes
+DEFAULT_RANK_UPDATES = os.environ.get('ANALYSIS_RANK_UPDATES', 'false').lower() == 'true'
+DEFAULT_TOP_N = 10
+
+# Full article text is served by get_article_text instead of riding along in every stream event
+DEFAULT_INCLUDE_FULL_TEXT = os.environ.get('STREAM_INCLUDE_FULL_TEXT', 'false').lower() == 'true'
+DEFAULT_COMPRESS_STREAM = os.environ.get('STREAM_COMPRESSION', 'false').lower() == 'true'
+RESCORE_TOP_N = int(os.environ.get('RESCORE_TOP_N', '100'))
+# Feature tables of stored extractions, per PMID set and patient, reused while weights are tuned
+feature_tables = MemoryCache(int(os.environ.get('SCORING_TABLE_CACHE_ENTRIES', '16')), 3600)
+ARTICLE_TEXT_MAX_AGE_SECONDS = int(os.environ.get('ARTICLE_TEXT_MAX_AGE_SECONDS', '86400'))
+# Articles analyzed on this instance, so the reader's follow-up text request skips BigQuery
+article_text_cache = MemoryCache(int(os.environ.get('ARTICLE_TEXT_CACHE_ENTRIES', '200')), ARTICLE_TEXT_MAX_AGE_SECONDS)
+
+# Article text preprocessing before prompting: 'full', 'clean' or 'window' (see article_text.py)
+DEFAULT_TEXT_MODE = os.environ.get('ARTICLE_TEXT_MODE', 'full')
+DEFAULT_TOKEN_BUDGET = int(os.environ.get('ARTICLE_TOKEN_BUDGET', '6000'))
+retrievers = {}
+retrievers_lock = threading.Lock()
+
+# Journal impact snapshot: bundled with the source and/or cached on the instance, refreshed from BigQuery when stale.
+# Build journal_impact.sqlite before deploying (see journal_snapshot.py) so cold starts do not wait for BigQuery
+JOURNAL_SNAPSHOT_PATH = os.environ.get('JOURNAL_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'journal_impact.sqlite'))
+JOURNAL_SNAPSHOT_CACHE_PATH = os.environ.get('JOURNAL_SNAPSHOT_CACHE_PATH', '/tmp/journal_impact.sqlite')
+JOURNAL_SNAPSHOT_MAX_AGE_SECONDS = int(os.environ.get('JOURNAL_SNAPSHOT_MAX_AGE_SECONDS', str(7 * 24 * 3600)))
+JOURNAL_SNAPSHOT_REFRESH = os.environ.get('JOURNAL_SNAPSHOT_REFRESH', 'true').lower() == 'true'
+
+# Resumable analysis jobs: events persisted on the instance so clients can reconnect and replay
+JOB_STORE_PATH = os.environ.get('ANALYSIS_JOB_STORE_PATH', '/tmp/analysis_jobs.sqlite')
+JOB_RETENTION_SECONDS = int(os.environ.get('ANALYSIS_JOB_RETENTION_SECONDS', str(24 * 3600)))
+job_manager = JobManager(JobStore(JOB_STORE_PATH), JOB_RETENTION_SECONDS)
+
+# Case notes pipeline: disease and events are extracted in this instance, then retrieval and analysis follow
+CASE_EXTRACTION_MODEL = os.environ.get('EXTRACTION_MODEL', 'gemini-2.0-flash-001')
+DEFAULT_CASE_GROUNDING = os.environ.get('EXTRACTION_GROUNDING', 'false').lower() == 'true'
+# Same settings and cache keys as the extract-case function, so a shared GCS cache serves both
+case_extraction_cache = create_cache_from_env('EXTRACTION_CACHE')
+
+# When the prefix can be context cached, a methodology's article block is replaced by this note
+# and the article is appended after the static prefix
+ARTICLE_BLOCK_PATTERN = re.compile(r'<Article>\s*\{article_text\}\s*</Article>')
+ARTICLE_REFERENCE = "The full article is provided in the <Article> block at the end of this prompt."
+# Substituted for {journal_context} in methodology templates that still reference the SJR table
+JOURNAL_CONTEXT_NOTE = "Journal SJR scores are resolved automatically from the extracted journal title and ISSN."
 
 # Initialize clients
 client = genai.Client(
@@ -46,6 +145,26 @@ client = genai.Client(
 )
 bq_client = bigquery.Client(project="playground-439016")
 
+# Journal SJR scores, loaded from the snapshot on first use rather than at import
+journal_store = JournalImpactStore(
+    lambda: fetch_journal_rows(bq_client),
+    bundled_path=JOURNAL_SNAPSHOT_PATH,
+    cache_path=JOURNAL_SNAPSHOT_CACHE_PATH,
+    max_age_seconds=JOURNAL_SNAPSHOT_MAX_AGE_SECONDS,
+    refresh=JOURNAL_SNAPSHOT_REFRESH,
+)
+
+# Context cache for the prompt prefix shared by every article: 'vertex', 'local' (in-process stub) or 'none'.
+# Off by default: the default and frontend methodologies give prefixes of roughly 600-1500 tokens, below the
+# 4096-token minimum Vertex AI accepts for cached content, so only long custom methodologies benefit
+prefix_cache = create_prefix_cache(
+    client,
+    GEMINI_MODEL,
+    backend=os.environ.get('CONTEXT_CACHE_BACKEND', 'none'),
+    ttl_seconds=int(os.environ.get('CONTEXT_CACHE_TTL_SECONDS', '3600')),
+    min_tokens=int(os.environ.get('CONTEXT_CACHE_MIN_TOKENS', '4096')),
+)
+
 def normalize_journal_score(sjr):
     """Normalize journal SJR score to points between 0-25 to align with other scoring metrics."""
     if not sjr:
@@ -57,132 +176,40 @@ def normalize_journal_score(sjr):
     # Cap at 25 points to match the scale of other point calculations
     return min(normalized, 25)
 
+def resolve_journal_sjr(metadata):
+    """Fill journal_sjr from the local journal index using the extracted journal title and ISSN."""
+    match = journal_store.index().lookup(metadata.get('journal_title'), metadata.get('journal_issn'))
+    if match:
+        matched_title, sjr = match
+        metadata['journal_sjr'] = sjr
+        metadata['journal_match'] = matched_title
+    else:
+        metadata['journal_sjr'] = 0
+
 def calculate_points(metadata, query_disease=None):
     """Calculate points based on article metadata and return both total and breakdown."""
-    points = 0
-    breakdown = {}
-    
-    # Journal impact points
-    if metadata.get('journal_title') and metadata.get('journal_sjr'):
-        journal_title = metadata['journal_title']
-        sjr = float(metadata['journal_sjr'])
-        if sjr > 0:
-            impact_points = normalize_journal_score(sjr)
-            points += impact_points
-            breakdown['journal_impact'] = impact_points
-            logger.info(f"Journal '{journal_title}' has SJR {sjr}, awarded {impact_points:.2f} points")
-        else:
-            logger.info(f"Journal '{journal_title}' has no SJR score")
-    
-    # Year-based points: -5 points per year difference from current year
-    current_year = datetime.now().year
-    if metadata.get('year'):
-        try:
-            article_year = int(metadata.get('year'))
-            year_diff = current_year - article_year
-            year_points = -5 * year_diff
-            points += year_points
-            breakdown['year'] = year_points
-        except (ValueError, TypeError):
-            # If year is not a valid integer, skip year-based points
-            pass
-    
-    # Disease Match: +50 points
-    if metadata.get('disease_match'):
-        points += 50
-        breakdown['disease_match'] = 50
-    
-    # Pediatric Focus: +20 points
-    if metadata.get('pediatric_focus'):
-        points += 20
-        breakdown['pediatric_focus'] = 20
-    
-    # Paper Type: +40 points for clinical trial, -5 points for review
-    paper_type = metadata.get('paper_type', '').lower()
-    if 'clinical trial' in paper_type:
-        points += 40
-        breakdown['paper_type'] = 40
-    elif 'review' in paper_type:
-        points -= 5
-        breakdown['paper_type'] = -5
-    
-    # Actionable Events: +15 points per matched event
-    actionable_events = metadata.get('actionable_events', [])
-    matched_events = sum(1 for event in actionable_events if event.get('matches_query', False))
-    if matched_events > 0:
-        event_points = matched_events * 15
-        points += event_points
-        breakdown['actionable_events'] = event_points
-    
-    # Drugs Tested: +5 points
-    if metadata.get('drugs_tested'):
-        points += 5
-        breakdown['drugs_tested'] = 5
-    
-    # Drug Results: +50 points for actual positive treatment shown
-    if metadata.get('treatment_shown'):
-        points += 50
-        breakdown['treatment_shown'] = 50
-    
-    # Cell Studies: +5 points
-    if metadata.get('cell_studies'):
-        points += 5
-        breakdown['cell_studies'] = 5
-    
-    # Mice Studies: +10 points
-    if metadata.get('mice_studies'):
-        points += 10
-        breakdown['mice_studies'] = 10
-    
-    # Case Report: +5 points
-    if metadata.get('case_report'):
-        points += 5
-        breakdown['case_report'] = 5
-    
-    # Series of Case Reports: +10 points
-    if metadata.get('series_of_case_reports'):
-        points += 10
-        breakdown['series_of_case_reports'] = 10
-    
-    # Clinical Study: +15 points
-    if metadata.get('clinical_study'):
-        points += 15
-        breakdown['clinical_study'] = 15
-    
-    # Clinical Study on Children: +20 points
-    if metadata.get('clinical_study_on_children'):
-        points += 20
-        breakdown['clinical_study_on_children'] = 20
-    
-    # Novelty: +10 points
-    if metadata.get('novelty'):
-        points += 10
-        breakdown['novelty'] = 10
-    
+    resolve_journal_sjr(metadata)
+    points, breakdown = score_articles([metadata])[0]
+    if 'journal_impact' in breakdown:
+        logger.info(f"Journal '{metadata['journal_title']}' has SJR {metadata['journal_sjr']}, awarded {breakdown['journal_impact']:.2f} points")
     return points, breakdown
 
-def create_gemini_prompt(article_text, pmid, methodology_content=None, disease=None, events_text=None):
+def create_gemini_prompt_parts(article_text, pmid, methodology_content=None, disease=None, events_text=None):
+    """Split the analysis prompt into a static prefix shared by every article and a per-article <Article> suffix.
+
+    The article only moves to the end when the prefix can be context cached; otherwise the prefix is None
+    and the prompt keeps the methodology's own order, with the article where the methodology puts it.
+    """
     # Add disease and events context to the prompt if provided
     disease_context = f"\nThe patient's disease is: {disease}\n" if disease else ""
     events_context = f"\nThe patient's actionable events are: {events_text}\n" if events_text else ""
-    
-    # Create journal context string
-    journal_context = ""
-    for title, sjr in journal_impact_data.items():
-        journal_context += f"- {title}: {sjr}\n"
 
     # Default methodology if none provided
     if not methodology_content:
         methodology_content = f"""You are an expert pediatric oncologist and you are the chair of the International Leukemia Tumor Board. Your goal is to evaluate full research articles related to oncology, especially those concerning pediatric leukemia, to identify potential advancements in treatment and understanding of the disease.{disease_context}{events_context}
 
-Journal Impact Data (SJR scores):
-The following is a list of journal titles and their SJR scores. When extracting the journal title from the article, find the best matching title from this list and use its SJR score. If no match is found, use 0 as the SJR score.
-
-Journal Titles and Scores:
-{journal_context}
-
 <Article>
-{article_text}
+{{article_text}}
 </Article>
 
 <Instructions>
@@ -195,22 +222,22 @@ As an expert oncologist:
 
 Please analyze the article and provide a JSON response with the following structure:
 
-{
-  "article_metadata": {
+{{
+  "article_metadata": {{
     "title": "...",
     "year": "...",
-    "journal_title": "...",  // Extract the journal title from the article
-    "journal_sjr": 0,        // Look up the SJR score from the provided list. Use the score of the best matching journal title, or 0 if no match found
+    "journal_title": "...",  // Extract the full journal title from the article
+    "journal_issn": "...",   // The journal ISSN if printed in the article, otherwise ""
     "cancer_focus": true/false,
     "pediatric_focus": true/false,
     "type_of_cancer": "...",
     "disease_match": true/false,      // Set to true if article's disease is relevant to patient's condition
     "paper_type": "...",
     "actionable_events": [
-      {
+      {{
         "event": "...",
         "matches_query": true/false   // Set to true if this event matches any of the patient's actionable events
-      }
+      }}
     ],
     "drugs_tested": true/false,
     "drug_results": ["...", "..."],   // List of treatment outcomes
@@ -222,37 +249,42 @@ Please analyze the article and provide a JSON response with the following struct
     "clinical_study": true/false,
     "clinical_study_on_children": true/false,
     "novelty": true/false
-  }
-}
+  }}
+}}
 
 Important: The response must be valid JSON and follow this exact structure. Do not include any explanatory text, markdown formatting, or code blocks. Return only the raw JSON object."""
 
-    # Log the article text format
-    logger.info(f"Article text to be inserted:\n{article_text}")
-    
-    # Replace all placeholders
-    prompt = methodology_content
-    prompt = prompt.replace("{article_text}", article_text)
-    prompt = prompt.replace("{disease}", disease if disease else "")
-    prompt = prompt.replace("{events}", events_text if events_text else "")
-    prompt = prompt.replace("{journal_context}", journal_context)
+    log_payload(logger, "Article text", article_text, pmid=pmid)
     
-    # Log the final prompt
-    logger.info(f"Final prompt with article inserted:\n{prompt}")
-    
-    return prompt
+    # Replace all placeholders except the article
+    template = methodology_content.replace("{disease}", disease if disease else "")
+    template = template.replace("{events}", events_text if events_text else "")
+    template = template.replace("{journal_context}", JOURNAL_CONTEXT_NOTE)
+    suffix = f"<Article>\n{article_text}\n</Article>"
 
-def analyze_with_gemini(article_text, pmid, methodology_content=None, disease=None, events_text=None):
-    # Create prompt with JSON-only instruction
-    prompt = create_gemini_prompt(article_text, pmid, methodology_content, disease, events_text)
-    prompt += "\n\nIMPORTANT: Return ONLY the raw JSON object. Do not include any explanatory text, markdown formatting, or code blocks. The response should start with '{' and end with '}' with no other characters before or after."
-    
-    # Configure Gemini
-    model = "gemini-2.0-flash-001"
-    generate_content_config = types.GenerateContentConfig(
+    # The article moves to the end so everything before it can be cached
+    prefix = ARTICLE_BLOCK_PATTERN.sub(ARTICLE_REFERENCE, template)
+    prefix = prefix.replace("{article_text}", ARTICLE_REFERENCE)
+    if prefix_cache is not None and prefix_cache.applies(prefix):
+        log_payload(logger, "Prompt prefix", prefix, pmid=pmid)
+        return prefix, suffix
+
+    if "{article_text}" not in template:
+        return None, f"{template}\n\n{suffix}"
+    prompt = ARTICLE_BLOCK_PATTERN.sub(lambda match: suffix, template)
+    return None, prompt.replace("{article_text}", article_text)
+
+def gemini_config(max_output_tokens=8192, response_schema=None):
+    """Deterministic generation config shared by all article analysis calls, optionally constrained to a JSON schema."""
+    structured = {} if response_schema is None else {
+        'response_mime_type': 'application/json',
+        'response_schema': response_schema,
+    }
+    return types.GenerateContentConfig(
+        **structured,
         temperature=0,
         top_p=0.95,
-        max_output_tokens=8192,
+        max_output_tokens=max_output_tokens,
         response_modalities=["TEXT"],
         safety_settings=[
             types.SafetySetting(category=cat, threshold="OFF")
@@ -260,150 +292,699 @@ def analyze_with_gemini(article_text, pmid, methodology_content=None, disease=No
                       "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_HARASSMENT"]
         ]
     )
-    
-    # Create content with prompt
-    contents = [types.Content(role="user", parts=[{"text": prompt}])]
-    
-    # Initialize retry parameters
-    base_delay = 5  # Start with 5 seconds
-    attempt = 0
-    
-    while True:  # Keep trying indefinitely
+
+def clean_json_text(text):
+    """Strip markdown fences and surrounding prose from a model response."""
+    text = text.strip()
+    # First try to find JSON between ```json and ``` markers
+    if '```json' in text:
+        text = text.split('```json')[1].split('```')[0].strip()
+    # If that fails, try to find JSON between { and }
+    elif '{' in text and '}' in text:
+        start = text.find('{')
+        end = text.rfind('}') + 1
+        text = text[start:end]
+    # Remove any non-JSON text before or after
+    return text.strip()
+
+class AnalysisCancelled(Exception):
+    """Raised instead of calling Gemini once the request that needs the call has been cancelled."""
+
+# threading.Event set when the client of an asyncio stream goes away; worker threads of that stream check it
+cancelled_var = contextvars.ContextVar('analysis_cancelled', default=None)
+
+def cancellable(fn):
+    """fn() that raises AnalysisCancelled instead when the current request is cancelled; checked before every attempt."""
+    def call():
+        cancelled = cancelled_var.get()
+        if cancelled is not None and cancelled.is_set():
+            raise AnalysisCancelled("Analysis cancelled")
+        return fn()
+    return call
+
+def run_cancellable(cancelled, fn, *args):
+    """Run fn(*args) in a worker thread whose Gemini calls stop once cancelled is set."""
+    cancelled_var.set(cancelled)
+    return fn(*args)
+
+def generate_content(prefix, prompt, config, deadline=None):
+    """Call Gemini with prefix + prompt, serving the prefix from a context cache when one is available."""
+    cached_name = prefix_cache.get(prefix) if prefix and prefix_cache else None
+    if prefix and prefix_cache:
+        record_cache('context', cached_name is not None)
+    if cached_name:
         try:
-            response = client.models.generate_content(
-                model=model,
-                contents=contents,
-                config=generate_content_config,
+            return call_with_rate_limit(
+                cancellable(lambda: client.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=[types.Content(role="user", parts=[{"text": prompt}])],
+                    config=config.model_copy(update={'cached_content': cached_name}),
+                )),
+                deadline=deadline,
             )
-            break  # If successful, break out of the retry loop
         except Exception as e:
-            error_str = str(e)
-            if "429 RESOURCE_EXHAUSTED" in error_str:
-                attempt += 1
-                # Calculate exponential backoff delay with a maximum of 5 minutes
-                delay = min(base_delay * (2 ** (attempt - 1)), 300)  # Cap at 300 seconds (5 minutes)
-                print(f"Received RESOURCE_EXHAUSTED error. Attempt {attempt}. Waiting {delay} seconds before retry...")
-                time.sleep(delay)
-            else:
-                # If it's not a 429 error, raise immediately
+            if isinstance(e, (RateLimitExceeded, AnalysisCancelled)) or is_rate_limit_error(e):
                 raise
+            # The entry may have expired or been deleted; drop it and send the full prompt
+            logger.warning(f"Generation with context cache {cached_name} failed, sending the full prompt: {str(e)}")
+            prefix_cache.invalidate(prefix)
+
+    full_prompt = f"{prefix}\n\n{prompt}" if prefix else prompt
+    return call_with_rate_limit(
+        cancellable(lambda: client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=[types.Content(role="user", parts=[{"text": full_prompt}])],
+            config=config,
+        )),
+        deadline=deadline,
+    )
+
+def prepare_json_request(prompt, cache_parts, max_output_tokens=8192, response_schema=None, prefix=None):
+    """Return the final prompt, generation config and analysis-cache key for a JSON call."""
+    if response_schema is None:
+        prompt += "\n\n" + JSON_ONLY_INSTRUCTION
+    generate_content_config = gemini_config(max_output_tokens, response_schema)
     
-    try:
-        # Log Gemini's raw response with clear markers
-        logger.info("========== RAW GEMINI RESPONSE START ==========")
-        logger.info(response.text)
-        logger.info("========== RAW GEMINI RESPONSE END ============")
-        
-        # Clean up response text
-        text = response.text.strip()
-        
-        # Try to find JSON object
+    # Identical requests are served from the analysis cache
+    cache_key = make_cache_key(
+        prompt=f"{prefix}\n\n{prompt}" if prefix else prompt,
+        model=GEMINI_MODEL,
+        config=generate_content_config.model_dump(mode='json', exclude_none=True),
+        **cache_parts
+    )
+    return prompt, generate_content_config, cache_key
+
+def cache_parts_summary(cache_parts):
+    """Loggable identifiers of a call: the PMID and any short parts, never article content."""
+    return {key: value for key, value in cache_parts.items() if key != 'content'}
+
+def parse_json_response(response_text, validate=None, response_schema=None):
+    """Parse a model response into a JSON object, or None if it is not valid JSON or fails validate().
+
+    The full response is logged only when the request is sampled or parsing fails.
+    """
+    log_payload(logger, "Gemini response", response_text)
+    
+    if response_schema is not None:
+        result = repair_json_text(response_text)
+        if result is None:
+            logger.error("Structured response could not be parsed or repaired")
+    else:
+        text = clean_json_text(response_text)
         try:
-            # First try to find JSON between ```json and ``` markers
-            if '```json' in text:
-                text = text.split('```json')[1].split('```')[0].strip()
-            # If that fails, try to find JSON between { and }
-            elif '{' in text and '}' in text:
-                start = text.find('{')
-                end = text.rfind('}') + 1
-                text = text[start:end]
-            
-            # Remove any non-JSON text before or after
-            text = text.strip()
-            
-            # Log cleaned text before parsing
-            logger.info("========== CLEANED TEXT START ==========")
-            logger.info(text)
-            logger.info("========== CLEANED TEXT END ============")
-            
-            # Try to parse as JSON
-            try:
-                analysis = json.loads(text)
-                logger.info("Successfully parsed JSON")
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parse error at position {e.pos}: {e.msg}")
-                logger.error(f"Error context: {text[max(0, e.pos-50):min(len(text), e.pos+50)]}")
-                raise
-            
-            # Validate required fields
-            if not isinstance(analysis, dict) or 'article_metadata' not in analysis:
-                logger.error("Invalid JSON structure - missing article_metadata")
-                return None
-                
-            metadata = analysis['article_metadata']
-            required_fields = ['title', 'journal_title', 'journal_sjr', 'cancer_focus', 'type_of_cancer', 'paper_type', 'actionable_events']
-            for field in required_fields:
-                if field not in metadata:
-                    logger.error(f"Invalid JSON structure - missing {field}")
-                    return None
+            result = json.loads(text)
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON: {str(e)}")
-            logger.error(f"Cleaned response was: {text}")
+            logger.error(f"JSON parse error at position {e.pos}: {e.msg}")
+            logger.error(f"Error context: {text[max(0, e.pos-50):min(len(text), e.pos+50)]}")
+            result = None
+    
+    if result is not None and validate and not validate(result):
+        result = None
+    if result is None:
+        log_payload(logger, "Rejected Gemini response", response_text, logging.ERROR, force=True)
+    return result
+
+def generate_json(prompt, cache_parts, validate=None, deadline=None, use_cache=True, max_output_tokens=8192, response_schema=None, prefix=None):
+    """Call Gemini for a JSON object, serving identical calls from the analysis cache.
+
+    A prefix shared by many calls is sent ahead of prompt and may be served from
+    a context cache. With a response_schema the SDK's JSON mode is used and
+    truncated output is repaired instead of scraped. Returns the parsed object,
+    or None if the response is not valid JSON or fails validate(). With
+    use_cache=False the lookup is skipped but a valid response is still cached.
+    """
+    prompt, generate_content_config, cache_key = prepare_json_request(prompt, cache_parts, max_output_tokens, response_schema, prefix)
+    with timed('cache_lookup'):
+        response_text = analysis_cache.get(cache_key) if use_cache else None
+    cache_hit = response_text is not None
+    if use_cache:
+        record_cache('analysis', cache_hit)
+    if cache_hit:
+        logger.info(f"Cache hit for {cache_parts.get('pmid', 'request')}")
+    else:
+        # Shared rate limiter paces calls and retries 429s within the retry budget and deadline
+        with timed('gemini_call'):
+            response = generate_content(prefix, prompt, generate_content_config, deadline)
+        record_usage(response)
+        response_text = response.text or ""
+    
+    with timed('parse'):
+        result = parse_json_response(response_text, validate, response_schema)
+    if result is None:
+        log_payload(logger, "Prompt of rejected response", prompt, logging.ERROR, force=True, **cache_parts_summary(cache_parts))
+    # Only cache responses that parsed and validated
+    if result is not None and not cache_hit:
+        analysis_cache.set(cache_key, response_text)
+    return result
+
+def validate_article_analysis(analysis):
+    """Check that a single-call analysis has article_metadata with the required fields."""
+    if not isinstance(analysis, dict) or 'article_metadata' not in analysis:
+        logger.error("Invalid JSON structure - missing article_metadata")
+        return False
+    metadata = analysis['article_metadata']
+    required_fields = ['title', 'journal_title', 'cancer_focus', 'type_of_cancer', 'paper_type', 'actionable_events']
+    for field in required_fields:
+        if field not in metadata:
+            logger.error(f"Invalid JSON structure - missing {field}")
+            return False
+    return True
+
+def finalize_analysis(analysis, article_text, pmid, disease=None):
+    """Add PMID, link, points and the full article text to a validated analysis."""
+    metadata = analysis['article_metadata']
+    # Add PMID and generate link
+    metadata['PMID'] = pmid
+    metadata['link'] = f'https://pubmed.ncbi.nlm.nih.gov/{pmid}/'
+    
+    # Calculate points with disease information
+    with timed('scoring'):
+        points, point_breakdown = calculate_points(metadata, disease)
+    metadata['overall_points'] = points
+    metadata['point_breakdown'] = point_breakdown
+    
+    # Store full article text at top level
+    analysis['full_article_text'] = article_text
+    logger.info("Added full article text and calculated points")
+    return analysis
+
+def generate_structured_analysis(prefix, prompt, pmid, article_text, deadline=None, use_cache=True):
+    """Schema-constrained analysis; repairs partial output and re-asks once for required fields that are still missing."""
+    cache_parts = {'pmid': pmid, 'content': article_text}
+    result = generate_json(prompt, cache_parts, validate=lambda r: isinstance(r, dict), deadline=deadline,
+                           use_cache=use_cache, response_schema=article_response_schema(), prefix=prefix)
+    if result is None:
+        return None
+    metadata = parse_article_metadata(result)
+    missing = missing_fields(metadata)
+    if missing:
+        logger.warning(f"Structured analysis of {pmid} is missing {missing}, asking for those fields only")
+        patch = generate_json(
+            create_missing_fields_prompt(prompt, metadata, missing),
+            {**cache_parts, 'missing': missing},
+            validate=lambda r: isinstance(r, dict),
+            deadline=deadline,
+            use_cache=use_cache,
+            max_output_tokens=1024,
+            response_schema=article_response_schema(missing),
+            prefix=prefix,
+        )
+        if patch is not None:
+            metadata = merge_metadata(metadata, parse_article_metadata(patch))
+        missing = missing_fields(metadata)
+        if missing:
+            logger.error(f"Invalid JSON structure - missing {missing} after re-ask")
             return None
-        
-        # Process metadata and calculate points
-        if 'article_metadata' in analysis:
-            metadata = analysis['article_metadata']
-            # Add PMID and generate link
-            metadata['PMID'] = pmid
-            metadata['link'] = f'https://pubmed.ncbi.nlm.nih.gov/{pmid}/'
-            
-            # Calculate points with disease information
-            points, point_breakdown = calculate_points(metadata, disease)
-            metadata['overall_points'] = points
-            metadata['point_breakdown'] = point_breakdown
-            
-            # Store full article text at top level
-            analysis['full_article_text'] = article_text
-            logger.info("Added full article text and calculated points")
-        
-        return analysis
+    return {'article_metadata': metadata.model_dump(exclude_none=True)}
+
+def analyze_with_gemini(article_text, pmid, methodology_content=None, disease=None, events_text=None, deadline=None, use_cache=True, output_mode='text'):
+    with timed('prompt_build'):
+        prefix, prompt = create_gemini_prompt_parts(article_text, pmid, methodology_content, disease, events_text)
+    if output_mode == 'structured':
+        analysis = generate_structured_analysis(prefix, prompt, pmid, article_text, deadline, use_cache)
+    else:
+        analysis = generate_json(
+            prompt,
+            {'pmid': pmid, 'content': article_text},
+            validate=validate_article_analysis,
+            deadline=deadline,
+            use_cache=use_cache,
+            prefix=prefix,
+        )
+    if analysis is None:
+        return None
+    try:
+        return finalize_analysis(analysis, article_text, pmid, disease)
     except Exception as e:
         logger.error(f"Error analyzing article with Gemini: {str(e)}")
         return None
 
-def create_bq_query(events_text):
-    return f"""
-    DECLARE query_text STRING;
-    SET query_text = \"\"\"
-    {events_text}
-    \"\"\";
-
-    WITH query_embedding AS (
-      SELECT ml_generate_embedding_result AS embedding_col
-      FROM ML.GENERATE_EMBEDDING(
-        MODEL `playground-439016.pmid_uscentral.textembed`,
-        (SELECT query_text AS content),
-        STRUCT(TRUE AS flatten_json_output)
-      )
+def create_extraction_prompt(article_text):
+    """Prompt for the patient-independent extraction stage of the two-stage pipeline."""
+    return f"""You are an expert pediatric oncologist and you are the chair of the International Leukemia Tumor Board. Your goal is to evaluate full research articles related to oncology, especially those concerning pediatric leukemia, to identify potential advancements in treatment and understanding of the disease.
+
+<Article>
+{article_text}
+</Article>
+
+<Instructions>
+Read the provided full article and extract key information about it. Do not consider any particular patient; describe only the article itself.
+
+Please analyze the article and provide a JSON response with the following structure:
+
+{{
+  "article_metadata": {{
+    "title": "...",
+    "year": "...",
+    "journal_title": "...",  // Extract the full journal title from the article
+    "journal_issn": "...",   // The journal ISSN if printed in the article, otherwise ""
+    "cancer_focus": true/false,
+    "pediatric_focus": true/false,
+    "type_of_cancer": "...",
+    "paper_type": "...",
+    "actionable_events": ["...", "..."],  // Gene fusions, mutations and markers studied in the article
+    "drugs_tested": true/false,
+    "drug_results": ["...", "..."],   // List of treatment outcomes
+    "treatment_shown": true/false,    // Set to true if article shows positive treatment results
+    "cell_studies": true/false,
+    "mice_studies": true/false,
+    "case_report": true/false,
+    "series_of_case_reports": true/false,
+    "clinical_study": true/false,
+    "clinical_study_on_children": true/false,
+    "novelty": true/false
+  }}
+}}
+</Instructions>"""
+
+def create_matching_prompt(extraction, disease, patient_events):
+    """Short prompt matching a patient's disease and events against a stored extraction."""
+    article_events = "\n".join(f"{i}. {event}" for i, event in enumerate(extraction.get('actionable_events', []), 1))
+    patient_events_text = "\n".join(f"- {event}" for event in patient_events)
+    return f"""You are an expert pediatric oncologist. Compare a patient with a research article.
+
+The patient's disease is: {disease or "unknown"}
+The patient's actionable events are:
+{patient_events_text}
+
+Article title: {extraction.get('title', '')}
+Article cancer type: {extraction.get('type_of_cancer', '')}
+Article actionable events:
+{article_events}
+
+Set disease_match to true if the article's cancer type is relevant to the patient's condition.
+For each numbered article event, in order, set true if it is an exact or close match to any of the patient's actionable events.
+
+Return JSON with this structure:
+{{"disease_match": true/false, "event_matches": [true/false, ...]}}"""
+
+def validate_extraction(extraction):
+    """Check that an extraction stage response has the fields the scoring needs."""
+    if not isinstance(extraction, dict) or 'article_metadata' not in extraction:
+        logger.error("Invalid extraction - missing article_metadata")
+        return False
+    metadata = extraction['article_metadata']
+    for field in ['title', 'journal_title', 'type_of_cancer', 'paper_type', 'actionable_events']:
+        if field not in metadata:
+            logger.error(f"Invalid extraction - missing {field}")
+            return False
+    return True
+
+def extraction_key(pmid):
+    """Store key for a PMID's patient-independent extraction."""
+    return make_cache_key(pmid=pmid, prompt_version=EXTRACTION_PROMPT_VERSION, model=GEMINI_MODEL)
+
+def get_precomputed_extractions():
+    """Load the batch job's extractions for the current prompt version and model once per instance."""
+    global precomputed_extractions
+    with precomputed_lock:
+        if precomputed_extractions is None:
+            precomputed_extractions = read_extractions(PRECOMPUTED_EXTRACTIONS_PATH, EXTRACTION_PROMPT_VERSION, GEMINI_MODEL)
+            logger.info(f"Loaded {len(precomputed_extractions)} precomputed extractions")
+    return precomputed_extractions
+
+def get_stored_extraction(pmid):
+    """Return the precomputed or stored extraction for a PMID, or None."""
+    precomputed = get_precomputed_extractions().get(str(pmid))
+    if precomputed is not None:
+        return precomputed
+    stored = extraction_store.get(extraction_key(pmid))
+    return json.loads(stored) if stored else None
+
+def extract_article(article_text, pmid, deadline=None, use_cache=True):
+    """Stage 1: patient-independent extraction, computed once per PMID and stored."""
+    if use_cache:
+        with timed('cache_lookup'):
+            extraction = get_stored_extraction(pmid)
+        record_cache('extraction', extraction is not None)
+        if extraction is not None:
+            logger.info(f"Using stored extraction for article {pmid}")
+            return extraction
+
+    result = generate_json(
+        create_extraction_prompt(article_text),
+        {'pmid': pmid, 'content': article_text, 'stage': 'extraction'},
+        validate=validate_extraction,
+        deadline=deadline,
+        use_cache=use_cache,
+    )
+    if result is None:
+        return None
+    extraction = result['article_metadata']
+    extraction_store.set(extraction_key(pmid), json.dumps(extraction))
+    return extraction
+
+def match_patient(extraction, disease, events_text, match_mode='llm', deadline=None, use_cache=True):
+    """Stage 2: decide disease_match and per-event matches_query for one patient.
+
+    'lookup' matches deterministically on disease names and gene/marker symbols, 'llm' asks
+    Gemini with a short prompt over the extraction only, and 'auto' uses the lookup result when
+    it finds any match and falls back to the LLM otherwise.
+    """
+    article_events = [str(event) for event in extraction.get('actionable_events', [])]
+    patient_events = [
+        event for event in split_events(events_text)
+        if normalize_text(event) != normalize_text(disease)
+    ]
+
+    if match_mode in ('lookup', 'auto'):
+        disease_match = match_disease(disease, extraction.get('type_of_cancer'))
+        event_matches = match_events(article_events, patient_events)
+        if match_mode == 'lookup' or disease_match or any(event_matches):
+            return disease_match, event_matches
+
+    result = generate_json(
+        create_matching_prompt(extraction, disease, patient_events),
+        {'stage': 'matching'},
+        validate=lambda r: isinstance(r, dict) and 'disease_match' in r,
+        deadline=deadline,
+        use_cache=use_cache,
+        max_output_tokens=1024,
+    )
+    if result is None:
+        return None
+    event_matches = [bool(m) for m in result.get('event_matches', [])]
+    # Pad or trim in case the model returned a different number of flags
+    event_matches = (event_matches + [False] * len(article_events))[:len(article_events)]
+    return bool(result['disease_match']), event_matches
+
+def combine_extraction(extraction, disease_match, event_matches):
+    """article_metadata for one patient from a stored extraction and its matching results."""
+    metadata = dict(extraction)
+    metadata['disease_match'] = disease_match
+    metadata['actionable_events'] = [
+        {'event': str(event), 'matches_query': matched}
+        for event, matched in zip(extraction.get('actionable_events', []), event_matches)
+    ]
+    return metadata
+
+def analyze_two_stage(article_text, pmid, disease=None, events_text=None, match_mode='llm', deadline=None, use_cache=True):
+    """Analyze an article as a stored extraction plus a cheap patient-specific matching stage."""
+    extraction = extract_article(article_text, pmid, deadline, use_cache)
+    if extraction is None:
+        return None
+    return analyze_for_patient(extraction, article_text, pmid, disease, events_text, match_mode, deadline, use_cache)
+
+def analyze_for_patient(extraction, article_text, pmid, disease=None, events_text=None, match_mode='llm', deadline=None, use_cache=True):
+    """Stage 2 and scoring of a stored extraction for one patient."""
+    match = match_patient(extraction, disease, events_text, match_mode, deadline, use_cache)
+    if match is None:
+        return None
+    metadata = combine_extraction(extraction, *match)
+    try:
+        return finalize_analysis({'article_metadata': metadata}, article_text, pmid, disease)
+    except Exception as e:
+        logger.error(f"Error combining two-stage analysis: {str(e)}")
+        return None
+
+def vertex_embed_batch(texts):
+    """Embed a batch of query texts with the Vertex AI text embedding endpoint."""
+    response = call_with_rate_limit(
+        lambda: client.models.embed_content(model=TEXT_EMBEDDING_MODEL, contents=texts)
     )
-    SELECT 
-      base.name,
-      base.content,
-      distance
-    FROM VECTOR_SEARCH(
-      TABLE `playground-439016.pmid_uscentral.pmid_embed_nonzero`,
-      'ml_generate_embedding_result',
-      (SELECT embedding_col FROM query_embedding),
-      top_k => 20
-    ) results
-    JOIN `playground-439016.pmid_uscentral.pmid_embed_nonzero` base 
-    ON results.base.name = base.name
-    ORDER BY distance ASC;
+    return [embedding.values for embedding in response.embeddings]
+
+def create_query_embedder():
+    """Build the query embedding stage selected by QUERY_EMBEDDER ('bigquery', 'vertex' or 'inline')."""
+    if QUERY_EMBEDDER == 'vertex':
+        return QueryEmbedder(vertex_embed_batch)
+    if QUERY_EMBEDDER == 'bigquery':
+        return QueryEmbedder(lambda texts: bigquery_embed_batch(bq_client, texts))
+    return None
+
+def embed_query(text):
+    """Query embedding through the shared embedder, timed as its own stage."""
+    with timed('embedding'):
+        if query_embedder is None:
+            return vertex_embed_batch([text])[0]
+        return query_embedder.embed(text)
+
+def get_retriever(name=None):
+    """Return the named retrieval backend, creating it on first use."""
+    name = name or RETRIEVAL_BACKEND
+    with retrievers_lock:
+        if name not in retrievers:
+            if name == 'bigquery':
+                retrievers[name] = BigQueryRetriever(bq_client, embed_query if query_embedder else None)
+            elif name == 'local':
+                retrievers[name] = LocalVectorRetriever(LOCAL_INDEX_PATH, embed_query, LOCAL_INDEX_TYPE)
+            else:
+                raise ValueError(f"Unknown retrieval backend: {name}")
+        return retrievers[name]
+
+def bool_option(request_json, name, default=False):
+    """A boolean request option: JSON true/false or the strings "true"/"false"; ValueError for anything else."""
+    value = request_json.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ValueError(f"{name} must be true or false, got {value!r}")
+
+def number_option(request_json, name, default=None, convert=int, minimum=None, maximum=None):
+    """A numeric request option; default when it is missing, capped at maximum, ValueError when it is invalid."""
+    value = request_json.get(name)
+    if value is None or value == '':
+        return default
+    kind = 'an integer' if convert is int else 'a number'
+    try:
+        number = float(value) if not isinstance(value, bool) else math.nan
+    except (TypeError, ValueError):
+        number = math.nan
+    if not math.isfinite(number) or (convert is int and not number.is_integer()):
+        raise ValueError(f"{name} must be {kind}, got {value!r}")
+    if minimum is not None and number < minimum:
+        raise ValueError(f"{name} must be at least {minimum}, got {value!r}")
+    if maximum is not None:
+        number = min(number, maximum)
+    return convert(number)
+
+def parse_analysis_options(request_json):
+    """Read the optional analysis settings from the request JSON; ValueError if one is invalid."""
+    text_mode = request_json.get('text_mode', DEFAULT_TEXT_MODE)
+    if text_mode not in TEXT_MODES:
+        raise ValueError(f"text_mode must be one of {', '.join(TEXT_MODES)}")
+    output_mode = request_json.get('output_mode', DEFAULT_OUTPUT_MODE)
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"output_mode must be one of {', '.join(OUTPUT_MODES)}")
+    pipeline = request_json.get('pipeline', DEFAULT_PIPELINE)
+    if pipeline not in PIPELINES:
+        raise ValueError(f"pipeline must be one of {', '.join(PIPELINES)}")
+    match_mode = request_json.get('match_mode', 'llm')
+    if match_mode not in MATCH_MODES:
+        raise ValueError(f"match_mode must be one of {', '.join(MATCH_MODES)}")
+    return {
+        'concurrency': number_option(request_json, 'concurrency', minimum=1, maximum=MAX_CONCURRENCY),
+        'deadline_seconds': number_option(request_json, 'deadline_seconds', convert=float, minimum=1),
+        # bypass_cache skips cache lookups; fresh results are still stored, so it refreshes stale entries
+        'use_cache': not bool_option(request_json, 'bypass_cache'),
+        'pipeline': pipeline,
+        'match_mode': match_mode,
+        'retrieval_backend': request_json.get('retrieval_backend'),
+        'top_k': number_option(request_json, 'top_k', DEFAULT_TOP_K, minimum=1, maximum=MAX_TOP_K),
+        'max_distance': number_option(request_json, 'max_distance', convert=float, minimum=0),
+        'max_articles': number_option(request_json, 'max_articles', minimum=1),
+        'prerank': bool_option(request_json, 'prerank', DEFAULT_PRERANK),
+        'rank_updates': bool_option(request_json, 'rank_updates', DEFAULT_RANK_UPDATES),
+        'top_n': number_option(request_json, 'top_n', DEFAULT_TOP_N, minimum=1),
+        'include_full_text': bool_option(request_json, 'include_full_text', DEFAULT_INCLUDE_FULL_TEXT),
+        'compress': bool_option(request_json, 'compress', DEFAULT_COMPRESS_STREAM),
+        'text_mode': text_mode,
+        'output_mode': output_mode,
+        'token_budget': number_option(request_json, 'token_budget', DEFAULT_TOKEN_BUDGET, minimum=1),
+        # None keeps the default weights computed with each analysis
+        'weights': resolve_weights(request_json['weights']) if request_json.get('weights') is not None else None,
+    }
+
+def analyze_article(hit, content_loader, methodology_content=None, disease=None, events_text=None, options=None, deadline=None):
+    """Fetch a retrieved article's content and analyze it with the requested pipeline."""
+    options = options or {}
+    pmid = hit['name']
+    with timed('content_fetch'):
+        content = content_loader.get(pmid)
+    if content is None:
+        raise ValueError(f"No content found for article {pmid}")
+
+    logger.info(f"Processing article {pmid}", extra={'fields': {'pmid': pmid, 'content_length': len(content)}})
+
+    use_cache = options.get('use_cache', True)
+    text_mode = options.get('text_mode', 'full')
+    if options.get('pipeline') == 'two_stage':
+        # Extractions are stored per PMID, so their text must not depend on the patient
+        with timed('prompt_build'):
+            prompt_text, report = prepare_article_text(content, 'clean' if text_mode == 'window' else text_mode)
+        analysis = analyze_two_stage(prompt_text, pmid, disease, events_text, options.get('match_mode', 'llm'), deadline, use_cache)
+    else:
+        with timed('prompt_build'):
+            prompt_text, report = prepare_article_text(content, text_mode, disease, events_text, options.get('token_budget', DEFAULT_TOKEN_BUDGET))
+        analysis = analyze_with_gemini(prompt_text, pmid, methodology_content, disease, events_text, deadline, use_cache,
+                                       options.get('output_mode', 'text'))
+    return attach_article_details(analysis, pmid, content, report, options)
+
+def attach_article_details(analysis, pmid, content, report, options):
+    """Add the text preprocessing report, the request's weight profile points, and the full article text if asked for inline."""
+    logger.info(f"Article {pmid} text mode {report['mode']}: {report['original_tokens']} -> {report['prompt_tokens']} estimated tokens")
+    article_text_cache.set(str(pmid), content)
+    if analysis:
+        analysis.pop('full_article_text', None)
+        if options.get('include_full_text'):
+            # The reader still gets the whole article, whatever was sent to the model
+            analysis['full_article_text'] = content
+        analysis['text_length'] = len(content)
+        analysis['text_preprocessing'] = report
+        if options.get('weights') is not None:
+            metadata = analysis['article_metadata']
+            with timed('scoring'):
+                metadata['overall_points'], metadata['point_breakdown'] = score_articles([metadata], options['weights'])[0]
+    return analysis
+
+def prerank_results(retriever, results, disease, events_text):
+    """Order retrieved hits by expected score, computed from snippets and precomputed extractions without LLM calls."""
+    with timed('content_fetch'):
+        snippets = retriever.fetch_snippets([hit['name'] for hit in results], PRERANK_SNIPPET_CHARS)
+    with timed('prerank'):
+        ranked = prerank_hits(
+            results, snippets, disease, split_events(events_text),
+            journal_store.index(), normalize_journal_score, get_precomputed_extractions()
+        )
+    logger.info(f"Pre-ranked {len(ranked)} articles: {[(hit['name'], round(hit['expected_score'], 1)) for hit in ranked]}")
+    return ranked
+
+def build_article_event(hit, completed, total_articles, get_analysis):
+    """Build the NDJSON event for one article, tagged with its original retrieval rank and any expected score."""
+    pmid = hit['name']
+    tags = {"rank": hit['rank']}
+    if 'expected_score' in hit:
+        tags["expected_score"] = hit['expected_score']
+    try:
+        analysis = get_analysis()
+        if analysis:
+            return {
+                "type": "article_analysis",
+                "data": {
+                    "progress": {
+                        "article_number": completed,
+                        "total_articles": total_articles
+                    },
+                    **tags,
+                    "analysis": analysis
+                }
+            }
+        logger.error(f"Failed to analyze article {pmid}")
+        return {
+            "type": "error",
+            "data": {
+                "message": f"Failed to analyze article {pmid}",
+                "article_number": completed,
+                **tags,
+                "total_articles": total_articles
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error processing article {pmid}: {str(e)}")
+        return {
+            "type": "error",
+            "data": {
+                "message": f"Error processing article {pmid}: {str(e)}",
+                "article_number": completed,
+                **tags,
+                "total_articles": total_articles
+            }
+        }
+
+def retrieve_candidates(retriever, events_text, disease=None, options=None):
+    """Retrieve, deduplicate, optionally pre-rank, and cap the articles to analyze.
+
+    Each hit is tagged with its retrieval rank. Returns (hits, number of duplicate hits dropped).
     """
+    options = options or {}
+    # Embedding time is recorded separately, so vector_search is the search itself
+    with timed('vector_search'):
+        results = list(retriever.search(events_text, options.get('top_k', DEFAULT_TOP_K), options.get('max_distance')))
+    for rank, hit in enumerate(results, 1):
+        hit['rank'] = rank
+    # Repeated PMIDs and extra chunks of an already retrieved paper would only repeat an LLM call
+    results, duplicates = dedupe_hits(results)
+    if duplicates:
+        logger.info(f"Dropped {duplicates} duplicate hits before analysis")
+    if options.get('prerank') and results:
+        # Analyze in descending expected score, so max_articles keeps the most promising candidates
+        results = prerank_results(retriever, results, disease, events_text)
+    if options.get('max_articles'):
+        results = results[:int(options['max_articles'])]
+    return results, duplicates
+
+def request_concurrency(options):
+    return max(1, min(int(options.get('concurrency') or DEFAULT_CONCURRENCY), MAX_CONCURRENCY))
+
+def new_text_totals(options):
+    return {'mode': options.get('text_mode', 'full'), 'original_tokens': 0, 'prompt_tokens': 0, 'removed_tokens': 0}
+
+def rank_update_event(top_k, event):
+    """Add a finished article to the running top-K; return a rank_update event if the ordering changed."""
+    if top_k is None or event['type'] != 'article_analysis':
+        return None
+    metadata = event['data']['analysis']['article_metadata']
+    ordering = top_k.add(metadata.get('PMID'), metadata.get('overall_points', 0), {
+        'title': metadata.get('title'),
+        'rank': event['data']['rank'],
+    })
+    if ordering is None:
+        return None
+    return {
+        "type": "rank_update",
+        "data": {
+            "article_number": event['data']['progress']['article_number'],
+            "top": ordering
+        }
+    }
+
+def add_text_totals(totals, event):
+    """Accumulate an article event's estimated token counts into the request totals."""
+    report = event['data'].get('analysis', {}).get('text_preprocessing') if event['type'] == 'article_analysis' else None
+    if report:
+        for key in ('original_tokens', 'prompt_tokens', 'removed_tokens'):
+            totals[key] += report[key]
+
+def retrieval_event(results, duplicates):
+    """The retrieved candidates, in analysis order, before any article is analyzed."""
+    articles = []
+    for hit in results:
+        article = {"pmid": hit['name'], "rank": hit['rank'], "distance": hit.get('distance')}
+        if 'expected_score' in hit:
+            article["expected_score"] = hit['expected_score']
+        articles.append(article)
+    return {
+        "type": "retrieval",
+        "data": {
+            "total_articles": len(results),
+            "duplicates_skipped": duplicates,
+            "articles": articles
+        }
+    }
+
+def stream_response(events_text, methodology_content=None, disease=None, options=None):
+    options = options or {}
+    begin_request()
+    request_metrics = begin_request_metrics()
+    deadline = deadline_after(float(options.get('deadline_seconds') or REQUEST_DEADLINE_SECONDS))
+    yield from stream_analysis(events_text, methodology_content, disease, options, request_metrics, deadline)
 
-def stream_response(events_text, methodology_content=None, disease=None):
+def stream_analysis(events_text, methodology_content, disease, options, request_metrics, deadline, include_retrieval=False):
+    """Retrieve and analyze articles for events_text, yielding NDJSON lines; the request context is set up by the caller."""
+    executor = None
     try:
-        # Execute BigQuery
-        # Execute BigQuery and log results
-        query = create_bq_query(events_text)
-        query_job = bq_client.query(query)
-        results = list(query_job.result())
+        # Retrieve the closest articles with the configured backend; content is loaded later
+        retriever = get_retriever(options.get('retrieval_backend'))
+        results, duplicates = retrieve_candidates(retriever, events_text, disease, options)
         total_articles = len(results)
         
-        # Print array of PMIDs from BigQuery results
         pmids = [row['name'] for row in results]
-        print(f"Retrieved PMIDs: {pmids}")
+        logger.info(f"Retrieved {len(pmids)} articles", extra={'fields': {'pmids': pmids}})
+        if include_retrieval:
+            yield json.dumps(retrieval_event(results, duplicates)) + "\n"
 
         # Stream initial metadata
         yield json.dumps({
@@ -411,61 +992,46 @@ def stream_response(events_text, methodology_content=None, disease=None):
             "data": {
                 "total_articles": total_articles,
                 "current_article": 0,
-                "status": "processing"
+                "status": "processing",
+                "duplicates_skipped": duplicates
             }
         }) + "\n"
 
-        # Process each article
-        for idx, row in enumerate(results, 1):
-            pmid = row['name']
-            content = row['content']
-            
-            # Log article details before analysis
-            logger.info(f"Processing article:\nPMID: {pmid}\nContent length: {len(content)}\nFirst 200 chars: {content[:200]}")
-            
-            # Add delay between articles
-            if idx > 1:  # Don't delay for first article
-                logger.info("Waiting 5 seconds before next analysis...")
-                time.sleep(5)
-            
-            # Analyze with Gemini and prepare complete response object
-            try:
-                analysis = analyze_with_gemini(content, pmid, methodology_content, disease, events_text)
-                if analysis:
-                    # Create complete response object
-                    response_obj = {
-                        "type": "article_analysis",
-                        "data": {
-                            "progress": {
-                                "article_number": idx,
-                                "total_articles": total_articles
-                            },
-                            "analysis": analysis
-                        }
-                    }
-                    # Send complete JSON object with newline
-                    yield json.dumps(response_obj) + "\n"
-                else:
-                    logger.error(f"Failed to analyze article {pmid}")
-                    error_obj = {
-                        "type": "error",
-                        "data": {
-                            "message": f"Failed to analyze article {pmid}",
-                            "article_number": idx,
-                            "total_articles": total_articles
-                        }
-                    }
-                    yield json.dumps(error_obj) + "\n"
-            except Exception as e:
-                logger.error(f"Error processing article {pmid}: {str(e)}")
-                yield json.dumps({
-                    "type": "error",
-                    "data": {
-                        "message": f"Error processing article {pmid}: {str(e)}",
-                        "article_number": idx,
-                        "total_articles": total_articles
-                    }
-                }) + "\n"
+        concurrency = request_concurrency(options)
+        logger.info(f"Analyzing {total_articles} articles with concurrency {concurrency}")
+        content_loader = LazyContentLoader(retriever, pmids, batch_size=concurrency)
+        text_totals = new_text_totals(options)
+        top_k = TopK(options.get('top_n', DEFAULT_TOP_N)) if options.get('rank_updates') else None
+
+        if concurrency == 1:
+            # Sequential mode; pacing between articles comes from the shared rate limiter
+            for idx, row in enumerate(results, 1):
+                event = build_article_event(
+                    row, idx, total_articles,
+                    lambda: analyze_article(row, content_loader, methodology_content, disease, events_text, options, deadline)
+                )
+                add_text_totals(text_totals, event)
+                record_article(event['type'])
+                yield json.dumps(event) + "\n"
+                update = rank_update_event(top_k, event)
+                if update:
+                    yield json.dumps(update) + "\n"
+        else:
+            # Analyze articles in parallel and stream each one as soon as it finishes
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            futures = {
+                # Each worker runs in a copy of the request's context so its logs keep the request id and sampling
+                executor.submit(contextvars.copy_context().run, analyze_article, row, content_loader, methodology_content, disease, events_text, options, deadline): row
+                for row in results
+            }
+            for completed, future in enumerate(as_completed(futures), 1):
+                event = build_article_event(futures[future], completed, total_articles, future.result)
+                add_text_totals(text_totals, event)
+                record_article(event['type'])
+                yield json.dumps(event) + "\n"
+                update = rank_update_event(top_k, event)
+                if update:
+                    yield json.dumps(update) + "\n"
 
         # Send completion message as complete JSON object
         completion_obj = {
@@ -473,64 +1039,1069 @@ def stream_response(events_text, methodology_content=None, disease=None):
             "data": {
                 "total_articles": total_articles,
                 "current_article": total_articles,
-                "status": "complete"
+                "status": "complete",
+                "cache": request_metrics.cache_stats('analysis'),
+                "context_cache": prefix_cache.stats() if prefix_cache else None,
+                "text_preprocessing": text_totals,
+                "metrics": request_metrics.summary(),
+                "journal_snapshot": journal_store.info()
             }
         }
         yield json.dumps(completion_obj) + "\n"
 
     except Exception as e:
-        logger.error(f"Error in stream_response: {str(e)}")
+        logger.error(f"Error in stream_analysis: {str(e)}")
         yield json.dumps({
             "type": "error",
             "data": {
                 "message": str(e)
             }
         }) + "\n"
+    finally:
+        # Stop queued analyses if the client disconnected before completion
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-# Fetch journal impact data when module loads
-fetch_journal_impact_data()
+async def generate_content_async(prefix, prompt, config, deadline=None):
+    """generate_content() on the SDK's async client; the rate limiter waits without blocking the event loop."""
+    cached_name = await asyncio.to_thread(prefix_cache.get, prefix) if prefix and prefix_cache else None
+    if prefix and prefix_cache:
+        record_cache('context', cached_name is not None)
+    if cached_name:
+        try:
+            return await call_with_rate_limit_async(
+                lambda: client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=[types.Content(role="user", parts=[{"text": prompt}])],
+                    config=config.model_copy(update={'cached_content': cached_name}),
+                ),
+                deadline=deadline,
+            )
+        except Exception as e:
+            if isinstance(e, RateLimitExceeded) or is_rate_limit_error(e):
+                raise
+            logger.warning(f"Generation with context cache {cached_name} failed, sending the full prompt: {str(e)}")
+            prefix_cache.invalidate(prefix)
 
-@functions_framework.http
-def analyze_articles(request):
-    # Enable CORS
-    if request.method == 'OPTIONS':
-        headers = {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST',
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Access-Control-Max-Age': '3600'
-        }
-        return ('', 204, headers)
+    full_prompt = f"{prefix}\n\n{prompt}" if prefix else prompt
+    return await call_with_rate_limit_async(
+        lambda: client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=[types.Content(role="user", parts=[{"text": full_prompt}])],
+            config=config,
+        ),
+        deadline=deadline,
+    )
 
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Content-Type': 'text/event-stream',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive'
-    }
+async def generate_json_async(prompt, cache_parts, validate=None, deadline=None, use_cache=True, max_output_tokens=8192, response_schema=None, prefix=None):
+    """generate_json() for the asyncio path; cache backends that may block run in a worker thread."""
+    prompt, generate_content_config, cache_key = prepare_json_request(prompt, cache_parts, max_output_tokens, response_schema, prefix)
+    with timed('cache_lookup'):
+        response_text = await asyncio.to_thread(analysis_cache.get, cache_key) if use_cache else None
+    cache_hit = response_text is not None
+    if use_cache:
+        record_cache('analysis', cache_hit)
+    if cache_hit:
+        logger.info(f"Cache hit for {cache_parts.get('pmid', 'request')}")
+    else:
+        with timed('gemini_call'):
+            response = await generate_content_async(prefix, prompt, generate_content_config, deadline)
+        record_usage(response)
+        response_text = response.text or ""
+
+    with timed('parse'):
+        result = parse_json_response(response_text, validate, response_schema)
+    if result is None:
+        log_payload(logger, "Prompt of rejected response", prompt, logging.ERROR, force=True, **cache_parts_summary(cache_parts))
+    if result is not None and not cache_hit:
+        await asyncio.to_thread(analysis_cache.set, cache_key, response_text)
+    return result
+
+async def generate_structured_analysis_async(prefix, prompt, pmid, article_text, deadline=None, use_cache=True):
+    """generate_structured_analysis() for the asyncio path."""
+    cache_parts = {'pmid': pmid, 'content': article_text}
+    result = await generate_json_async(prompt, cache_parts, validate=lambda r: isinstance(r, dict), deadline=deadline,
+                                       use_cache=use_cache, response_schema=article_response_schema(), prefix=prefix)
+    if result is None:
+        return None
+    metadata = parse_article_metadata(result)
+    missing = missing_fields(metadata)
+    if missing:
+        logger.warning(f"Structured analysis of {pmid} is missing {missing}, asking for those fields only")
+        patch = await generate_json_async(
+            create_missing_fields_prompt(prompt, metadata, missing),
+            {**cache_parts, 'missing': missing},
+            validate=lambda r: isinstance(r, dict),
+            deadline=deadline,
+            use_cache=use_cache,
+            max_output_tokens=1024,
+            response_schema=article_response_schema(missing),
+            prefix=prefix,
+        )
+        if patch is not None:
+            metadata = merge_metadata(metadata, parse_article_metadata(patch))
+        missing = missing_fields(metadata)
+        if missing:
+            logger.error(f"Invalid JSON structure - missing {missing} after re-ask")
+            return None
+    return {'article_metadata': metadata.model_dump(exclude_none=True)}
 
+async def analyze_with_gemini_async(article_text, pmid, methodology_content=None, disease=None, events_text=None, deadline=None, use_cache=True, output_mode='text'):
+    with timed('prompt_build'):
+        prefix, prompt = create_gemini_prompt_parts(article_text, pmid, methodology_content, disease, events_text)
+    if output_mode == 'structured':
+        analysis = await generate_structured_analysis_async(prefix, prompt, pmid, article_text, deadline, use_cache)
+    else:
+        analysis = await generate_json_async(
+            prompt,
+            {'pmid': pmid, 'content': article_text},
+            validate=validate_article_analysis,
+            deadline=deadline,
+            use_cache=use_cache,
+            prefix=prefix,
+        )
+    if analysis is None:
+        return None
     try:
-        request_json = request.get_json()
-        if not request_json:
-            return jsonify({'error': 'No JSON data received'}), 400, headers
+        return finalize_analysis(analysis, article_text, pmid, disease)
+    except Exception as e:
+        logger.error(f"Error analyzing article with Gemini: {str(e)}")
+        return None
 
-        events_text = request_json.get('events_text')
-        if not events_text:
-            return jsonify({'error': 'Missing events_text field'}), 400, headers
+async def analyze_article_async(hit, content_loader, methodology_content=None, disease=None, events_text=None, options=None, deadline=None,
+                                cancelled=None):
+    """analyze_article() for the asyncio path; BigQuery reads and the two-stage pipeline run in worker threads.
 
-        # Get methodology content and disease if provided
-        methodology_content = request_json.get('methodology_content')
-        disease = request_json.get('disease')
+    Cancelling the task does not stop a worker thread, so the two-stage thread checks cancelled before each
+    Gemini call; the call already in flight, and a content fetch, still run to completion.
+    """
+    options = options or {}
+    pmid = hit['name']
+    with timed('content_fetch'):
+        content = await asyncio.to_thread(content_loader.get, pmid)
+    if content is None:
+        raise ValueError(f"No content found for article {pmid}")
 
-        return Response(
-            stream_response(events_text, methodology_content, disease),
-            headers=headers,
-            mimetype='text/event-stream'
+    logger.info(f"Processing article {pmid}", extra={'fields': {'pmid': pmid, 'content_length': len(content)}})
+
+    use_cache = options.get('use_cache', True)
+    text_mode = options.get('text_mode', 'full')
+    if options.get('pipeline') == 'two_stage':
+        with timed('prompt_build'):
+            prompt_text, report = prepare_article_text(content, 'clean' if text_mode == 'window' else text_mode)
+        analysis = await asyncio.to_thread(
+            run_cancellable, cancelled, analyze_two_stage, prompt_text, pmid, disease, events_text, options.get('match_mode', 'llm'),
+            deadline, use_cache
         )
+    else:
+        with timed('prompt_build'):
+            prompt_text, report = prepare_article_text(content, text_mode, disease, events_text, options.get('token_budget', DEFAULT_TOKEN_BUDGET))
+        analysis = await analyze_with_gemini_async(prompt_text, pmid, methodology_content, disease, events_text, deadline, use_cache,
+                                                   options.get('output_mode', 'text'))
+    return attach_article_details(analysis, pmid, content, report, options)
 
-    except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
-        return jsonify({"error": str(e)}), 500, headers
+async def stream_response_async(events_text, methodology_content=None, disease=None, options=None):
+    """stream_response() on asyncio: the same NDJSON events, with outstanding analyses cancelled if the client goes away."""
+    options = options or {}
+    begin_request()
+    request_metrics = begin_request_metrics()
+    deadline = deadline_after(float(options.get('deadline_seconds') or REQUEST_DEADLINE_SECONDS))
+    async for line in stream_analysis_async(events_text, methodology_content, disease, options, request_metrics, deadline):
+        yield line
+
+async def stream_analysis_async(events_text, methodology_content, disease, options, request_metrics, deadline, include_retrieval=False):
+    """stream_analysis() on asyncio.
+
+    When the client disconnects, outstanding analyses are cancelled: coroutines stop at once, and
+    threaded stages stop before their next Gemini call. Retrieval and content fetches that have
+    started, and a Gemini call already in flight in a thread, are not interrupted.
+    """
+    tasks = {}
+    cancelled = threading.Event()
+    try:
+        retriever = get_retriever(options.get('retrieval_backend'))
+        results, duplicates = await asyncio.to_thread(retrieve_candidates, retriever, events_text, disease, options)
+        total_articles = len(results)
+
+        pmids = [row['name'] for row in results]
+        logger.info(f"Retrieved {len(pmids)} articles", extra={'fields': {'pmids': pmids}})
+        if include_retrieval:
+            yield json.dumps(retrieval_event(results, duplicates)) + "\n"
+
+        yield json.dumps({
+            "type": "metadata",
+            "data": {
+                "total_articles": total_articles,
+                "current_article": 0,
+                "status": "processing",
+                "duplicates_skipped": duplicates
+            }
+        }) + "\n"
+
+        concurrency = request_concurrency(options)
+        logger.info(f"Analyzing {total_articles} articles with concurrency {concurrency}")
+        content_loader = LazyContentLoader(retriever, pmids, batch_size=concurrency)
+        text_totals = new_text_totals(options)
+        top_k = TopK(options.get('top_n', DEFAULT_TOP_N)) if options.get('rank_updates') else None
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def analyze(row):
+            # Tasks acquire the semaphore in creation order, so articles start in rank order
+            async with semaphore:
+                return await analyze_article_async(row, content_loader, methodology_content, disease, events_text, options, deadline,
+                                                   cancelled)
+
+        tasks = {asyncio.create_task(analyze(row)): row for row in results}
+        pending = set(tasks)
+        completed = 0
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                completed += 1
+                event = build_article_event(tasks[task], completed, total_articles, task.result)
+                add_text_totals(text_totals, event)
+                record_article(event['type'])
+                yield json.dumps(event) + "\n"
+                update = rank_update_event(top_k, event)
+                if update:
+                    yield json.dumps(update) + "\n"
+
+        yield json.dumps({
+            "type": "metadata",
+            "data": {
+                "total_articles": total_articles,
+                "current_article": total_articles,
+                "status": "complete",
+                "cache": request_metrics.cache_stats('analysis'),
+                "context_cache": prefix_cache.stats() if prefix_cache else None,
+                "text_preprocessing": text_totals,
+                "metrics": request_metrics.summary(),
+                "journal_snapshot": journal_store.info()
+            }
+        }) + "\n"
+
+    except Exception as e:
+        logger.error(f"Error in stream_analysis_async: {str(e)}")
+        yield json.dumps({
+            "type": "error",
+            "data": {
+                "message": str(e)
+            }
+        }) + "\n"
+    finally:
+        # Starlette cancels the stream when the client disconnects; stop paying for its remaining analyses
+        outstanding = [task for task in tasks if not task.done()]
+        if outstanding:
+            cancelled.set()
+        for task in outstanding:
+            task.cancel()
+        if outstanding:
+            logger.info(f"Cancelled {len(outstanding)} outstanding article analyses")
+
+def stored_feature_table(pmids, disease, events_text):
+    """Feature table of stored extractions matched to a patient by lookup (no LLM calls); returns (table, missing PMIDs)."""
+    key = make_cache_key(pmids=pmids, disease=disease, events_text=events_text, journals=journal_store.info()['version'],
+                         prompt_version=EXTRACTION_PROMPT_VERSION, model=GEMINI_MODEL)
+    cached = feature_tables.get(key)
+    record_cache('feature_table', cached is not None)
+    if cached is not None:
+        return cached
+
+    metadatas = []
+    missing = []
+    for pmid in pmids:
+        extraction = get_stored_extraction(pmid)
+        if extraction is None:
+            missing.append(pmid)
+            continue
+        metadata = combine_extraction(extraction, *match_patient(extraction, disease or '', events_text or '', 'lookup'))
+        metadata['PMID'] = pmid
+        resolve_journal_sjr(metadata)
+        metadatas.append(metadata)
+    table = FeatureTable.from_metadata(metadatas)
+    feature_tables.set(key, (table, missing))
+    return table, missing
+
+def posted_article_metadata(articles):
+    """article_metadata dicts from the articles posted to rescore_articles; raises ValueError for anything else."""
+    if not isinstance(articles, list):
+        raise ValueError("articles must be a list")
+    metadatas = []
+    for i, article in enumerate(articles):
+        if isinstance(article, dict):
+            article = article.get('analysis', article)
+        if isinstance(article, dict):
+            article = article.get('article_metadata', article)
+        if not isinstance(article, dict):
+            raise ValueError(f"articles[{i}] must be an object with article metadata")
+        metadata = dict(article)
+        if 'journal_sjr' not in metadata:
+            resolve_journal_sjr(metadata)
+        metadatas.append(metadata)
+    return metadatas
+
+def rescore(table, weights, top_n):
+    """Rank a feature table with a weight profile; returns the top_n articles with their points and breakdowns."""
+    with timed('scoring'):
+        totals, components = score_table(table, weights)
+        order = rank_order(totals)[:top_n]
+    return [
+        {
+            "position": position,
+            "PMID": table.pmids[i],
+            "title": table.titles[i],
+            "overall_points": as_number(totals[i]),
+            "point_breakdown": breakdown_at(components, i),
+        }
+        for position, i in enumerate(order, 1)
+    ]
+
+def analysis_request_key(events_text, methodology_content, disease, options):
+    """Identity of an analysis request for attaching duplicate submissions; compression only affects transport."""
+    return make_cache_key(
+        events_text=events_text,
+        methodology_content=methodology_content,
+        disease=disease,
+        options={name: value for name, value in options.items() if name != 'compress'},
+    )
+
+def job_event(job_id, attached=False, resumed_after=None):
+    """Unnumbered event with a job's id and status, sent when a client connects and when the job ends."""
+    info = job_manager.status(job_id)
+    data = {"job_id": job_id, "status": info['status'], "last_event_id": info['last_event_id']}
+    if attached:
+        data["attached"] = True
+    if resumed_after is not None:
+        data["resumed_after"] = resumed_after
+    return json.dumps({"type": "job", "data": data}) + "\n"
+
+def stream_job(job_id, after_id=0, attached=False):
+    """A job's events after after_id, framed by job status events; the job keeps running if the client leaves."""
+    yield job_event(job_id, attached, after_id or None)
+    yield from job_manager.follow(job_id, after_id)
+    if job_manager.status(job_id)['status'] == INTERRUPTED:
+        yield json.dumps({"type": "error", "data": {"message": f"Job {job_id} was interrupted by an instance restart; submit the request again"}}) + "\n"
+    yield job_event(job_id)
+
+def warm_pipeline(options):
+    """Load the retriever and journal index, so they are ready when the case extraction finishes."""
+    try:
+        get_retriever(options.get('retrieval_backend'))
+        journal_store.index()
+    except Exception as e:
+        # Retrieval reports the same error to the client
+        logger.warning(f"Pipeline warm-up failed: {str(e)}")
+
+def extract_case_for_pipeline(case_notes, events_prompt, grounding, options, deadline):
+    """Run the case extraction and build its NDJSON event; returns (extraction, event)."""
+    with timed('case_extraction'):
+        extraction, cached = extract_case(
+            client, case_extraction_cache, CASE_EXTRACTION_MODEL, case_notes, events_prompt, grounding,
+            options.get('use_cache', True), deadline, record_usage
+        )
+    record_cache('case_extraction', cached)
+    events_text = events_query_text(extraction)
+    logger.info(f"Extracted {extraction['disease']} with {len(extraction['events'])} events", extra={'fields': {'cached': cached}})
+    return extraction, {
+        "type": "extraction",
+        "data": {
+            **extraction,
+            "events_text": events_text,
+            "cached": cached,
+            "grounding": grounding
+        }
+    }
+
+def stream_case_pipeline(case_notes, methodology_content=None, events_prompt=None, grounding=False, options=None):
+    """Case notes to analyzed articles in one stream: an extraction event, a retrieval event, then stream_response()'s events."""
+    options = options or {}
+    begin_request()
+    request_metrics = begin_request_metrics()
+    deadline = deadline_after(float(options.get('deadline_seconds') or REQUEST_DEADLINE_SECONDS))
+    threading.Thread(target=contextvars.copy_context().run, args=(warm_pipeline, options), daemon=True).start()
+    try:
+        extraction, event = extract_case_for_pipeline(case_notes, events_prompt, grounding, options, deadline)
+    except Exception as e:
+        logger.error(f"Error extracting case notes: {str(e)}")
+        yield json.dumps({"type": "error", "data": {"message": f"Error extracting case notes: {str(e)}"}}) + "\n"
+        return
+    yield json.dumps(event) + "\n"
+    yield from stream_analysis(event['data']['events_text'], methodology_content, extraction['disease'], options,
+                               request_metrics, deadline, include_retrieval=True)
+
+async def stream_case_pipeline_async(case_notes, methodology_content=None, events_prompt=None, grounding=False, options=None):
+    """stream_case_pipeline() on asyncio."""
+    options = options or {}
+    begin_request()
+    request_metrics = begin_request_metrics()
+    deadline = deadline_after(float(options.get('deadline_seconds') or REQUEST_DEADLINE_SECONDS))
+    warmup = asyncio.create_task(asyncio.to_thread(warm_pipeline, options))
+    try:
+        try:
+            extraction, event = await asyncio.to_thread(extract_case_for_pipeline, case_notes, events_prompt, grounding, options, deadline)
+        except Exception as e:
+            logger.error(f"Error extracting case notes: {str(e)}")
+            yield json.dumps({"type": "error", "data": {"message": f"Error extracting case notes: {str(e)}"}}) + "\n"
+            return
+        # Sent as soon as it is ready; retrieval waits on the retriever the warm-up is still loading, if any
+        yield json.dumps(event) + "\n"
+        async for line in stream_analysis_async(event['data']['events_text'], methodology_content, extraction['disease'], options,
+                                                request_metrics, deadline, include_retrieval=True):
+            yield line
+    finally:
+        # warm_pipeline logs its own errors; cancelling only stops waiting for it, the thread runs to completion
+        warmup.cancel()
+
+def parse_case_request(request_json):
+    """Case notes, pipeline settings and analysis options from a case pipeline request body."""
+    return {
+        'case_notes': request_json.get('case_notes'),
+        'methodology_content': request_json.get('methodology_content'),
+        'events_prompt': request_json.get('events_prompt'),
+        'grounding': bool_option(request_json, 'grounding', DEFAULT_CASE_GROUNDING),
+        'options': parse_analysis_options(request_json),
+    }
+
+def parse_batch_patients(request_json):
+    """The batch's patients as {'id', 'case_notes', 'disease', 'events_text'} dicts."""
+    patients = request_json.get('patients')
+    if not isinstance(patients, list) or not patients:
+        raise ValueError("patients must be a non-empty list")
+    if len(patients) > MAX_BATCH_PATIENTS:
+        raise ValueError(f"At most {MAX_BATCH_PATIENTS} patients per batch")
+    parsed = []
+    for index, patient in enumerate(patients, 1):
+        if not isinstance(patient, dict) or not (patient.get('case_notes') or patient.get('events_text')):
+            raise ValueError(f"Patient {index} needs case_notes or events_text")
+        parsed.append({
+            'id': str(patient.get('id') or index),
+            'case_notes': patient.get('case_notes'),
+            'disease': patient.get('disease'),
+            'events_text': patient.get('events_text'),
+        })
+    if len({patient['id'] for patient in parsed}) != len(parsed):
+        raise ValueError("Patient ids must be unique")
+    return parsed
+
+def patient_event(patient, event):
+    """Tag a stream event with the batch patient it belongs to."""
+    return json.dumps({"type": event['type'], "patient": patient['id'], "data": event['data']}) + "\n"
+
+def prepare_batch_patient(patient, events_prompt, grounding, retriever, options, deadline):
+    """Extract a patient's case notes unless events were given, then retrieve their candidates; returns (events, hits)."""
+    events = []
+    if not patient['events_text']:
+        extraction, event = extract_case_for_pipeline(patient['case_notes'], events_prompt, grounding, options, deadline)
+        patient['disease'] = extraction['disease']
+        patient['events_text'] = event['data']['events_text']
+        events.append(event)
+    hits, duplicates = retrieve_candidates(retriever, patient['events_text'], patient['disease'], options)
+    events.append(retrieval_event(hits, duplicates))
+    return events, hits
+
+def analyze_shared_article(pmid, readers, content_loader, options, deadline):
+    """Extract an article once and analyze it for every patient who retrieved it; returns {patient id: analysis or error}."""
+    with timed('content_fetch'):
+        content = content_loader.get(pmid)
+    if content is None:
+        raise ValueError(f"No content found for article {pmid}")
+    use_cache = options.get('use_cache', True)
+    text_mode = options.get('text_mode', 'full')
+    # Extractions are shared between patients, so their text must not depend on any of them
+    with timed('prompt_build'):
+        prompt_text, report = prepare_article_text(content, 'clean' if text_mode == 'window' else text_mode)
+    extraction = extract_article(prompt_text, pmid, deadline, use_cache)
+    results = {}
+    for patient, _ in readers:
+        try:
+            analysis = None
+            if extraction is not None:
+                analysis = analyze_for_patient(extraction, prompt_text, pmid, patient['disease'], patient['events_text'],
+                                               options.get('match_mode', 'llm'), deadline, use_cache)
+            results[patient['id']] = attach_article_details(analysis, pmid, content, report, options)
+        except Exception as e:
+            results[patient['id']] = e
+    return results
+
+def outcome_result(outcome):
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+def patient_complete_event(patient):
+    total_articles = len(patient['hits'])
+    return {
+        "type": "metadata",
+        "data": {
+            "total_articles": total_articles,
+            "current_article": total_articles,
+            "status": "complete"
+        }
+    }
+
+def stream_batch(patients, events_prompt=None, grounding=False, options=None):
+    """Analyze several patients in one stream, extracting each article retrieved for any of them only once.
+
+    Every patient's retrieval hits are pooled by PMID; each unique article is extracted once
+    (two-stage pipeline) under the request's concurrency budget, then matched and scored for each
+    patient who retrieved it. Patient events carry a "patient" id; "batch" events cover the whole batch.
+    """
+    options = options or {}
+    executor = None
+    begin_request()
+    request_metrics = begin_request_metrics()
+    deadline = deadline_after(float(options.get('deadline_seconds') or REQUEST_DEADLINE_SECONDS))
+    try:
+        retriever = get_retriever(options.get('retrieval_backend'))
+        concurrency = request_concurrency(options)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        # Case extraction and retrieval for all patients, streamed as each patient is ready
+        futures = {
+            executor.submit(contextvars.copy_context().run, prepare_batch_patient, patient, events_prompt, grounding, retriever, options, deadline): patient
+            for patient in patients
+        }
+        ready = []
+        for future in as_completed(futures):
+            patient = futures[future]
+            try:
+                events, hits = future.result()
+            except Exception as e:
+                logger.error(f"Error preparing batch patient {patient['id']}: {str(e)}")
+                yield patient_event(patient, {"type": "error", "data": {"message": f"Error preparing patient: {str(e)}"}})
+                continue
+            for event in events:
+                yield patient_event(patient, event)
+            patient['hits'] = hits
+            patient['completed'] = 0
+            patient['top_k'] = TopK(options.get('top_n', DEFAULT_TOP_N)) if options.get('rank_updates') else None
+            ready.append(patient)
+
+        # Pool the hits by PMID; articles ranked highly for any patient are analyzed first
+        readers = {}
+        for patient in ready:
+            for hit in patient['hits']:
+                readers.setdefault(hit['name'], []).append((patient, hit))
+        pmids = sorted(readers, key=lambda pmid: min(hit['rank'] for _, hit in readers[pmid]))
+        total_articles = sum(len(patient['hits']) for patient in ready)
+        summary = {
+            "patients": len(ready),
+            "failed_patients": len(patients) - len(ready),
+            "total_articles": total_articles,
+            "unique_articles": len(pmids),
+            "shared_articles": total_articles - len(pmids)
+        }
+        logger.info(f"Batch of {len(ready)} patients retrieved {total_articles} articles, {len(pmids)} unique")
+        yield json.dumps({"type": "batch", "data": {"status": "processing", **summary}}) + "\n"
+        for patient in ready:
+            if not patient['hits']:
+                yield patient_event(patient, patient_complete_event(patient))
+
+        content_loader = LazyContentLoader(retriever, pmids, batch_size=concurrency)
+        article_futures = {
+            executor.submit(contextvars.copy_context().run, analyze_shared_article, pmid, readers[pmid], content_loader, options, deadline): pmid
+            for pmid in pmids
+        }
+        for future in as_completed(article_futures):
+            pmid = article_futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                results = {patient['id']: e for patient, _ in readers[pmid]}
+            for patient, hit in readers[pmid]:
+                patient['completed'] += 1
+                outcome = results.get(patient['id'])
+                event = build_article_event(hit, patient['completed'], len(patient['hits']), lambda: outcome_result(outcome))
+                record_article(event['type'])
+                yield patient_event(patient, event)
+                update = rank_update_event(patient['top_k'], event)
+                if update:
+                    yield patient_event(patient, update)
+                if patient['completed'] == len(patient['hits']):
+                    yield patient_event(patient, patient_complete_event(patient))
+
+        yield json.dumps({
+            "type": "batch",
+            "data": {
+                "status": "complete",
+                **summary,
+                "cache": request_metrics.cache_stats('analysis'),
+                "metrics": request_metrics.summary(),
+                "journal_snapshot": journal_store.info()
+            }
+        }) + "\n"
+
+    except Exception as e:
+        logger.error(f"Error in stream_batch: {str(e)}")
+        yield json.dumps({
+            "type": "error",
+            "data": {
+                "message": str(e)
+            }
+        }) + "\n"
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# Build the query embedding stage shared by all requests
+query_embedder = create_query_embedder()
+
+# Count 429s, backoff and limiter waits in the metrics
+add_observer(record_rate_limit_event)
+
+@functions_framework.http
+def analyze_articles(request):
+    # Enable CORS
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive'
+    }
+
+    try:
+        request_json = request.get_json()
+        if not request_json:
+            return jsonify({'error': 'No JSON data received'}), 400, headers
+
+        events_text = request_json.get('events_text')
+        if not events_text:
+            return jsonify({'error': 'Missing events_text field'}), 400, headers
+
+        # Get methodology content and disease if provided
+        methodology_content = request_json.get('methodology_content')
+        disease = request_json.get('disease')
+        try:
+            options = parse_analysis_options(request_json)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400, headers
+
+        stream = stream_response(events_text, methodology_content, disease, options)
+        encoding = choose_encoding(request.headers.get('Accept-Encoding')) if options['compress'] else None
+        if encoding:
+            stream = compress_stream(stream, encoding)
+            headers['Content-Encoding'] = encoding
+            headers['Vary'] = 'Accept-Encoding'
+
+        return Response(
+            stream,
+            headers=headers,
+            mimetype='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return jsonify({"error": str(e)}), 500, headers
+
+@functions_framework.http
+def analyze_case(request):
+    """Case notes in, analyzed articles out: one NDJSON stream of extraction, retrieval and article events.
+
+    Body: {"case_notes", "events_prompt"?, "grounding"?, "methodology_content"?} plus the analyze_articles options.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive'
+    }
+
+    try:
+        request_json = request.get_json()
+        if not request_json:
+            return jsonify({'error': 'No JSON data received'}), 400, headers
+
+        try:
+            case_request = parse_case_request(request_json)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400, headers
+        if not case_request['case_notes']:
+            return jsonify({'error': 'Missing case_notes field'}), 400, headers
+
+        stream = stream_case_pipeline(**case_request)
+        encoding = choose_encoding(request.headers.get('Accept-Encoding')) if case_request['options']['compress'] else None
+        if encoding:
+            stream = compress_stream(stream, encoding)
+            headers['Content-Encoding'] = encoding
+            headers['Vary'] = 'Accept-Encoding'
+
+        return Response(
+            stream,
+            headers=headers,
+            mimetype='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return jsonify({"error": str(e)}), 500, headers
+
+@functions_framework.http
+def analyze_batch(request):
+    """Several patients in one NDJSON stream, with articles shared between patients extracted once.
+
+    Body: {"patients": [{"id"?, "case_notes"} or {"id"?, "disease", "events_text"}], "events_prompt"?, "grounding"?}
+    plus the analyze_articles options; articles are always analyzed with the two-stage pipeline.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive'
+    }
+
+    try:
+        request_json = request.get_json()
+        if not request_json:
+            return jsonify({'error': 'No JSON data received'}), 400, headers
+
+        try:
+            patients = parse_batch_patients(request_json)
+            options = parse_analysis_options(request_json)
+            grounding = bool_option(request_json, 'grounding', DEFAULT_CASE_GROUNDING)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400, headers
+        options['pipeline'] = 'two_stage'
+
+        stream = stream_batch(patients, request_json.get('events_prompt'), grounding, options)
+        encoding = choose_encoding(request.headers.get('Accept-Encoding')) if options['compress'] else None
+        if encoding:
+            stream = compress_stream(stream, encoding)
+            headers['Content-Encoding'] = encoding
+            headers['Vary'] = 'Accept-Encoding'
+
+        return Response(
+            stream,
+            headers=headers,
+            mimetype='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return jsonify({"error": str(e)}), 500, headers
+
+@functions_framework.http
+def rescore_articles(request):
+    """Re-rank analyzed articles with a weight profile, without any LLM calls.
+
+    Body: {"weights"?, "top_n"?} and either "articles" (article_analysis data or article_metadata from
+    an earlier stream) or "pmids", "disease" and "events_text" to score stored extractions; with neither,
+    every precomputed extraction is scored.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {'Access-Control-Allow-Origin': '*'}
+
+    try:
+        request_json = request.get_json(silent=True) or {}
+        try:
+            weights = resolve_weights(request_json.get('weights'))
+            top_n = max(1, int(request_json.get('top_n') or RESCORE_TOP_N))
+            pmids = request_json.get('pmids')
+            if pmids is not None and not isinstance(pmids, list):
+                raise ValueError("pmids must be a list")
+            start = time.perf_counter()
+            if request_json.get('articles') is not None:
+                metadatas = posted_article_metadata(request_json['articles'])
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': str(e)}), 400, headers
+
+        missing = []
+        if request_json.get('articles') is not None:
+            table = FeatureTable.from_metadata(metadatas)
+        else:
+            pmids = [str(pmid) for pmid in pmids] if pmids is not None else sorted(get_precomputed_extractions())
+            table, missing = stored_feature_table(pmids, request_json.get('disease'), request_json.get('events_text'))
+        table_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ranked = rescore(table, weights, top_n)
+        scoring_seconds = time.perf_counter() - start
+        logger.info(f"Re-scored {len(table)} articles in {scoring_seconds * 1000:.1f}ms")
+
+        return jsonify({
+            'total_articles': len(table),
+            'missing_pmids': missing,
+            'weights': weights,
+            'articles': ranked,
+            'timing': {'table_seconds': round(table_seconds, 4), 'scoring_seconds': round(scoring_seconds, 4)},
+        }), 200, headers
+
+    except Exception as e:
+        logger.error(f"Error re-scoring articles: {str(e)}")
+        return jsonify({"error": str(e)}), 500, headers
+
+@functions_framework.http
+def analysis_job(request):
+    """analyze_articles as a resumable job: results are kept on the server and clients reconnect from their last event.
+
+    POST the analyze_articles body to start a job, or attach to the running job for the same request.
+    POST {"job_id", "last_event_id"} (or send a Last-Event-ID header) to replay and follow a job.
+    GET ?job_id=... returns the job's status. Events carry an "id"; "job" events report the job's state.
+
+    Jobs are kept in a local SQLite file and run in this instance's process, so they can only be followed on
+    the instance that started them: with several instances a reconnect may get a 404 for a running job, and
+    clients should then submit the request again. Deploy with a single instance (or session affinity) for
+    reconnects to resume reliably.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST',
+            'Access-Control-Allow-Headers': 'Content-Type, Last-Event-ID',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    if request.method == 'GET':
+        headers = {'Access-Control-Allow-Origin': '*'}
+        info = job_manager.status(request.args.get('job_id', ''))
+        if info is None:
+            return jsonify({'error': 'Unknown job'}), 404, headers
+        return jsonify(info), 200, headers
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive'
+    }
+
+    try:
+        request_json = request.get_json()
+        if not request_json:
+            return jsonify({'error': 'No JSON data received'}), 400, headers
+
+        attached = False
+        if request_json.get('job_id'):
+            job_id = str(request_json['job_id'])
+            if job_manager.status(job_id) is None:
+                return jsonify({'error': f'Unknown job {job_id}'}), 404, headers
+            try:
+                after_id = int(request_json.get('last_event_id') or request.headers.get('Last-Event-ID') or 0)
+            except ValueError:
+                return jsonify({'error': 'last_event_id must be an integer'}), 400, headers
+            try:
+                compress = bool_option(request_json, 'compress', DEFAULT_COMPRESS_STREAM)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400, headers
+        else:
+            events_text = request_json.get('events_text')
+            if not events_text:
+                return jsonify({'error': 'Missing events_text field'}), 400, headers
+            methodology_content = request_json.get('methodology_content')
+            disease = request_json.get('disease')
+            try:
+                options = parse_analysis_options(request_json)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400, headers
+            job_id, attached = job_manager.submit(
+                analysis_request_key(events_text, methodology_content, disease, options),
+                lambda: stream_response(events_text, methodology_content, disease, options)
+            )
+            after_id = 0
+            compress = options['compress']
+
+        stream = stream_job(job_id, after_id, attached)
+        encoding = choose_encoding(request.headers.get('Accept-Encoding')) if compress else None
+        if encoding:
+            stream = compress_stream(stream, encoding)
+            headers['Content-Encoding'] = encoding
+            headers['Vary'] = 'Accept-Encoding'
+
+        return Response(
+            stream,
+            headers=headers,
+            mimetype='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return jsonify({"error": str(e)}), 500, headers
+
+@functions_framework.http
+def get_article_text(request):
+    """Full text of one article by PMID (GET ?pmid=...), with ETag revalidation and optional compression."""
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+    }
+    if request.method == 'OPTIONS':
+        headers.update({
+            'Access-Control-Allow-Methods': 'GET',
+            'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+            'Access-Control-Max-Age': '3600'
+        })
+        return ('', 204, headers)
+
+    try:
+        pmid = (request.args.get('pmid') or '').strip()
+        if not pmid:
+            return jsonify({'error': 'Missing pmid parameter'}), 400, headers
+
+        content = article_text_cache.get(pmid)
+        record_cache('article_text', content is not None)
+        if content is None:
+            content = get_retriever(request.args.get('retrieval_backend')).fetch_contents([pmid]).get(pmid)
+            if content is None:
+                return jsonify({'error': f'No content found for article {pmid}'}), 404, headers
+            article_text_cache.set(pmid, content)
+
+        # Article text never changes for a PMID, so browsers can cache it and revalidate cheaply
+        etag = '"' + hashlib.sha256(content.encode('utf-8')).hexdigest()[:32] + '"'
+        headers['ETag'] = etag
+        headers['Cache-Control'] = f'public, max-age={ARTICLE_TEXT_MAX_AGE_SECONDS}'
+        headers['Vary'] = 'Accept-Encoding'
+        if etag in [tag.strip() for tag in (request.headers.get('If-None-Match') or '').split(',')]:
+            return ('', 304, headers)
+
+        body = content
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding:
+            body = compress_body(content, encoding)
+            headers['Content-Encoding'] = encoding
+        headers['Content-Type'] = 'text/plain; charset=utf-8'
+        return (body, 200, headers)
+
+    except Exception as e:
+        logger.error(f"Error fetching article text: {str(e)}")
+        return jsonify({"error": str(e)}), 500, headers
+
+@functions_framework.http
+def analysis_metrics(request):
+    """This instance's counters and stage latency histograms in the Prometheus text format."""
+    return (render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+@functions_framework.aio.http
+async def analyze_articles_async(request):
+    """asyncio entry point with the same request body and NDJSON stream as analyze_articles (serve with --asgi)."""
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return StarletteResponse('', status_code=204, headers=headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive'
+    }
+
+    try:
+        request_json = await request.json()
+        if not request_json:
+            return JSONResponse({'error': 'No JSON data received'}, status_code=400, headers=headers)
+
+        events_text = request_json.get('events_text')
+        if not events_text:
+            return JSONResponse({'error': 'Missing events_text field'}, status_code=400, headers=headers)
+
+        methodology_content = request_json.get('methodology_content')
+        disease = request_json.get('disease')
+        try:
+            options = parse_analysis_options(request_json)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400, headers=headers)
+
+        stream = stream_response_async(events_text, methodology_content, disease, options)
+        encoding = choose_encoding(request.headers.get('accept-encoding')) if options['compress'] else None
+        if encoding:
+            stream = compress_stream_async(stream, encoding)
+            headers['Content-Encoding'] = encoding
+            headers['Vary'] = 'Accept-Encoding'
+
+        return StreamingResponse(
+            stream,
+            headers=headers,
+            media_type='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500, headers=headers)
+
+@functions_framework.aio.http
+async def analyze_case_async(request):
+    """asyncio entry point with the same request body and NDJSON stream as analyze_case (serve with --asgi)."""
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return StarletteResponse('', status_code=204, headers=headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive'
+    }
+
+    try:
+        request_json = await request.json()
+        if not request_json:
+            return JSONResponse({'error': 'No JSON data received'}, status_code=400, headers=headers)
+
+        try:
+            case_request = parse_case_request(request_json)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400, headers=headers)
+        if not case_request['case_notes']:
+            return JSONResponse({'error': 'Missing case_notes field'}, status_code=400, headers=headers)
+
+        stream = stream_case_pipeline_async(**case_request)
+        encoding = choose_encoding(request.headers.get('accept-encoding')) if case_request['options']['compress'] else None
+        if encoding:
+            stream = compress_stream_async(stream, encoding)
+            headers['Content-Encoding'] = encoding
+            headers['Vary'] = 'Accept-Encoding'
+
+        return StreamingResponse(
+            stream,
+            headers=headers,
+            media_type='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500, headers=headers)
 
 if __name__ == "__main__":
     app = functions_framework.create_app(target="analyze_articles")
@@ -0,0 +1,259 @@
+"""Per-stage latency, token usage, throttling and cache metrics for article analysis.
+
+Every observation updates two places: the process-wide series below, which
+render_prometheus() exposes in the Prometheus text format (also scraped by
+the OpenTelemetry Collector's prometheus receiver), and the RequestMetrics
+of the current request, whose summary() is sent in the stream's final
+metadata event.
+
+timed() records exclusive stage times: time spent in a stage nested inside
+another (the query embedding inside a vector search) counts only for the
+nested stage, so a request's stage totals add up without double counting.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Token counts reported in a Gemini response's usage_metadata
+USAGE_FIELDS = {
+    'prompt': 'prompt_token_count',
+    'output': 'candidates_token_count',
+    'cached': 'cached_content_token_count',
+    'thoughts': 'thoughts_token_count',
+    'total': 'total_token_count',
+}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            series = self._values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {series['count']}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUESTS = registry.counter('analysis_requests_total', 'Analysis requests started.')
+ARTICLES = registry.counter('analysis_articles_total', 'Articles streamed, by outcome.', ['status'])
+STAGE_SECONDS = registry.histogram('analysis_stage_seconds', 'Exclusive time spent per pipeline stage.', ['stage'])
+TOKENS = registry.counter('gemini_tokens_total', 'Gemini tokens from response usage metadata.', ['type'])
+RATE_LIMITED = registry.counter('vertex_rate_limited_total', 'Vertex AI calls answered with 429 RESOURCE_EXHAUSTED.')
+BACKOFF_SECONDS = registry.counter('vertex_backoff_seconds_total', 'Seconds slept backing off from 429s.')
+LIMITER_WAIT_SECONDS = registry.counter('vertex_limiter_wait_seconds_total', 'Seconds spent waiting for a rate limiter token.')
+CACHE_LOOKUPS = registry.counter('analysis_cache_lookups_total', 'Cache lookups, by cache and result.', ['cache', 'result'])
+
+
+class RequestMetrics:
+    """Totals for one request, shared by the threads and tasks working on it."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.tokens = {}
+        self.counters = {}
+        self.caches = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+
+    def add(self, section, name, amount=1):
+        with self._lock:
+            values = getattr(self, section)
+            values[name] = values.get(name, 0) + amount
+
+    def summary(self):
+        with self._lock:
+            return {
+                'wall_seconds': round(time.monotonic() - self.started, 3),
+                'stages': {
+                    stage: {'count': totals['count'], 'seconds': round(totals['seconds'], 3), 'max_seconds': round(totals['max_seconds'], 3)}
+                    for stage, totals in self.stages.items()
+                },
+                'tokens': dict(self.tokens),
+                'rate_limited': self.counters.get('rate_limited', 0),
+                'backoff_seconds': round(self.counters.get('backoff_seconds', 0.0), 3),
+                'limiter_wait_seconds': round(self.counters.get('limiter_wait_seconds', 0.0), 3),
+                'cache': {cache: dict(counts) for cache, counts in self.caches.items()},
+            }
+
+    def add_cache(self, cache, hit):
+        with self._lock:
+            counts = self.caches.setdefault(cache, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    def cache_stats(self, cache):
+        """This request's hits and misses of one cache."""
+        with self._lock:
+            return dict(self.caches.get(cache, {'hits': 0, 'misses': 0}))
+
+
+request_metrics_var = contextvars.ContextVar('request_metrics', default=None)
+_stage_frame_var = contextvars.ContextVar('stage_frame', default=None)
+
+
+def begin_request_metrics():
+    """Start collecting metrics for the current context's request."""
+    REQUESTS.inc()
+    metrics = RequestMetrics()
+    request_metrics_var.set(metrics)
+    return metrics
+
+
+def _add(section, name, amount):
+    metrics = request_metrics_var.get()
+    if metrics is not None:
+        metrics.add(section, name, amount)
+
+
+@contextmanager
+def timed(stage):
+    """Time a pipeline stage, excluding the time of stages nested inside it."""
+    frame = {'nested': 0.0}
+    parent = _stage_frame_var.get()
+    token = _stage_frame_var.set(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _stage_frame_var.reset(token)
+        if parent is not None:
+            parent['nested'] += elapsed
+        seconds = max(0.0, elapsed - frame['nested'])
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        metrics = request_metrics_var.get()
+        if metrics is not None:
+            metrics.add_stage(stage, seconds)
+
+
+def record_usage(response):
+    """Add a Gemini response's usage_metadata token counts."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    for name, field in USAGE_FIELDS.items():
+        count = getattr(usage, field, None)
+        if count:
+            TOKENS.inc(count, type=name)
+            _add('tokens', name, count)
+
+
+def record_rate_limit_event(event, seconds):
+    """Rate limiter observer: 'throttled' per 429, 'backoff' and 'wait' with the seconds slept."""
+    if event == 'throttled':
+        RATE_LIMITED.inc()
+        _add('counters', 'rate_limited', 1)
+    elif event == 'backoff':
+        BACKOFF_SECONDS.inc(seconds)
+        _add('counters', 'backoff_seconds', seconds)
+    elif event == 'wait':
+        LIMITER_WAIT_SECONDS.inc(seconds)
+        _add('counters', 'limiter_wait_seconds', seconds)
+
+
+def record_cache(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
+    metrics = request_metrics_var.get()
+    if metrics is not None:
+        metrics.add_cache(cache, hit)
+
+
+def record_article(event_type):
+    ARTICLES.inc(status='analyzed' if event_type == 'article_analysis' else 'failed')
+
+
+def render_prometheus():
+    return registry.render()
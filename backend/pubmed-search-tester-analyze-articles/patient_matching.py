@@ -0,0 +1,101 @@
+"""Deterministic matching of a patient's disease and actionable events against an article extraction.
+
+Used by the two-stage pipeline to decide disease_match and matches_query
+without an LLM call when the answer can be read off the extracted fields.
+"""
+import re
+
+# Common leukemia/lymphoma abbreviations and their spelled-out forms
+DISEASE_ALIASES = {
+    'aml': 'acute myeloid leukemia',
+    'all': 'acute lymphoblastic leukemia',
+    'b all': 'b cell acute lymphoblastic leukemia',
+    't all': 't cell acute lymphoblastic leukemia',
+    'apl': 'acute promyelocytic leukemia',
+    'cml': 'chronic myeloid leukemia',
+    'cll': 'chronic lymphocytic leukemia',
+    'jmml': 'juvenile myelomonocytic leukemia',
+    'mds': 'myelodysplastic syndrome',
+    'mpal': 'mixed phenotype acute leukemia',
+    'nhl': 'non hodgkin lymphoma',
+}
+
+# Words that describe an event but do not identify it
+GENERIC_EVENT_WORDS = {
+    'fusion', 'fusions', 'mutation', 'mutations', 'mutated', 'positive', 'negative', 'expression',
+    'rearrangement', 'rearranged', 'deletion', 'amplification', 'loss', 'gain', 'and', 'with', 'the',
+    'of', 'p', 'c', 'high', 'low', 'overexpression',
+}
+
+
+def normalize_text(text):
+    text = (text or '').lower().replace('leukaemia', 'leukemia')
+    return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+
+def acronym_pattern(abbreviation):
+    """Case-sensitive pattern for an abbreviation written as an uppercase acronym, e.g. "B-ALL" or "B ALL"."""
+    tokens = [re.escape(token) for token in abbreviation.upper().split()]
+    return re.compile(r'(?<![A-Za-z0-9])' + r'[\s-]?'.join(tokens) + r'(?![A-Za-z0-9])')
+
+
+ACRONYM_PATTERNS = {abbreviation: acronym_pattern(abbreviation) for abbreviation in DISEASE_ALIASES}
+
+
+def mentions_term(term, text):
+    """True if text mentions a disease term.
+
+    Abbreviations such as "all" or "aml" are ordinary words in lowercase, so they only count
+    as an uppercase acronym or as the whole text; full names match case-insensitively.
+    """
+    normalized = normalize_text(text)
+    if term in ACRONYM_PATTERNS:
+        return normalized == term or bool(ACRONYM_PATTERNS[term].search(text or ''))
+    return bool(term) and bool(re.search(rf'\b{re.escape(term)}\b', normalized))
+
+
+def disease_terms(disease):
+    """Expand a disease name into the set of normalised names and abbreviations it is known by."""
+    normalized = normalize_text(disease)
+    terms = {normalized} if normalized else set()
+    # Pick up abbreviations in parentheses or embedded in the name, e.g. "B-cell ALL (B-ALL)"
+    for abbreviation, full in DISEASE_ALIASES.items():
+        if mentions_term(abbreviation, disease) or mentions_term(full, disease):
+            terms.update({abbreviation, full})
+    return terms
+
+
+def mentions_disease(disease, text):
+    """True if free text names the patient's disease by a full name or an uppercase acronym."""
+    return any(mentions_term(term, text) for term in disease_terms(disease))
+
+
+def match_disease(disease, type_of_cancer):
+    """True if the article's cancer type names the patient's disease."""
+    if not normalize_text(type_of_cancer):
+        return False
+    article_terms = disease_terms(type_of_cancer)
+    return any(term in article_terms for term in disease_terms(disease)) or mentions_disease(disease, type_of_cancer)
+
+
+def event_symbols(event):
+    """Gene, marker and variant symbols mentioned in an event description."""
+    tokens = re.split(r'[^A-Za-z0-9]+', event or '')
+    return {
+        token.upper() for token in tokens
+        if len(token) > 1 and token.lower() not in GENERIC_EVENT_WORDS
+        and (any(c.isdigit() for c in token) or token.isupper())
+    }
+
+
+def split_events(events_text):
+    """Split the newline separated events text sent by the frontend into single events."""
+    return [event.strip() for event in re.split(r'[\n;]+', events_text or '') if event.strip()]
+
+
+def match_events(article_events, patient_events):
+    """Flag each article event that shares a gene/marker symbol with any patient event."""
+    patient_symbols = set()
+    for event in patient_events:
+        patient_symbols |= event_symbols(event)
+    return [bool(event_symbols(event) & patient_symbols) for event in article_events]
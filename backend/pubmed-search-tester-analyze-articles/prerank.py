@@ -0,0 +1,96 @@
+"""Cheap pre-ranking of retrieved candidates before full Gemini analysis.
+
+The expected score approximates calculate_points from signals that need no
+LLM call: vector distance, journal SJR, publication year and mentions of the
+patient's disease and event symbols. Fields come from a precomputed extraction
+when one exists, otherwise from the first characters of the article text.
+"""
+import re
+from datetime import datetime
+
+from patient_matching import event_symbols, mentions_disease
+
+# Points for the closest candidate; the furthest gets 0 and the rest scale linearly
+DISTANCE_POINTS = 30
+DISEASE_POINTS = 50
+EVENT_POINTS = 15
+YEAR_POINTS = -5
+
+YEAR_PATTERN = re.compile(r'\b(19[5-9]\d|20\d\d)\b')
+
+
+def guess_year(text):
+    """Most recent plausible publication year mentioned in a snippet, or None."""
+    current_year = datetime.now().year
+    years = [int(y) for y in YEAR_PATTERN.findall(text or '') if int(y) <= current_year]
+    return max(years) if years else None
+
+
+def guess_journal(snippet, journal_index, max_lines=10):
+    """Look for a known journal title on one of the snippet's first short lines."""
+    for line in (snippet or '').splitlines()[:max_lines]:
+        line = line.strip()
+        if 3 <= len(line) <= 150:
+            match = journal_index.lookup(line)
+            if match:
+                return match
+    return None
+
+
+def expected_score(hit, snippet, disease, patient_events, journal_index, journal_points_fn,
+                   extraction=None, distance_range=None):
+    """Estimate an article's points and return (score, breakdown)."""
+    breakdown = {}
+
+    if distance_range and hit.get('distance') is not None:
+        low, high = distance_range
+        closeness = 1.0 if high == low else (high - hit['distance']) / (high - low)
+        breakdown['distance'] = DISTANCE_POINTS * closeness
+
+    if extraction:
+        match = journal_index.lookup(extraction.get('journal_title'), extraction.get('journal_issn'))
+        year = extraction.get('year')
+        text = ' '.join([
+            str(extraction.get('type_of_cancer', '')),
+            ' '.join(str(event) for event in extraction.get('actionable_events', [])),
+        ])
+        symbols_text = ' '.join(str(event) for event in extraction.get('actionable_events', []))
+    else:
+        match = guess_journal(snippet, journal_index)
+        year = guess_year(snippet)
+        text = snippet or ''
+        symbols_text = snippet or ''
+
+    if match and match[1] > 0:
+        breakdown['journal_impact'] = journal_points_fn(match[1])
+
+    try:
+        breakdown['year'] = YEAR_POINTS * (datetime.now().year - int(year))
+    except (TypeError, ValueError):
+        pass
+
+    # Short aliases such as "all" only count as uppercase acronyms in free text
+    if disease and mentions_disease(disease, text):
+        breakdown['disease_match'] = DISEASE_POINTS
+
+    article_symbols = event_symbols(symbols_text)
+    matched = sum(1 for event in patient_events if event_symbols(event) & article_symbols)
+    if matched:
+        breakdown['actionable_events'] = EVENT_POINTS * matched
+
+    return sum(breakdown.values()), breakdown
+
+
+def prerank_hits(hits, snippets, disease, patient_events, journal_index, journal_points_fn, extractions=None):
+    """Attach expected_score to each hit and return the hits sorted best first."""
+    extractions = extractions or {}
+    distances = [hit['distance'] for hit in hits if hit.get('distance') is not None]
+    distance_range = (min(distances), max(distances)) if distances else None
+    for hit in hits:
+        score, breakdown = expected_score(
+            hit, snippets.get(hit['name'], ''), disease, patient_events,
+            journal_index, journal_points_fn, extractions.get(hit['name']), distance_range
+        )
+        hit['expected_score'] = score
+        hit['expected_breakdown'] = breakdown
+    return sorted(hits, key=lambda hit: hit['expected_score'], reverse=True)
@@ -0,0 +1,131 @@
+"""Query embedding stage for retrieval: canonicalisation, caching and batching.
+
+Identical or re-ordered disease/event lists canonicalise to the same text and
+share one cached embedding. Cache misses from concurrent requests are
+collected for a short window and embedded in a single model call.
+"""
+import logging
+import re
+import threading
+from concurrent.futures import Future
+
+from google.cloud import bigquery
+
+from analysis_cache import MemoryCache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "playground-439016.pmid_uscentral.textembed"
+
+
+def canonicalize_events_text(text):
+    """Whitespace-normalise, deduplicate (case-insensitively) and sort the lines of an events text."""
+    lines = {}
+    for line in (text or '').splitlines():
+        line = re.sub(r'\s+', ' ', line).strip()
+        if line:
+            lines.setdefault(line.lower(), line)
+    return "\n".join(lines[key] for key in sorted(lines))
+
+
+def bigquery_embed_batch(bq_client, texts):
+    """Embed texts with the corpus's BigQuery remote model in one parameterised job."""
+    query = f"""
+    SELECT content, ml_generate_embedding_result AS embedding
+    FROM ML.GENERATE_EMBEDDING(
+      MODEL `{EMBEDDING_MODEL}`,
+      (SELECT content FROM UNNEST(@texts) AS content),
+      STRUCT(TRUE AS flatten_json_output)
+    )
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter('texts', 'STRING', texts)
+    ])
+    embeddings = {row['content']: list(row['embedding']) for row in bq_client.query(query, job_config=job_config).result()}
+    return [embeddings[text] for text in texts]
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding requests into batched calls to embed_batch_fn."""
+
+    def __init__(self, embed_batch_fn, max_batch_size=32, max_wait_seconds=0.05):
+        self.embed_batch_fn = embed_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def submit(self, text):
+        """Return a Future for text's embedding; identical pending texts share one Future."""
+        with self._lock:
+            if text in self._pending:
+                return self._pending[text]
+            future = Future()
+            self._pending[text] = future
+            if len(self._pending) >= self.max_batch_size:
+                batch = self._take_batch()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self.max_wait_seconds, self._flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if batch:
+            self._run(batch)
+        return future
+
+    def _take_batch(self):
+        batch = self._pending
+        self._pending = {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take_batch()
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch):
+        texts = list(batch)
+        try:
+            vectors = self.embed_batch_fn(texts)
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        logger.info(f"Embedded {len(texts)} queries in one batch")
+        for text, vector in zip(texts, vectors):
+            batch[text].set_result(vector)
+
+
+class QueryEmbedder:
+    """Canonicalise, cache and batch query embeddings."""
+
+    def __init__(self, embed_batch_fn, cache_size=1000, ttl_seconds=24 * 3600, max_batch_size=32, max_wait_seconds=0.05):
+        self.cache = MemoryCache(cache_size, ttl_seconds)
+        self.batcher = EmbeddingBatcher(embed_batch_fn, max_batch_size, max_wait_seconds)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        canonical = canonicalize_events_text(text)
+        vector = self.cache.get(canonical)
+        with self._lock:
+            if vector is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if vector is not None:
+            return vector
+        vector = self.batcher.submit(canonical).result()
+        self.cache.set(canonical, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,58 @@
+"""Deduplication of retrieved hits and the running "best so far" ranking.
+
+Retrieval can return the same paper more than once, either as a repeated
+PMID or as several chunks named like "<pmid>_<n>". Only the best-ranked hit
+per paper is analyzed. As analyses finish, TopK keeps the K highest-scoring
+articles in a min-heap and reports when the visible ordering changes.
+"""
+import heapq
+import re
+
+CHUNK_SUFFIX_PATTERN = re.compile(r'^(?P<paper>.+?)[_#:](?:chunk|part|c)?\d+$', re.IGNORECASE)
+
+
+def paper_id(name):
+    """Paper identifier for a corpus row name, without any chunk suffix."""
+    name = str(name).strip()
+    match = CHUNK_SUFFIX_PATTERN.match(name)
+    return match.group('paper') if match else name
+
+
+def dedupe_hits(hits):
+    """Keep the first (best-ranked) hit per paper; return (unique hits, number dropped)."""
+    seen = set()
+    unique = []
+    for hit in hits:
+        key = paper_id(hit['name'])
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(hit)
+    return unique, len(hits) - len(unique)
+
+
+class TopK:
+    """Running top-K of scored articles; add() returns the new ordering when it changed, else None."""
+
+    def __init__(self, k=10):
+        self.k = max(1, k)
+        self._heap = []
+        self._count = 0
+
+    def add(self, pmid, points, summary=None):
+        self._count += 1
+        # Ties keep the earlier article ahead, so the entry counter breaks them in reverse
+        entry = (points, -self._count, pmid, summary or {})
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+        else:
+            return None
+        return self.ordering()
+
+    def ordering(self):
+        return [
+            {'position': position, 'pmid': pmid, 'points': points, **summary}
+            for position, (points, _, pmid, summary) in enumerate(sorted(self._heap, reverse=True), 1)
+        ]
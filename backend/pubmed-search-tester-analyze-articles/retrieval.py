@@ -0,0 +1,415 @@
+"""Retrieval backends for finding the articles closest to a patient's events.
+
+BigQueryRetriever is the original path: ML.GENERATE_EMBEDDING plus
+VECTOR_SEARCH over pmid_embed_nonzero. LocalVectorRetriever searches an
+exported copy of the same table in process, with no network round trip
+other than embedding the query.
+
+A local index directory contains:
+  embeddings.npy        float32 matrix, one row per article (memory-mapped)
+  pmids.json            PMID for each row
+  contents.jsonl        one {"name", "content"} object per row
+  content_offsets.npy   byte offset of each row in contents.jsonl
+  ivf_centroids.npy     optional IVF coarse centroids (build-ivf)
+  ivf_lists.npy         optional row ids grouped by centroid
+  ivf_offsets.npy       optional start of each centroid's group in ivf_lists.npy
+  hnsw.bin              optional hnswlib graph (build-hnsw)
+
+Create one with:
+    python retrieval.py export --output ./index
+    python retrieval.py build-ivf --index ./index
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from google.cloud import bigquery
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+CORPUS_TABLE = "playground-439016.pmid_uscentral.pmid_embed_nonzero"
+EMBEDDING_MODEL = "playground-439016.pmid_uscentral.textembed"
+
+
+class Retriever:
+    """Interface for retrieval backends.
+
+    search() yields {'name', 'distance'} hits nearest first, without article
+    content; fetch_contents() loads content for a batch of PMIDs when the
+    articles are about to be analyzed.
+    """
+
+    name = None
+
+    def search(self, query_text, top_k=20, max_distance=None, page_size=50):
+        raise NotImplementedError
+
+    def fetch_contents(self, pmids):
+        raise NotImplementedError
+
+    def fetch_snippets(self, pmids, max_chars=2000):
+        """First max_chars characters of each article, for cheap pre-ranking."""
+        return {pmid: (content or '')[:max_chars] for pmid, content in self.fetch_contents(pmids).items()}
+
+
+class BigQueryRetriever(Retriever):
+    """Runs VECTOR_SEARCH in BigQuery with query parameters, so repeated queries hit the result cache.
+
+    With an embed_fn the query vector is computed beforehand and passed as
+    @query_embedding; without one @query_text is embedded inside the same job.
+    top_k is validated as an integer and inlined, since VECTOR_SEARCH needs it
+    as a literal.
+    """
+
+    name = 'bigquery'
+
+    def __init__(self, bq_client, embed_fn=None):
+        self.bq_client = bq_client
+        self.embed_fn = embed_fn
+
+    def build_query(self, top_k=20):
+        return f"""
+    WITH query_embedding AS (
+      SELECT ml_generate_embedding_result AS embedding_col
+      FROM ML.GENERATE_EMBEDDING(
+        MODEL `{EMBEDDING_MODEL}`,
+        (SELECT @query_text AS content),
+        STRUCT(TRUE AS flatten_json_output)
+      )
+    )
+    SELECT
+      base.name AS name,
+      distance
+    FROM VECTOR_SEARCH(
+      TABLE `{CORPUS_TABLE}`,
+      'ml_generate_embedding_result',
+      (SELECT embedding_col FROM query_embedding),
+      top_k => {int(top_k)}
+    )
+    WHERE @max_distance IS NULL OR distance <= @max_distance
+    ORDER BY distance ASC
+    """
+
+    def build_vector_query(self, top_k=20):
+        return f"""
+    SELECT
+      base.name AS name,
+      distance
+    FROM VECTOR_SEARCH(
+      TABLE `{CORPUS_TABLE}`,
+      'ml_generate_embedding_result',
+      (SELECT @query_embedding AS embedding_col),
+      'embedding_col',
+      top_k => {int(top_k)}
+    )
+    WHERE @max_distance IS NULL OR distance <= @max_distance
+    ORDER BY distance ASC
+    """
+
+    def search(self, query_text, top_k=20, max_distance=None, page_size=50):
+        parameters = [bigquery.ScalarQueryParameter('max_distance', 'FLOAT64', max_distance)]
+        if self.embed_fn is None:
+            query = self.build_query(top_k)
+            parameters.append(bigquery.ScalarQueryParameter('query_text', 'STRING', query_text))
+        else:
+            query = self.build_vector_query(top_k)
+            parameters.append(bigquery.ArrayQueryParameter('query_embedding', 'FLOAT64', list(self.embed_fn(query_text))))
+        query_job = self.bq_client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=parameters))
+        # Rows are pulled from BigQuery one page at a time as the caller iterates
+        for row in query_job.result(page_size=page_size):
+            yield {'name': row['name'], 'distance': row['distance']}
+
+    def fetch_contents(self, pmids):
+        query = f"""
+    SELECT name, content
+    FROM `{CORPUS_TABLE}`
+    WHERE name IN UNNEST(@pmids)
+    """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter('pmids', 'STRING', [str(pmid) for pmid in pmids])
+        ])
+        return {row['name']: row['content'] for row in self.bq_client.query(query, job_config=job_config).result()}
+
+    def fetch_snippets(self, pmids, max_chars=2000):
+        query = f"""
+    SELECT name, SUBSTR(content, 1, @max_chars) AS content
+    FROM `{CORPUS_TABLE}`
+    WHERE name IN UNNEST(@pmids)
+    """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter('pmids', 'STRING', [str(pmid) for pmid in pmids]),
+            bigquery.ScalarQueryParameter('max_chars', 'INT64', int(max_chars)),
+        ])
+        return {row['name']: row['content'] for row in self.bq_client.query(query, job_config=job_config).result()}
+
+
+class LazyContentLoader:
+    """Fetches article content in rank-ordered batches, just before the articles are analyzed.
+
+    The first request for a PMID that is not loaded yet fetches it together with
+    the next unfetched PMIDs in rank order; content is released once handed out.
+    The fetch runs outside the lock, and requests for PMIDs in a batch being
+    fetched wait for that batch. If a fetch fails its PMIDs can be fetched again.
+    """
+
+    def __init__(self, retriever, pmids, batch_size=5):
+        self.retriever = retriever
+        self.pmids = [str(pmid) for pmid in pmids]
+        self.batch_size = max(1, batch_size)
+        self._contents = {}
+        self._requested = set()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, pmid):
+        pmid = str(pmid)
+        while True:
+            with self._lock:
+                if pmid in self._contents or pmid in self._requested:
+                    return self._contents.pop(pmid, None)
+                fetching = self._pending.get(pmid)
+                if fetching is None:
+                    batch = [pmid] + [
+                        p for p in self.pmids
+                        if p != pmid and p not in self._requested and p not in self._pending
+                    ][:self.batch_size - 1]
+                    fetching = threading.Event()
+                    for p in batch:
+                        self._pending[p] = fetching
+                    break
+            # Another worker is fetching this PMID's batch; check again once it finishes or fails
+            fetching.wait()
+
+        try:
+            contents = self.retriever.fetch_contents(batch)
+        except Exception:
+            with self._lock:
+                for p in batch:
+                    self._pending.pop(p, None)
+            fetching.set()
+            raise
+        with self._lock:
+            self._contents.update(contents)
+            self._requested.update(batch)
+            for p in batch:
+                self._pending.pop(p, None)
+            fetching.set()
+            return self._contents.pop(pmid, None)
+
+
+class LocalContentStore:
+    """PMID content read from contents.jsonl on demand, one seek per article."""
+
+    def __init__(self, index_dir):
+        self.path = os.path.join(index_dir, 'contents.jsonl')
+        self.offsets = np.load(os.path.join(index_dir, 'content_offsets.npy'), mmap_mode='r')
+
+    def get(self, row_id):
+        with open(self.path, 'rb') as f:
+            f.seek(int(self.offsets[row_id]))
+            return json.loads(f.readline())['content']
+
+
+class LocalVectorRetriever(Retriever):
+    """In-process nearest-neighbour search over an exported embedding matrix.
+
+    index_type 'brute' scans every row with NumPy, 'ivf' scans only the nprobe
+    closest clusters and 'hnsw' uses an hnswlib graph. 'auto' picks hnsw, then
+    ivf, when their files exist, and falls back to brute force.
+    Distances are Euclidean, matching the VECTOR_SEARCH default.
+    """
+
+    name = 'local'
+
+    def __init__(self, index_dir, embed_fn, index_type='auto', nprobe=8):
+        self.index_dir = index_dir
+        self.embed_fn = embed_fn
+        self.nprobe = nprobe
+        self.embeddings = np.load(os.path.join(index_dir, 'embeddings.npy'), mmap_mode='r')
+        with open(os.path.join(index_dir, 'pmids.json')) as f:
+            self.pmids = json.load(f)
+        self.row_ids = {str(pmid): row_id for row_id, pmid in enumerate(self.pmids)}
+        self.contents = LocalContentStore(index_dir)
+        self._norms = None
+        self.index_type = self._resolve_index_type(index_type)
+        if self.index_type == 'ivf':
+            self.centroids = np.load(os.path.join(index_dir, 'ivf_centroids.npy'))
+            self.ivf_lists = np.load(os.path.join(index_dir, 'ivf_lists.npy'), mmap_mode='r')
+            self.ivf_offsets = np.load(os.path.join(index_dir, 'ivf_offsets.npy'))
+        elif self.index_type == 'hnsw':
+            self.hnsw = hnswlib.Index(space='l2', dim=self.embeddings.shape[1])
+            self.hnsw.load_index(os.path.join(index_dir, 'hnsw.bin'))
+            self.hnsw.set_ef(max(64, 4 * nprobe))
+        logger.info(f"Loaded local {self.index_type} index with {len(self.pmids)} articles")
+
+    def _resolve_index_type(self, index_type):
+        has_hnsw = hnswlib is not None and os.path.exists(os.path.join(self.index_dir, 'hnsw.bin'))
+        has_ivf = os.path.exists(os.path.join(self.index_dir, 'ivf_centroids.npy'))
+        if index_type == 'auto':
+            return 'hnsw' if has_hnsw else 'ivf' if has_ivf else 'brute'
+        if (index_type == 'hnsw' and not has_hnsw) or (index_type == 'ivf' and not has_ivf):
+            raise ValueError(f"Index type {index_type} is not built in {self.index_dir}")
+        return index_type
+
+    @property
+    def norms(self):
+        # Squared row norms, computed once for brute-force distances
+        if self._norms is None:
+            self._norms = np.einsum('ij,ij->i', self.embeddings, self.embeddings)
+        return self._norms
+
+    def nearest(self, vector, top_k=20):
+        """Return (row_ids, distances) of the top_k rows closest to vector, nearest first."""
+        query = np.asarray(vector, dtype=np.float32)
+        if self.index_type == 'hnsw':
+            labels, squared = self.hnsw.knn_query(query, k=min(top_k, len(self.pmids)))
+            return labels[0], np.sqrt(squared[0])
+
+        if self.index_type == 'ivf':
+            centroid_distances = np.linalg.norm(self.centroids - query, axis=1)
+            order = np.argsort(centroid_distances)
+            # Probe nprobe lists, and further ones while those probed hold fewer than top_k rows
+            # (empty clusters near the query would otherwise leave no candidates at all)
+            list_sizes = np.cumsum(np.diff(self.ivf_offsets)[order])
+            enough = int(np.searchsorted(list_sizes, min(top_k, len(self.pmids)))) + 1
+            probes = order[:max(self.nprobe, enough)]
+            candidates = np.sort(np.concatenate([
+                self.ivf_lists[self.ivf_offsets[c]:self.ivf_offsets[c + 1]] for c in probes
+            ]))
+            vectors = np.asarray(self.embeddings[candidates])
+            squared = np.einsum('ij,ij->i', vectors, vectors) - 2 * vectors @ query + query @ query
+        else:
+            candidates = np.arange(len(self.pmids))
+            squared = self.norms - 2 * (self.embeddings @ query) + query @ query
+
+        k = min(top_k, len(candidates))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        best = np.argpartition(squared, k - 1)[:k]
+        best = best[np.argsort(squared[best])]
+        return candidates[best], np.sqrt(np.maximum(squared[best], 0))
+
+    def search(self, query_text, top_k=20, max_distance=None, page_size=50):
+        row_ids, distances = self.nearest(self.embed_fn(query_text), top_k)
+        for row_id, distance in zip(row_ids, distances):
+            if max_distance is not None and distance > max_distance:
+                break
+            yield {'name': self.pmids[row_id], 'distance': float(distance)}
+
+    def fetch_contents(self, pmids):
+        return {
+            str(pmid): self.contents.get(self.row_ids[str(pmid)])
+            for pmid in pmids if str(pmid) in self.row_ids
+        }
+
+
+def export_index(bq_client, output_dir, table=CORPUS_TABLE, page_size=1000):
+    """Export the corpus table's embeddings and content into a local index directory."""
+    os.makedirs(output_dir, exist_ok=True)
+    table_ref = bq_client.get_table(table)
+    total = table_ref.num_rows
+    rows = bq_client.list_rows(table_ref, selected_fields=[
+        field for field in table_ref.schema if field.name in ('name', 'content', 'ml_generate_embedding_result')
+    ], page_size=page_size)
+
+    embeddings = None
+    pmids = []
+    offsets = []
+    with open(os.path.join(output_dir, 'contents.jsonl'), 'wb') as contents:
+        for row_id, row in enumerate(rows):
+            vector = row['ml_generate_embedding_result']
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    os.path.join(output_dir, 'embeddings.npy'), mode='w+', dtype=np.float32, shape=(total, len(vector))
+                )
+            embeddings[row_id] = vector
+            pmids.append(row['name'])
+            offsets.append(contents.tell())
+            contents.write((json.dumps({'name': row['name'], 'content': row['content']}) + "\n").encode('utf-8'))
+    embeddings.flush()
+
+    with open(os.path.join(output_dir, 'pmids.json'), 'w') as f:
+        json.dump(pmids, f)
+    np.save(os.path.join(output_dir, 'content_offsets.npy'), np.asarray(offsets, dtype=np.int64))
+    logger.info(f"Exported {len(pmids)} articles to {output_dir}")
+
+
+def build_ivf(index_dir, nlist=None, iterations=10, sample_size=50000, seed=0):
+    """Cluster the exported embeddings with k-means and write the IVF lists."""
+    embeddings = np.load(os.path.join(index_dir, 'embeddings.npy'), mmap_mode='r')
+    n = len(embeddings)
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(embeddings[np.sort(rng.choice(n, size=min(n, sample_size), replace=False))])
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        for c in range(nlist):
+            members = sample[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+
+    assignments = np.concatenate([
+        assign_to_centroids(np.asarray(embeddings[start:start + 10000]), centroids)
+        for start in range(0, n, 10000)
+    ])
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.searchsorted(assignments[order], np.arange(nlist + 1))
+    np.save(os.path.join(index_dir, 'ivf_centroids.npy'), centroids)
+    np.save(os.path.join(index_dir, 'ivf_lists.npy'), order.astype(np.int64))
+    np.save(os.path.join(index_dir, 'ivf_offsets.npy'), offsets.astype(np.int64))
+    logger.info(f"Built IVF index with {nlist} lists over {n} articles")
+
+
+def assign_to_centroids(vectors, centroids):
+    squared = (
+        np.einsum('ij,ij->i', vectors, vectors)[:, None]
+        - 2 * vectors @ centroids.T
+        + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+    )
+    return np.argmin(squared, axis=1)
+
+
+def build_hnsw(index_dir, m=16, ef_construction=200):
+    """Build an hnswlib graph over the exported embeddings (requires hnswlib)."""
+    if hnswlib is None:
+        raise RuntimeError("hnswlib is not installed")
+    embeddings = np.load(os.path.join(index_dir, 'embeddings.npy'), mmap_mode='r')
+    index = hnswlib.Index(space='l2', dim=embeddings.shape[1])
+    index.init_index(max_elements=len(embeddings), M=m, ef_construction=ef_construction)
+    for start in range(0, len(embeddings), 10000):
+        batch = np.asarray(embeddings[start:start + 10000])
+        index.add_items(batch, np.arange(start, start + len(batch)))
+    index.save_index(os.path.join(index_dir, 'hnsw.bin'))
+    logger.info(f"Built HNSW index over {len(embeddings)} articles")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build a local retrieval index from the corpus table.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('--output', required=True)
+    export_parser.add_argument('--project', default='playground-439016')
+    ivf_parser = subparsers.add_parser('build-ivf')
+    ivf_parser.add_argument('--index', required=True)
+    ivf_parser.add_argument('--nlist', type=int, default=None)
+    hnsw_parser = subparsers.add_parser('build-hnsw')
+    hnsw_parser.add_argument('--index', required=True)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_index(bigquery.Client(project=args.project), args.output)
+    elif args.command == 'build-ivf':
+        build_ivf(args.index, args.nlist)
+    else:
+        build_hnsw(args.index)
@@ -0,0 +1,189 @@
+"""Vectorised article scoring with pluggable weight profiles.
+
+FeatureTable holds the scoring features of many analyzed articles as NumPy
+columns: journal log(SJR + 1), article age, paper type, matched event count and the
+boolean study flags. score_table() computes the points of every article and
+every breakdown component in one pass for a weight profile, so changing the
+weights re-ranks thousands of stored analyses without touching the model.
+
+A weight profile is a dict with the keys of DEFAULT_WEIGHTS. Requests pass
+either a profile name from WEIGHT_PROFILES or a dict of overrides applied on
+top of the default profile, which reproduces the original methodology.
+"""
+import math
+from datetime import datetime
+
+import numpy as np
+
+DEFAULT_WEIGHTS = {
+    # Journal impact: journal_impact * log(SJR + 1), capped at journal_impact_max
+    'journal_impact': 5.0,
+    'journal_impact_max': 25.0,
+    # Points per year between publication and now
+    'year': -5.0,
+    'disease_match': 50.0,
+    'pediatric_focus': 20.0,
+    # Paper type: a clinical trial, otherwise a review
+    'clinical_trial': 40.0,
+    'review': -5.0,
+    # Points per actionable event matching the patient
+    'actionable_events': 15.0,
+    'drugs_tested': 5.0,
+    'treatment_shown': 50.0,
+    'cell_studies': 5.0,
+    'mice_studies': 10.0,
+    'case_report': 5.0,
+    'series_of_case_reports': 10.0,
+    'clinical_study': 15.0,
+    'clinical_study_on_children': 20.0,
+    'novelty': 10.0,
+}
+
+WEIGHT_PROFILES = {
+    'default': DEFAULT_WEIGHTS,
+}
+
+# Boolean metadata fields scored as weight * flag, in breakdown order after the paper type and events
+FLAG_FIELDS = ['drugs_tested', 'treatment_shown', 'cell_studies', 'mice_studies', 'case_report',
+               'series_of_case_reports', 'clinical_study', 'clinical_study_on_children', 'novelty']
+
+# Breakdown components in the order calculate_points has always reported them
+COMPONENTS = ['journal_impact', 'year', 'disease_match', 'pediatric_focus', 'paper_type', 'actionable_events'] + FLAG_FIELDS
+
+
+def resolve_weights(weights=None):
+    """A complete weight profile from a profile name, a dict of overrides on the default profile, or None."""
+    if weights is None:
+        return dict(DEFAULT_WEIGHTS)
+    if isinstance(weights, str):
+        if weights not in WEIGHT_PROFILES:
+            raise ValueError(f"Unknown weight profile {weights!r}; expected one of {', '.join(WEIGHT_PROFILES)}")
+        return dict(WEIGHT_PROFILES[weights])
+    if not isinstance(weights, dict):
+        raise ValueError("weights must be a profile name or an object of weights")
+    unknown = sorted(set(weights) - set(DEFAULT_WEIGHTS))
+    if unknown:
+        raise ValueError(f"Unknown weights: {', '.join(unknown)}")
+    resolved = dict(DEFAULT_WEIGHTS)
+    for name, value in weights.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Weight {name} must be a number")
+        resolved[name] = float(value)
+    return resolved
+
+
+def parse_year(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def matched_event_count(events):
+    return sum(1 for event in events or [] if isinstance(event, dict) and event.get('matches_query', False))
+
+
+class FeatureTable:
+    """Scoring features of many articles as NumPy columns, with their PMIDs and titles."""
+
+    def __init__(self, columns, pmids, titles):
+        self.columns = columns
+        self.pmids = pmids
+        self.titles = titles
+
+    def __len__(self):
+        return len(self.pmids)
+
+    @classmethod
+    def from_metadata(cls, metadatas, current_year=None):
+        """Build the table from article_metadata dicts whose journal_sjr is already resolved."""
+        current_year = current_year or datetime.now().year
+        count = len(metadatas)
+        has_journal = np.zeros(count, dtype=bool)
+        journal_log = np.zeros(count)
+        age = np.zeros(count)
+        has_year = np.zeros(count, dtype=bool)
+        clinical_trial = np.zeros(count, dtype=bool)
+        review = np.zeros(count, dtype=bool)
+        matched_events = np.zeros(count)
+        flags = {field: np.zeros(count, dtype=bool) for field in ['disease_match', 'pediatric_focus'] + FLAG_FIELDS}
+
+        for i, metadata in enumerate(metadatas):
+            # Journal points need both a title and a resolved SJR above zero
+            if metadata.get('journal_title') and metadata.get('journal_sjr'):
+                sjr = float(metadata['journal_sjr'])
+                if sjr > 0:
+                    has_journal[i] = True
+                    # math.log rather than NumPy's log or log1p, which differ from it in the last bit
+                    journal_log[i] = math.log(sjr + 1)
+            year = parse_year(metadata.get('year')) if metadata.get('year') else None
+            if year is not None:
+                has_year[i] = True
+                age[i] = current_year - year
+            paper_type = str(metadata.get('paper_type') or '').lower()
+            clinical_trial[i] = 'clinical trial' in paper_type
+            review[i] = not clinical_trial[i] and 'review' in paper_type
+            matched_events[i] = matched_event_count(metadata.get('actionable_events'))
+            for field, column in flags.items():
+                column[i] = bool(metadata.get(field))
+
+        columns = {
+            'has_journal': has_journal,
+            'journal_log': journal_log,
+            'age': age,
+            'has_year': has_year,
+            'clinical_trial': clinical_trial,
+            'review': review,
+            'matched_events': matched_events,
+            **flags,
+        }
+        return cls(columns, [metadata.get('PMID') for metadata in metadatas], [metadata.get('title') for metadata in metadatas])
+
+
+def score_table(table, weights):
+    """Points for every article; returns (totals, {component: (points, applies)}) as NumPy arrays."""
+    columns = table.columns
+    has_journal = columns['has_journal']
+    components = {
+        'journal_impact': (
+            np.where(has_journal, np.minimum(columns['journal_log'] * weights['journal_impact'], weights['journal_impact_max']), 0.0),
+            has_journal,
+        ),
+        'year': (np.where(columns['has_year'], weights['year'] * columns['age'], 0.0), columns['has_year']),
+        'paper_type': (
+            np.where(columns['clinical_trial'], weights['clinical_trial'], np.where(columns['review'], weights['review'], 0.0)),
+            columns['clinical_trial'] | columns['review'],
+        ),
+        'actionable_events': (columns['matched_events'] * weights['actionable_events'], columns['matched_events'] > 0),
+    }
+    for field in ['disease_match', 'pediatric_focus'] + FLAG_FIELDS:
+        components[field] = (np.where(columns[field], weights[field], 0.0), columns[field])
+
+    # Summed in breakdown order, the order calculate_points always added them in
+    totals = np.zeros(len(table))
+    for name in COMPONENTS:
+        totals += components[name][0]
+    return totals, components
+
+
+def as_number(value):
+    """A plain int or float for JSON, keeping whole numbers as ints like the original scores."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def breakdown_at(components, i):
+    """The point breakdown of article i, with only the components that apply to it."""
+    return {name: as_number(components[name][0][i]) for name in COMPONENTS if components[name][1][i]}
+
+
+def rank_order(totals):
+    """Article indices by descending points; ties keep their table order."""
+    return np.argsort(-totals, kind='stable')
+
+
+def score_articles(metadatas, weights=None):
+    """(points, breakdown) for each article_metadata dict."""
+    table = FeatureTable.from_metadata(metadatas)
+    totals, components = score_table(table, resolve_weights() if weights is None else weights)
+    return [(as_number(totals[i]), breakdown_at(components, i)) for i in range(len(table))]
@@ -0,0 +1,82 @@
+"""Incremental gzip/brotli compression of NDJSON streams and text responses.
+
+Each event is flushed through the compressor as it is produced, so the
+client can decode it immediately instead of waiting for the stream to end.
+Brotli is used only if the optional brotli package is installed.
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def choose_encoding(accept_encoding):
+    """Best supported Content-Encoding for an Accept-Encoding header, or None."""
+    accepted = {
+        part.split(';')[0].strip().lower()
+        for part in (accept_encoding or '').split(',')
+        if part.strip() and not part.strip().endswith(';q=0')
+    }
+    if 'br' in accepted and brotli is not None:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class StreamCompressor:
+    """Compress chunks one at a time, flushing after each so every event is decodable on arrival."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=5)
+        else:
+            # wbits 16+ writes a gzip header and trailer around the deflate stream
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def compress_stream(chunks, encoding):
+    """Compress a generator of text chunks; close() on the result closes the source generator."""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+async def compress_stream_async(chunks, encoding):
+    """compress_stream() for async generators."""
+    compressor = StreamCompressor(encoding)
+    try:
+        async for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        await chunks.aclose()
+
+
+def compress_body(data, encoding):
+    """One-shot compression of a complete response body."""
+    data = data.encode('utf-8') if isinstance(data, str) else data
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT)
+    return gzip.compress(data)
@@ -0,0 +1,106 @@
+"""Structured, non-blocking logging with sampled payload logs.
+
+setup_logging() routes every record through a QueueHandler, so a request
+thread only enqueues the record and a background listener does the
+formatting and I/O. Records are written as one JSON object per line, which
+Cloud Logging ingests as structured entries (LOG_FORMAT=text keeps the plain
+format for local runs).
+
+Prompts and model responses are large, so log_payload() records only their
+length and a hash unless the current request was sampled (1 in
+LOG_PAYLOAD_SAMPLE_EVERY requests), DEBUG logging is on, or the caller is
+reporting an error.
+"""
+import atexit
+import contextvars
+import hashlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import uuid
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_PAYLOAD_SAMPLE_EVERY = int(os.environ.get('LOG_PAYLOAD_SAMPLE_EVERY', '0'))
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+payload_sampled_var = contextvars.ContextVar('payload_sampled', default=False)
+_request_counter = itertools.count(1)
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Stamp each record with the current request id before it leaves the request's thread."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with Cloud Logging's severity field and any extra 'fields'."""
+
+    def format(self, record):
+        entry = {
+            'severity': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+            'time': self.formatTime(record),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Send all logging through a queue to a background listener; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def begin_request(sample_every=LOG_PAYLOAD_SAMPLE_EVERY):
+    """Give the current context a request id and decide whether its payloads are logged in full."""
+    request_id_var.set(uuid.uuid4().hex[:12])
+    sampled = sample_every > 0 and next(_request_counter) % sample_every == 0
+    payload_sampled_var.set(sampled)
+    return sampled
+
+
+def payload_summary(text):
+    text = text or ''
+    return {'length': len(text), 'sha256': hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}
+
+
+def log_payload(logger, label, text, level=logging.INFO, force=False, **fields):
+    """Log a prompt or response: in full when sampled, at DEBUG or forced (errors), otherwise its length and hash."""
+    summary = payload_summary(text)
+    full = force or payload_sampled_var.get() or logger.isEnabledFor(logging.DEBUG)
+    fields = {'payload': label, **summary, **fields}
+    if full:
+        logger.log(level, f"{label}:\n{text}", extra={'fields': fields})
+    else:
+        logger.log(level, f"{label}: {summary['length']} chars, sha256 {summary['sha256']}", extra={'fields': fields})
@@ -0,0 +1,225 @@
+"""Structured-output mode for the single-call article analysis.
+
+Gemini is asked for application/json constrained by ARTICLE_FIELDS, and the
+response is read through ArticleMetadata, which coerces what it can (string
+booleans, numeric years, bare event strings) and leaves the rest unset, so
+a partial answer can be completed with one re-ask for the missing fields.
+"""
+import json
+import re
+from typing import List, Optional
+
+from google.genai import types
+from pydantic import BaseModel, ConfigDict, model_validator
+
+REQUIRED_FIELDS = ['title', 'journal_title', 'cancer_focus', 'type_of_cancer', 'paper_type', 'actionable_events']
+
+STRING = types.Schema(type='STRING')
+BOOLEAN = types.Schema(type='BOOLEAN')
+ARTICLE_FIELDS = {
+    'title': STRING,
+    'year': STRING,
+    'journal_title': STRING,
+    'journal_issn': STRING,
+    'cancer_focus': BOOLEAN,
+    'pediatric_focus': BOOLEAN,
+    'type_of_cancer': STRING,
+    'disease_match': BOOLEAN,
+    'paper_type': STRING,
+    'actionable_events': types.Schema(type='ARRAY', items=types.Schema(
+        type='OBJECT',
+        properties={'event': STRING, 'matches_query': BOOLEAN},
+        required=['event', 'matches_query'],
+        property_ordering=['event', 'matches_query'],
+    )),
+    'drugs_tested': BOOLEAN,
+    'drug_results': types.Schema(type='ARRAY', items=STRING),
+    'treatment_shown': BOOLEAN,
+    'cell_studies': BOOLEAN,
+    'mice_studies': BOOLEAN,
+    'case_report': BOOLEAN,
+    'series_of_case_reports': BOOLEAN,
+    'clinical_study': BOOLEAN,
+    'clinical_study_on_children': BOOLEAN,
+    'novelty': BOOLEAN,
+}
+
+
+def article_response_schema(fields=None):
+    """Response schema for {"article_metadata": {...}}, restricted to fields if given."""
+    names = [name for name in ARTICLE_FIELDS if fields is None or name in fields]
+    return types.Schema(
+        type='OBJECT',
+        properties={'article_metadata': types.Schema(
+            type='OBJECT',
+            properties={name: ARTICLE_FIELDS[name] for name in names},
+            required=names,
+            property_ordering=names,
+        )},
+        required=['article_metadata'],
+    )
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ('true', 'yes', 'y', '1'):
+            return True
+        if value in ('false', 'no', 'n', '0'):
+            return False
+    return None
+
+
+def to_text(value):
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        value = str(value).strip()
+        return value or None
+    return None
+
+
+def to_event(value):
+    if isinstance(value, str):
+        return {'event': value, 'matches_query': False} if value.strip() else None
+    if isinstance(value, dict) and to_text(value.get('event')):
+        return {'event': to_text(value['event']), 'matches_query': bool(to_bool(value.get('matches_query')))}
+    return None
+
+
+class ActionableEvent(BaseModel):
+    event: str
+    matches_query: bool = False
+
+
+class ArticleMetadata(BaseModel):
+    """article_metadata as returned by the model; unknown keys are kept, unusable values become None."""
+
+    model_config = ConfigDict(extra='allow')
+
+    title: Optional[str] = None
+    year: Optional[str] = None
+    journal_title: Optional[str] = None
+    journal_issn: Optional[str] = None
+    cancer_focus: Optional[bool] = None
+    pediatric_focus: Optional[bool] = None
+    type_of_cancer: Optional[str] = None
+    disease_match: Optional[bool] = None
+    paper_type: Optional[str] = None
+    actionable_events: Optional[List[ActionableEvent]] = None
+    drugs_tested: Optional[bool] = None
+    drug_results: Optional[List[str]] = None
+    treatment_shown: Optional[bool] = None
+    cell_studies: Optional[bool] = None
+    mice_studies: Optional[bool] = None
+    case_report: Optional[bool] = None
+    series_of_case_reports: Optional[bool] = None
+    clinical_study: Optional[bool] = None
+    clinical_study_on_children: Optional[bool] = None
+    novelty: Optional[bool] = None
+
+    @model_validator(mode='before')
+    @classmethod
+    def repair(cls, data):
+        if not isinstance(data, dict):
+            return {}
+        data = dict(data)
+        for name, field in cls.model_fields.items():
+            if name not in data:
+                continue
+            value = data[name]
+            if field.annotation == Optional[bool]:
+                data[name] = to_bool(value)
+            elif field.annotation == Optional[str]:
+                data[name] = to_text(value)
+            elif name == 'actionable_events':
+                items = value if isinstance(value, list) else [value]
+                data[name] = [event for event in map(to_event, items) if event] if value is not None else None
+            elif name == 'drug_results':
+                items = value if isinstance(value, list) else [value]
+                data[name] = [text for text in map(to_text, items) if text] if value is not None else None
+        return data
+
+
+def parse_article_metadata(result):
+    """ArticleMetadata from a parsed response, accepting either the wrapped or the bare metadata object."""
+    if not isinstance(result, dict):
+        return ArticleMetadata()
+    metadata = result.get('article_metadata', result)
+    return ArticleMetadata.model_validate(metadata if isinstance(metadata, dict) else {})
+
+
+def missing_fields(metadata):
+    return [name for name in REQUIRED_FIELDS if getattr(metadata, name) is None]
+
+
+def merge_metadata(metadata, patch):
+    """Fill metadata's unset fields from a re-ask's answer."""
+    values = metadata.model_dump(exclude_none=True)
+    for name, value in patch.model_dump(exclude_none=True).items():
+        values.setdefault(name, value)
+    return ArticleMetadata.model_validate(values)
+
+
+def create_missing_fields_prompt(prompt, metadata, fields):
+    """Re-ask with the original prompt, the fields already extracted and the ones still needed."""
+    return f"""{prompt}
+
+<PreviousAnswer>
+{json.dumps({'article_metadata': metadata.model_dump(exclude_none=True)})}
+</PreviousAnswer>
+
+The previous answer is missing or has invalid values for: {', '.join(fields)}.
+Return an article_metadata object containing only these fields."""
+
+
+def repair_json_text(text):
+    """Parse a possibly truncated JSON object, dropping a cut-off last member and closing open brackets; None if nothing parses."""
+    text = (text or '').strip()
+    fenced = re.search(r'```(?:json)?\s*(.*?)(?:```|$)', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    start = text.find('{')
+    if start < 0:
+        return None
+    text = text[start:]
+    # Each failed attempt drops the last (possibly partial) member and tries again
+    for _ in range(50):
+        closed = close_json(text)
+        try:
+            if closed is not None:
+                return json.JSONDecoder().raw_decode(closed)[0]
+        except json.JSONDecodeError:
+            pass
+        cut = text.rfind(',')
+        if cut <= 0:
+            return None
+        text = text[:cut]
+    return None
+
+
+def close_json(text):
+    """Append the brackets needed to close a truncated JSON document; None if it ends inside a string."""
+    closers = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            closers.append('}' if ch == '{' else ']')
+        elif ch in '}]' and closers:
+            closers.pop()
+    if in_string:
+        # A value cut off mid-string is unreliable; the caller drops that member instead
+        return None
+    text = re.sub(r'[,:\s]+$', '', text)
+    return text + ''.join(reversed(closers))
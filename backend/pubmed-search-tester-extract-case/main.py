@@ -0,0 +1,86 @@
+import functions_framework
+from flask import jsonify, request
+from google import genai
+import logging
+import os
+
+from analysis_cache import create_cache_from_env
+from case_extraction import extract_case
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Initialize Vertex AI client
+client = genai.Client(
+    vertexai=True,
+    project="gemini-med-lit-review",
+    location="us-central1",
+)
+
+# One deterministic call extracts the disease and the actionable events together
+EXTRACTION_MODEL = os.environ.get('EXTRACTION_MODEL', 'gemini-2.0-flash-001')
+# Google Search grounding is opt-in; without it the response is constrained to a JSON schema
+DEFAULT_GROUNDING = os.environ.get('EXTRACTION_GROUNDING', 'false').lower() == 'true'
+
+# Extractions keyed by the case notes hash, prompt and settings
+extraction_cache = create_cache_from_env('EXTRACTION_CACHE')
+
+def bool_option(request_json, name, default=False):
+    """A boolean request option: JSON true/false or the strings "true"/"false"; ValueError for anything else."""
+    value = request_json.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ValueError(f"{name} must be true or false, got {value!r}")
+
+@functions_framework.http
+def extract_case_notes(request):
+    """Disease and typed actionable events from case notes (POST {"text", "events_prompt"?, "grounding"?, "bypass_cache"?})."""
+    # Enable CORS
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {'Access-Control-Allow-Origin': '*'}
+
+    try:
+        request_json = request.get_json()
+        if not request_json:
+            return jsonify({'error': 'No JSON data received'}), 400, headers
+
+        text = request_json.get('text')
+        if not text:
+            return jsonify({'error': 'Missing text field'}), 400, headers
+
+        try:
+            grounding = bool_option(request_json, 'grounding', DEFAULT_GROUNDING)
+            use_cache = not bool_option(request_json, 'bypass_cache')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400, headers
+        extraction, cached = extract_case(
+            client, extraction_cache, EXTRACTION_MODEL, text,
+            events_prompt=request_json.get('events_prompt'),
+            grounding=grounding,
+            use_cache=use_cache,
+        )
+        return jsonify({**extraction, 'cached': cached, 'grounding': grounding, 'model': EXTRACTION_MODEL}), 200, headers
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return (jsonify({"error": str(e)}), 500, headers)
+
+if __name__ == "__main__":
+    # This is used when running locally only. When deploying to Google Cloud Functions,
+    # a webserver will be used to run the app instead
+    app = functions_framework.create_app(target="extract_case_notes")
+    port = int(os.environ.get('PORT', 8080))
+    app.run(host="0.0.0.0", port=port, debug=True)
@@ -4,6 +4,8 @@ from google import genai
 from google.genai import types
 import logging
 
+from rate_limiter import call_with_rate_limit
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -107,11 +109,13 @@ def extract_disease(request):
             tools=tools,
         )
 
-        # Generate response using Gemini
-        response = client.models.generate_content(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
+        # Generate response using Gemini through the shared rate limiter
+        response = call_with_rate_limit(
+            lambda: client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            )
         )
 
         return (response.text, 200, headers)
@@ -0,0 +1,200 @@
+"""Process-wide adaptive rate limiting for Vertex AI calls.
+
+Every Gemini call in this function goes through a single token bucket whose
+refill rate follows AIMD: it grows additively while calls succeed and is cut
+multiplicatively when Vertex answers with 429 RESOURCE_EXHAUSTED. Retries use
+jittered exponential backoff and are bounded by a retry budget and a deadline.
+
+This module is kept identical in every Cloud Function directory that calls
+Vertex AI, since each function is deployed from its own source directory.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Callables notified as observer(event, seconds): 'throttled' for each 429, 'backoff' and 'wait' with the seconds slept
+observers = []
+
+
+def add_observer(observer):
+    observers.append(observer)
+
+
+def notify(event, seconds=0.0):
+    for observer in observers:
+        try:
+            observer(event, seconds)
+        except Exception as e:
+            logger.warning(f"Rate limiter observer failed: {str(e)}")
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call runs out of retries or time while being throttled."""
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with an AIMD-controlled refill rate (requests per second)."""
+
+    def __init__(self, initial_rate=1.0, min_rate=0.05, max_rate=20.0,
+                 increase=0.1, decrease=0.5, burst=5, decrease_cooldown=2.0):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.decrease_cooldown = decrease_cooldown
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def _take(self):
+        """Take a token if one is available; otherwise return the seconds until one will be."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, deadline=None):
+        """Block until a token is available. Returns False if the deadline would pass first."""
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            notify('wait', wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, deadline=None):
+        """acquire() for asyncio code: waits without blocking the event loop."""
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            notify('wait', wait)
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """Additive increase: roughly +increase requests/second per second of successful calls."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1.0))
+
+    def on_throttle(self):
+        """Multiplicative decrease, applied at most once per cooldown so a burst of 429s counts once."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+            logger.warning(f"Vertex AI throttled, reducing rate to {self.rate:.2f} req/s")
+
+
+def is_rate_limit_error(error):
+    """Check whether an exception is a Vertex AI quota error: HTTP 429 or status RESOURCE_EXHAUSTED."""
+    if getattr(error, 'code', None) == 429 or getattr(error, 'status', None) == 'RESOURCE_EXHAUSTED':
+        return True
+    # Only the status prefix of the message counts, so a PMID or token count containing "429" is not a quota error
+    return str(error).startswith(('429 RESOURCE_EXHAUSTED', 'RESOURCE_EXHAUSTED'))
+
+
+def deadline_after(seconds):
+    """Convert a timeout in seconds to an absolute monotonic deadline."""
+    return time.monotonic() + seconds if seconds else None
+
+
+def call_with_rate_limit(fn, limiter=None, max_retries=None, deadline=None, base_delay=2.0, max_delay=60.0):
+    """Call fn() through the rate limiter, retrying 429s with full-jitter exponential backoff.
+
+    The call gives up with RateLimitExceeded after max_retries throttled attempts, or once the
+    earlier of the caller's deadline and VERTEX_CALL_DEADLINE_SECONDS has passed.
+    """
+    limiter = limiter or vertex_rate_limiter
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    deadline = call_deadline(deadline)
+
+    attempt = 0
+    while True:
+        if not limiter.acquire(deadline):
+            raise RateLimitExceeded("Deadline exceeded while waiting for Vertex AI rate limiter")
+        try:
+            result = fn()
+        except Exception as e:
+            attempt += 1
+            delay = backoff_delay(e, limiter, attempt, max_retries, deadline, base_delay, max_delay)
+            time.sleep(delay)
+            continue
+        limiter.on_success()
+        return result
+
+
+async def call_with_rate_limit_async(fn, limiter=None, max_retries=None, deadline=None, base_delay=2.0, max_delay=60.0):
+    """call_with_rate_limit() for coroutines: fn() returns an awaitable, and waits do not block the event loop."""
+    limiter = limiter or vertex_rate_limiter
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    deadline = call_deadline(deadline)
+
+    attempt = 0
+    while True:
+        if not await limiter.acquire_async(deadline):
+            raise RateLimitExceeded("Deadline exceeded while waiting for Vertex AI rate limiter")
+        try:
+            result = await fn()
+        except Exception as e:
+            attempt += 1
+            delay = backoff_delay(e, limiter, attempt, max_retries, deadline, base_delay, max_delay)
+            await asyncio.sleep(delay)
+            continue
+        limiter.on_success()
+        return result
+
+
+def call_deadline(deadline=None):
+    """The earlier of the caller's deadline and VERTEX_CALL_DEADLINE_SECONDS from now."""
+    limit = deadline_after(CALL_DEADLINE_SECONDS)
+    return min(deadline, limit) if deadline is not None else limit
+
+
+def backoff_delay(error, limiter, attempt, max_retries, deadline, base_delay, max_delay):
+    """Seconds to wait before retrying a throttled call; re-raises errors that must not be retried."""
+    if not is_rate_limit_error(error):
+        raise error
+    notify('throttled')
+    limiter.on_throttle()
+    if attempt > max_retries:
+        raise RateLimitExceeded(f"Vertex AI quota exhausted after {max_retries} retries") from error
+    delay = random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+    if deadline is not None and time.monotonic() + delay > deadline:
+        raise RateLimitExceeded("Deadline exceeded while backing off from Vertex AI quota errors") from error
+    logger.warning(f"Received RESOURCE_EXHAUSTED error. Attempt {attempt}/{max_retries}. Backing off {delay:.1f} seconds...")
+    notify('backoff', delay)
+    return delay
+
+
+MAX_RETRIES = int(os.environ.get('VERTEX_MAX_RETRIES', '6'))
+CALL_DEADLINE_SECONDS = float(os.environ.get('VERTEX_CALL_DEADLINE_SECONDS', '300'))
+
+# Shared by every Vertex AI call in this process
+vertex_rate_limiter = AdaptiveRateLimiter(
+    initial_rate=float(os.environ.get('VERTEX_RATE_INITIAL', '1.0')),
+    min_rate=float(os.environ.get('VERTEX_RATE_MIN', '0.05')),
+    max_rate=float(os.environ.get('VERTEX_RATE_MAX', '20.0')),
+)
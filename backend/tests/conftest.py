@@ -0,0 +1,30 @@
+"""Tests live outside the Cloud Function source directories so they are not uploaded on deploy.
+
+The analyze-articles modules are imported from its source directory. The main
+fixture imports main.py with the fake Gemini and BigQuery clients of
+benchmark.py, loaded with a small synthetic corpus and SJR table.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pubmed-search-tester-analyze-articles'))
+
+
+@pytest.fixture(scope='session')
+def fakes():
+    import benchmark
+    journals = benchmark.make_journal_table(50)
+    backend = benchmark.FakeGeminiBackend(latency=0, jitter=0, latency_per_1k_tokens=0)
+    bq_client = benchmark.FakeBigQueryClient(latency=0)
+    bq_client.load(benchmark.make_corpus(10, journals, article_chars=4000), journals)
+    return {'genai': benchmark.FakeGenaiClient(backend), 'bigquery': bq_client, 'backend': backend, 'journals': journals}
+
+
+@pytest.fixture(scope='session')
+def main(fakes):
+    import benchmark
+    module = benchmark.load_main(fakes['genai'], fakes['bigquery'])
+    benchmark.reset_state(module, vertex_rate=1000)
+    return module
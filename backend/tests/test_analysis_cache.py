@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import pytest
+
+import analysis_cache
+from analysis_cache import AnalysisCache, MemoryCache, SQLiteCache, create_cache_from_env, make_cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the cache module's clock with one the test advances."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(analysis_cache, 'time', SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+class BrokenBackend:
+    def get(self, key):
+        raise OSError("disk unavailable")
+
+    def set(self, key, value):
+        raise OSError("disk unavailable")
+
+
+def test_cache_key_depends_on_every_part_but_not_their_order():
+    assert make_cache_key(pmid='1', prompt='p') == make_cache_key(prompt='p', pmid='1')
+    assert make_cache_key(pmid='1', prompt='p') != make_cache_key(pmid='2', prompt='p')
+
+
+def test_memory_cache_evicts_the_least_recently_used_entry():
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    cache.set('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+
+
+def test_memory_cache_entries_expire(clock):
+    cache = MemoryCache(ttl_seconds=60)
+    cache.set('a', '1')
+    clock.value += 59
+    assert cache.get('a') == '1'
+    clock.value += 2
+    assert cache.get('a') is None
+
+
+def test_sqlite_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    SQLiteCache(path).set('a', '1')
+    cache = SQLiteCache(path)
+    assert cache.get('a') == '1'
+    cache.set('a', '2')
+    assert SQLiteCache(path).get('a') == '2'
+
+
+def test_sqlite_cache_entries_expire(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'), ttl_seconds=60)
+    cache.set('a', '1')
+    clock.value += 61
+    assert cache.get('a') is None
+
+
+def test_analysis_cache_counts_hits_and_misses():
+    cache = AnalysisCache(MemoryCache())
+    cache.get('a')
+    cache.set('a', '1')
+    assert cache.get('a') == '1'
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_backend_errors_do_not_fail_the_caller():
+    cache = AnalysisCache(BrokenBackend())
+    cache.set('a', '1')
+    assert cache.get('a') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_backend_is_chosen_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('TEST_CACHE_BACKEND', 'sqlite')
+    monkeypatch.setenv('TEST_CACHE_PATH', str(tmp_path / 'env.sqlite'))
+    assert isinstance(create_cache_from_env('TEST_CACHE').backend, SQLiteCache)
+    monkeypatch.setenv('TEST_CACHE_BACKEND', 'none')
+    assert not create_cache_from_env('TEST_CACHE').enabled
+
+
+def stored_keys(cache):
+    return {key for key, in cache._conn.execute("SELECT key FROM cache")}
+
+
+def test_sqlite_cache_deletes_expired_rows_as_it_writes(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'), ttl_seconds=60, prune_every=3)
+    cache.set('old', '1')
+    clock.value += 61
+    cache.set('a', '2')
+    assert 'old' in stored_keys(cache)
+    cache.set('b', '3')
+    assert stored_keys(cache) == {'a', 'b'}
+
+
+def test_sqlite_cache_keeps_the_newest_max_entries(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'), max_entries=2, prune_every=1)
+    for key in 'abcd':
+        clock.value += 1
+        cache.set(key, key)
+    assert stored_keys(cache) == {'c', 'd'}
+
+
+def test_sqlite_cache_prunes_when_opened(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    SQLiteCache(path).set('old', '1')
+    clock.value += 61
+    assert stored_keys(SQLiteCache(path, ttl_seconds=60)) == set()
@@ -0,0 +1,55 @@
+import pytest
+
+
+@pytest.mark.parametrize('body, message', [
+    ({'pipeline': 'two-stage'}, 'pipeline must be one of'),
+    ({'match_mode': 'lookups'}, 'match_mode must be one of'),
+    ({'text_mode': 'summary'}, 'text_mode must be one of'),
+    ({'top_k': 'abc'}, 'top_k must be an integer'),
+    ({'top_n': 0}, 'top_n must be at least 1'),
+    ({'max_distance': 'far'}, 'max_distance must be a number'),
+    ({'max_articles': 2.5}, 'max_articles must be an integer'),
+    ({'deadline_seconds': 'nan'}, 'deadline_seconds must be a number'),
+])
+def test_invalid_options_are_rejected(main, body, message):
+    with pytest.raises(ValueError, match=message):
+        main.parse_analysis_options(body)
+
+
+def test_valid_options_are_converted(main):
+    options = main.parse_analysis_options({'pipeline': 'two_stage', 'match_mode': 'auto', 'top_k': '500', 'top_n': '3',
+                                           'max_distance': '0.4', 'concurrency': 99})
+    assert options['pipeline'] == 'two_stage'
+    assert options['match_mode'] == 'auto'
+    assert options['top_k'] == main.MAX_TOP_K
+    assert options['top_n'] == 3
+    assert options['max_distance'] == 0.4
+    assert options['concurrency'] == main.MAX_CONCURRENCY
+
+
+def test_handler_returns_400_for_an_invalid_option(main):
+    import flask
+    app = flask.Flask(__name__)
+    with app.test_request_context(method='POST', json={'events_text': 'NRAS', 'pipeline': 'two-stage'}):
+        body, status, _ = main.analyze_articles(flask.request)
+    assert status == 400
+    assert 'pipeline must be one of' in body.get_json()['error']
+
+
+@pytest.mark.parametrize('value, expected', [(True, True), (False, False), ('true', True), ('False', False)])
+def test_boolean_options_accept_json_booleans_and_their_strings(main, value, expected):
+    assert main.parse_analysis_options({'compress': value})['compress'] is expected
+
+
+def test_missing_boolean_option_uses_its_default(main):
+    assert main.parse_analysis_options({})['compress'] is main.DEFAULT_COMPRESS_STREAM
+
+
+@pytest.mark.parametrize('value', ['no', 'yes', 0, 1, [], {}])
+def test_boolean_options_reject_other_values(main, value):
+    with pytest.raises(ValueError, match='rank_updates must be true or false'):
+        main.parse_analysis_options({'rank_updates': value})
+
+
+def test_bypass_cache_string_false_keeps_the_cache(main):
+    assert main.parse_analysis_options({'bypass_cache': 'false'})['use_cache'] is True
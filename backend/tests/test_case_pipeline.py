@@ -0,0 +1,33 @@
+import asyncio
+import json
+import threading
+
+
+def test_extraction_event_is_not_held_back_by_the_warm_up(main, monkeypatch):
+    release = threading.Event()
+    warmed = threading.Event()
+
+    def slow_warm_up(options):
+        release.wait(5)
+        warmed.set()
+
+    def extract(case_notes, events_prompt, grounding, options, deadline):
+        extraction = {'disease': 'acute myeloid leukemia', 'events': ['NRAS Q61K']}
+        return extraction, {'type': 'extraction', 'data': {**extraction, 'events_text': 'NRAS Q61K'}}
+
+    monkeypatch.setattr(main, 'warm_pipeline', slow_warm_up)
+    monkeypatch.setattr(main, 'extract_case_for_pipeline', extract)
+
+    async def run():
+        stream = main.stream_case_pipeline_async("8 year old with relapsed AML, NRAS Q61K", options={'top_k': 2, 'compress': False})
+        first = json.loads(await asyncio.wait_for(stream.__anext__(), 5))
+        still_warming = not warmed.is_set()
+        release.set()
+        rest = [json.loads(line) async for line in stream if line.strip()]
+        return first, still_warming, rest
+
+    first, still_warming, rest = asyncio.run(run())
+    assert first['type'] == 'extraction'
+    assert still_warming
+    assert [event['type'] for event in rest][:2] == ['retrieval', 'metadata']
+    assert rest[-1]['data']['status'] == 'complete'
@@ -0,0 +1,71 @@
+import json
+
+from context_cache import CHARS_PER_TOKEN, LocalCachesStub, PromptPrefixCache, create_prefix_cache
+
+MIN_TOKENS = 100
+LONG_PREFIX = "Shared methodology instructions. " * (MIN_TOKENS * CHARS_PER_TOKEN // 30)
+
+
+class FailingCaches(LocalCachesStub):
+    def create(self, model, config=None):
+        raise RuntimeError("cached content quota exceeded")
+
+
+def test_prefix_above_minimum_is_created_once_and_reused():
+    caches = LocalCachesStub()
+    cache = PromptPrefixCache(caches, 'model', min_tokens=MIN_TOKENS)
+    names = [cache.get(LONG_PREFIX) for _ in range(5)]
+    assert names[0] is not None
+    assert set(names) == {names[0]}
+    assert list(caches.entries) == [names[0]]
+    assert cache.stats() == {'created': 1, 'reused': 4, 'skipped': 0, 'failed': 0}
+
+
+def test_invalidate_forces_a_new_entry():
+    cache = PromptPrefixCache(LocalCachesStub(), 'model', min_tokens=MIN_TOKENS)
+    first = cache.get(LONG_PREFIX)
+    cache.invalidate(LONG_PREFIX)
+    second = cache.get(LONG_PREFIX)
+    assert second is not None and second != first
+    assert cache.get(LONG_PREFIX) == second
+    assert cache.stats()['created'] == 2
+
+
+def test_entry_close_to_expiry_is_recreated():
+    cache = PromptPrefixCache(LocalCachesStub(), 'model', ttl_seconds=30, min_tokens=MIN_TOKENS, refresh_margin_seconds=60)
+    assert cache.get(LONG_PREFIX) != cache.get(LONG_PREFIX)
+    assert cache.stats()['created'] == 2
+
+
+def test_prefix_below_minimum_is_not_cached():
+    caches = LocalCachesStub()
+    cache = PromptPrefixCache(caches, 'model', min_tokens=MIN_TOKENS)
+    assert not cache.applies("Short methodology")
+    assert cache.get("Short methodology") is None
+    assert caches.entries == {}
+    assert cache.stats()['skipped'] == 1
+
+
+def test_creation_failure_falls_back_to_the_full_prompt():
+    cache = PromptPrefixCache(FailingCaches(), 'model', min_tokens=MIN_TOKENS)
+    assert cache.get(LONG_PREFIX) is None
+    assert cache.stats()['failed'] == 1
+
+
+def test_articles_of_a_request_share_one_cached_prefix(main, fakes, monkeypatch):
+    prefix_cache = create_prefix_cache(fakes['genai'], main.GEMINI_MODEL, backend='local', min_tokens=MIN_TOKENS)
+    monkeypatch.setattr(main, 'prefix_cache', prefix_cache)
+    methodology = LONG_PREFIX + "\n\nPatient disease: {disease}\n\n<Article>\n{article_text}\n</Article>\n\nReturn the JSON object."
+    options = main.parse_analysis_options({'top_k': 4, 'bypass_cache': True})
+    events = [json.loads(line) for line in main.stream_response("NRAS Q61K", methodology, "acute myeloid leukemia", options)]
+
+    articles = [event for event in events if event['type'] == 'article_analysis']
+    assert len(articles) == 4
+    assert prefix_cache.stats() == {'created': 1, 'reused': 3, 'skipped': 0, 'failed': 0}
+
+
+def test_short_prefix_keeps_the_methodology_order(main, fakes, monkeypatch):
+    monkeypatch.setattr(main, 'prefix_cache', create_prefix_cache(fakes['genai'], main.GEMINI_MODEL, backend='local'))
+    prefix, prompt = main.create_gemini_prompt_parts("ARTICLE BODY", '1', "Before\n<Article>\n{article_text}\n</Article>\nAfter {disease}", "AML")
+    assert prefix is None
+    assert prompt == "Before\n<Article>\nARTICLE BODY\n</Article>\nAfter AML"
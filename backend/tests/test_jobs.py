@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+
+import pytest
+
+from jobs import COMPLETE, FAILED, INTERRUPTED, RUNNING, JobManager, JobStore
+
+
+def event_lines(count, release=None):
+    """Stream factory yielding count NDJSON events, waiting for release before the last one."""
+    def stream():
+        for i in range(count):
+            if release is not None and i == count - 1:
+                release.wait(5)
+            yield json.dumps({'type': 'article_analysis', 'data': {'n': i}}) + "\n"
+    return stream
+
+
+def read_events(lines):
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def wait_until_done(manager, job_id):
+    for _ in range(500):
+        if manager.status(job_id)['status'] != RUNNING:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.sqlite'))
+
+
+def test_job_events_are_numbered_and_followed_to_the_end(store):
+    manager = JobManager(store)
+    job_id, attached = manager.submit('key', event_lines(3))
+    events = read_events(manager.follow(job_id))
+    assert not attached
+    assert [event['id'] for event in events] == [1, 2, 3]
+    assert [event['data']['n'] for event in events] == [0, 1, 2]
+    assert manager.status(job_id)['status'] == COMPLETE
+    assert manager.status(job_id)['last_event_id'] == 3
+
+
+def test_followers_resume_after_their_last_event(store):
+    manager = JobManager(store)
+    job_id, _ = manager.submit('key', event_lines(5))
+    wait_until_done(manager, job_id)
+    assert [event['id'] for event in read_events(manager.follow(job_id, after_id=3))] == [4, 5]
+
+
+def test_duplicate_submission_attaches_to_the_running_job(store):
+    manager = JobManager(store)
+    release = threading.Event()
+    job_id, _ = manager.submit('key', event_lines(2, release))
+    second_id, attached = manager.submit('key', event_lines(2))
+    other_id, other_attached = manager.submit('other key', event_lines(1))
+    release.set()
+    assert attached and second_id == job_id
+    assert not other_attached and other_id != job_id
+    assert len(read_events(manager.follow(job_id))) == 2
+
+
+def test_finished_job_is_not_attached_to(store):
+    manager = JobManager(store)
+    job_id, _ = manager.submit('key', event_lines(1))
+    wait_until_done(manager, job_id)
+    second_id, attached = manager.submit('key', event_lines(1))
+    assert not attached and second_id != job_id
+
+
+def test_waiting_follower_gets_keep_alive_lines(store):
+    manager = JobManager(store, heartbeat_seconds=0.01)
+    release = threading.Event()
+    job_id, _ = manager.submit('key', event_lines(2, release))
+    follower = manager.follow(job_id)
+    lines = [next(follower) for _ in range(3)]
+    release.set()
+    lines += list(follower)
+    assert "\n" in lines
+    assert [event['id'] for event in read_events(lines)] == [1, 2]
+
+
+def test_failing_stream_marks_the_job_failed(store):
+    def stream():
+        yield json.dumps({'type': 'metadata'}) + "\n"
+        raise RuntimeError("retrieval failed")
+
+    manager = JobManager(store)
+    job_id, _ = manager.submit('key', stream)
+    assert len(read_events(manager.follow(job_id))) == 1
+    assert manager.status(job_id)['status'] == FAILED
+
+
+def test_running_jobs_of_an_earlier_process_are_interrupted_on_startup(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite')
+    store = JobStore(path)
+    store.create('old-job', 'key')
+    store.append('old-job', 1, json.dumps({'type': 'metadata', 'id': 1}))
+
+    manager = JobManager(JobStore(path))
+    assert manager.status('old-job')['status'] == INTERRUPTED
+    assert [event['id'] for event in read_events(manager.follow('old-job'))] == [1]
+    job_id, attached = manager.submit('key', event_lines(1))
+    assert not attached and job_id != 'old-job'
+
+
+def test_finished_jobs_are_purged_after_the_retention_period(store):
+    store.create('old-job', 'key')
+    store.set_status('old-job', COMPLETE)
+    store.append('old-job', 1, '{}')
+    store._conn.execute("UPDATE jobs SET updated = updated - 7200 WHERE job_id = 'old-job'")
+    manager = JobManager(store, retention_seconds=3600)
+    job_id, _ = manager.submit('other key', event_lines(1))
+    assert manager.status('old-job') is None
+    assert store.events_after('old-job', 0) == []
+    assert manager.status(job_id) is not None
+
+
+def test_analysis_job_endpoint_resumes_from_the_last_event(main, tmp_path, monkeypatch):
+    import flask
+    monkeypatch.setattr(main, 'job_manager', JobManager(JobStore(str(tmp_path / 'jobs.sqlite'))))
+    app = flask.Flask(__name__)
+    body = {'events_text': 'NRAS Q61K', 'disease': 'acute myeloid leukemia', 'top_k': 3, 'compress': False}
+    with app.test_request_context(method='POST', json=body):
+        response = main.analysis_job(flask.request)
+        first = read_events(response.response)
+    job_id = first[0]['data']['job_id']
+    events = [event for event in first if event['type'] != 'job']
+    assert events[-1]['data']['status'] == 'complete'
+
+    with app.test_request_context(method='POST', json={'job_id': job_id, 'last_event_id': events[1]['id'], 'compress': False}):
+        response = main.analysis_job(flask.request)
+        resumed = [event for event in read_events(response.response) if event['type'] != 'job']
+    assert resumed == events[2:]
+
+    with app.test_request_context(method='POST', json={'job_id': 'missing', 'compress': False}):
+        _, status, _ = main.analysis_job(flask.request)
+    assert status == 404
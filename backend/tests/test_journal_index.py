@@ -0,0 +1,78 @@
+import pytest
+
+from benchmark import make_journal_table
+from journal_index import JournalIndex, normalize_issn, normalize_title, trigrams
+
+
+def dice(a, b):
+    grams_a, grams_b = trigrams(normalize_title(a)), trigrams(normalize_title(b))
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+@pytest.fixture
+def index():
+    index = JournalIndex()
+    index.add("Journal of Clinical Oncology", 12.5, ['0732-183X', '1527-7755'])
+    index.add("Blood", 8.0, ['0006-4971'])
+    index.add("Leukemia", 4.5, ['0887-6924'])
+    index.add("New England Journal of Medicine", 20.0)
+    return index
+
+
+@pytest.mark.parametrize('title', ["J Clin Oncol", "Journal of Clinical Oncology", "JCO", "the journal of clinical oncology"])
+def test_abbreviations_and_aliases_share_one_key(title):
+    assert normalize_title(title) == 'journal clinical oncology'
+
+
+def test_issn_is_normalised():
+    assert normalize_issn('0732-183x') == '0732183X'
+    assert normalize_issn('123') == ''
+
+
+def test_issn_match_wins_over_the_title(index):
+    assert index.lookup("Leukemia", "1527-7755") == ("Journal of Clinical Oncology", 12.5)
+    assert index.lookup(None, "0006-4971, 1528-0020") == ("Blood", 8.0)
+
+
+def test_unknown_issn_falls_back_to_the_title(index):
+    assert index.lookup("N Engl J Med", "9999-9999") == ("New England Journal of Medicine", 20.0)
+
+
+def test_small_typos_match_fuzzily(index):
+    assert dice("Journal of Clinical Oncolgy", "Journal of Clinical Oncology") >= index.min_similarity
+    assert index.lookup("Journal of Clinical Oncolgy") == ("Journal of Clinical Oncology", 12.5)
+
+
+def test_different_journals_do_not_match(index):
+    assert dice("Journal of Clinical Investigation", "Journal of Clinical Oncology") < index.min_similarity
+    assert index.lookup("Journal of Clinical Investigation") is None
+    assert index.lookup("Leukemia Research") is None
+    assert index.lookup("") is None
+
+
+def test_similarity_threshold_is_inclusive_at_the_score():
+    score = dice("Leukaemia", "Leukemia")
+    at_threshold = JournalIndex(min_similarity=score)
+    at_threshold.add("Leukemia", 4.5)
+    assert at_threshold.lookup("Leukaemia") == ("Leukemia", 4.5)
+    above_threshold = JournalIndex(min_similarity=score + 0.01)
+    above_threshold.add("Leukemia", 4.5)
+    assert above_threshold.lookup("Leukaemia") is None
+
+
+def test_first_entry_wins_for_duplicate_titles():
+    index = JournalIndex()
+    index.add("Blood", 8.0)
+    index.add("BLOOD", 1.0)
+    assert index.lookup("blood") == ("Blood", 8.0)
+    assert len(index) == 1
+
+
+def test_every_journal_of_a_table_resolves_by_issn_and_title():
+    journals = make_journal_table(200)
+    index = JournalIndex()
+    for row in journals:
+        index.add(row['title'], row['sjr'], [row['issn']])
+    for row in journals:
+        assert index.lookup(issn=row['issn']) == (row['title'], row['sjr'])
+        assert index.lookup(row['title']) == (row['title'], row['sjr'])
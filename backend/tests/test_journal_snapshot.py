@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from journal_snapshot import JournalImpactStore, read_snapshot_meta, snapshot_version, write_snapshot
+
+ROWS = [("Blood", "00064971", 8.0), ("Leukemia", "08876924, 14765551", 4.5)]
+
+
+class SlowFetch:
+    """fetch_rows stand-in that blocks until released, or fails with the given error."""
+
+    def __init__(self, rows=ROWS, error=None):
+        self.rows = rows
+        self.error = error
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.rows
+
+
+def test_bundled_snapshot_is_loaded_without_bigquery(tmp_path):
+    path = str(tmp_path / 'journal_impact.sqlite')
+    meta = write_snapshot(path, ROWS)
+    fetch = SlowFetch()
+    store = JournalImpactStore(fetch, bundled_path=path, cache_path=str(tmp_path / 'cache.sqlite'))
+    assert store.index().lookup("Leukemia") == ("Leukemia", 4.5)
+    assert store.index().lookup(issn="1476-5551") == ("Leukemia", 4.5)
+    assert fetch.calls == 0
+    assert store.info()['version'] == snapshot_version(meta)
+    assert store.info()['source'] == 'bundled'
+
+
+def test_cold_start_callers_wait_for_the_first_fetch(tmp_path):
+    fetch = SlowFetch()
+    cache_path = str(tmp_path / 'cache.sqlite')
+    store = JournalImpactStore(fetch, bundled_path=str(tmp_path / 'missing.sqlite'), cache_path=cache_path)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.index().lookup("Blood"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    assert results == []
+    fetch.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [("Blood", 8.0)] * 4
+    assert fetch.calls == 1
+    assert read_snapshot_meta(cache_path)['rows'] == '2'
+
+
+def test_failed_cold_start_fetch_scores_without_sjr_until_a_retry(tmp_path):
+    fetch = SlowFetch(error=RuntimeError("BigQuery unavailable"))
+    fetch.release.set()
+    store = JournalImpactStore(fetch, cache_path=str(tmp_path / 'cache.sqlite'), retry_seconds=0)
+    assert store.index().lookup("Blood") is None
+    assert store.info()['version'] is None
+    fetch.error = None
+    store.refresh(wait=True)
+    assert store.index().lookup("Blood") == ("Blood", 8.0)
+
+
+def test_snapshot_of_another_table_is_ignored(tmp_path):
+    path = str(tmp_path / 'journal_impact.sqlite')
+    write_snapshot(path, ROWS, source_table='other.table')
+    assert read_snapshot_meta(path) is None
+
+
+@pytest.mark.parametrize('refresh', [True, False])
+def test_stale_snapshot_is_served_while_it_refreshes(tmp_path, refresh):
+    path = str(tmp_path / 'journal_impact.sqlite')
+    write_snapshot(path, ROWS)
+    fetch = SlowFetch(rows=[("Blood", "00064971", 9.0)])
+    store = JournalImpactStore(fetch, bundled_path=path, max_age_seconds=-1, refresh=refresh)
+    assert store.index().lookup("Blood") == ("Blood", 8.0)
+    fetch.release.set()
+    if refresh:
+        store._refresh_thread.join(5)
+        assert store.index().lookup("Blood") == ("Blood", 9.0)
+    else:
+        assert fetch.calls == 0
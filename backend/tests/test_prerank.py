@@ -0,0 +1,22 @@
+from journal_index import JournalIndex
+from prerank import DISEASE_POINTS, expected_score
+
+
+def score_snippet(snippet, disease):
+    _, breakdown = expected_score({'name': '1'}, snippet, disease, [], JournalIndex(), lambda sjr: 0)
+    return breakdown
+
+
+def test_lowercase_all_is_not_a_disease_match():
+    breakdown = score_snippet('Neuroblastoma outcomes. All patients received induction chemotherapy.', 'B-ALL')
+    assert 'disease_match' not in breakdown
+
+
+def test_uppercase_acronym_is_a_disease_match():
+    breakdown = score_snippet('Revumenib in relapsed B-ALL with KMT2A rearrangement.', 'B-ALL')
+    assert breakdown['disease_match'] == DISEASE_POINTS
+
+
+def test_full_name_is_a_disease_match():
+    breakdown = score_snippet('Outcomes of pediatric acute lymphoblastic leukemia after HSCT.', 'B-ALL')
+    assert breakdown['disease_match'] == DISEASE_POINTS
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import pytest
+from google.genai import errors
+
+import rate_limiter
+from benchmark import FakeRateLimitError
+from rate_limiter import (AdaptiveRateLimiter, RateLimitExceeded, call_with_rate_limit, call_with_rate_limit_async,
+                          is_rate_limit_error)
+
+
+def fast_limiter(**kwargs):
+    return AdaptiveRateLimiter(**{'initial_rate': 1000.0, 'max_rate': 2000.0, 'burst': 1000, **kwargs})
+
+
+class FlakyCall:
+    """Fails with the given errors in order, then returns 'ok'."""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return 'ok'
+
+
+@pytest.fixture
+def throttled_events(monkeypatch):
+    events = []
+    monkeypatch.setattr(rate_limiter, 'observers', [lambda event, seconds: events.append(event)])
+    return events
+
+
+def test_success_increases_the_rate_additively_up_to_the_maximum():
+    limiter = AdaptiveRateLimiter(initial_rate=1.0, max_rate=1.25, increase=0.1)
+    limiter.on_success()
+    assert limiter.rate == pytest.approx(1.1)
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.rate == 1.25
+
+
+def test_throttle_halves_the_rate_once_per_cooldown_down_to_the_minimum():
+    limiter = AdaptiveRateLimiter(initial_rate=8.0, min_rate=1.5, decrease=0.5, decrease_cooldown=60)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.rate == 4.0
+    limiter.decrease_cooldown = 0
+    for _ in range(5):
+        limiter.on_throttle()
+    assert limiter.rate == 1.5
+
+
+def test_acquire_gives_up_when_the_deadline_would_pass():
+    limiter = AdaptiveRateLimiter(initial_rate=0.1, burst=1)
+    assert limiter.acquire()
+    assert not limiter.acquire(deadline=time.monotonic() + 0.5)
+
+
+@pytest.mark.parametrize('error', [
+    FakeRateLimitError("injected"),
+    errors.ClientError(429, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED', 'message': 'Quota exceeded'}}),
+    Exception("429 RESOURCE_EXHAUSTED: quota exceeded"),
+])
+def test_quota_errors_are_recognised(error):
+    assert is_rate_limit_error(error)
+
+
+@pytest.mark.parametrize('error', [
+    ValueError("No content found for article 34291429"),
+    ValueError("Prompt has 4290 tokens"),
+    errors.ClientError(400, {'error': {'code': 400, 'status': 'INVALID_ARGUMENT', 'message': 'Bad request'}}),
+])
+def test_other_errors_are_not_quota_errors(error):
+    assert not is_rate_limit_error(error)
+
+
+def test_quota_errors_are_retried_with_backoff(throttled_events):
+    limiter = fast_limiter(decrease_cooldown=0)
+    call = FlakyCall(FakeRateLimitError("429"), FakeRateLimitError("429"))
+    assert call_with_rate_limit(call, limiter=limiter, base_delay=0.001, max_delay=0.001) == 'ok'
+    assert call.calls == 3
+    assert throttled_events.count('throttled') == 2
+    assert throttled_events.count('backoff') == 2
+    assert limiter.rate < 1000.0
+
+
+def test_other_errors_are_raised_without_retrying():
+    call = FlakyCall(ValueError("No content found for article 34291429"))
+    with pytest.raises(ValueError):
+        call_with_rate_limit(call, limiter=fast_limiter(), base_delay=0.001)
+    assert call.calls == 1
+
+
+def test_retry_budget_is_bounded():
+    call = FlakyCall(*[FakeRateLimitError("429")] * 10)
+    with pytest.raises(RateLimitExceeded):
+        call_with_rate_limit(call, limiter=fast_limiter(), max_retries=2, base_delay=0.001, max_delay=0.001)
+    assert call.calls == 3
+
+
+def test_backoff_stops_at_the_deadline():
+    call = FlakyCall(*[FakeRateLimitError("429")] * 10)
+    with pytest.raises(RateLimitExceeded):
+        call_with_rate_limit(call, limiter=fast_limiter(), base_delay=60, max_delay=60, deadline=time.monotonic() + 0.01)
+
+
+def test_async_calls_retry_quota_errors():
+    call = FlakyCall(FakeRateLimitError("429"))
+
+    async def fn():
+        return call()
+
+    assert asyncio.run(call_with_rate_limit_async(fn, limiter=fast_limiter(), base_delay=0.001, max_delay=0.001)) == 'ok'
+    assert call.calls == 2
@@ -0,0 +1,71 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from retrieval import LocalVectorRetriever, build_ivf
+
+
+def write_index(index_dir, embeddings):
+    """A local index directory over the given embeddings, with PMIDs 1, 2, ..."""
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, 'embeddings.npy'), np.asarray(embeddings, dtype=np.float32))
+    pmids = [str(i + 1) for i in range(len(embeddings))]
+    with open(os.path.join(index_dir, 'pmids.json'), 'w') as f:
+        json.dump(pmids, f)
+    offsets = []
+    with open(os.path.join(index_dir, 'contents.jsonl'), 'wb') as f:
+        for pmid in pmids:
+            offsets.append(f.tell())
+            f.write((json.dumps({'name': pmid, 'content': f"Article {pmid}"}) + "\n").encode('utf-8'))
+    np.save(os.path.join(index_dir, 'content_offsets.npy'), np.array(offsets, dtype=np.int64))
+
+
+def write_ivf(index_dir, centroids, lists):
+    """IVF files with the given centroids and row ids per centroid (lists may be empty)."""
+    np.save(os.path.join(index_dir, 'ivf_centroids.npy'), np.asarray(centroids, dtype=np.float32))
+    np.save(os.path.join(index_dir, 'ivf_lists.npy'), np.array([row for rows in lists for row in rows], dtype=np.int64))
+    np.save(os.path.join(index_dir, 'ivf_offsets.npy'), np.cumsum([0] + [len(rows) for rows in lists]).astype(np.int64))
+
+
+@pytest.fixture
+def embeddings():
+    return np.random.default_rng(0).normal(size=(200, 8))
+
+
+def test_ivf_and_brute_force_agree_when_every_list_is_probed(tmp_path, embeddings):
+    index_dir = str(tmp_path / 'index')
+    write_index(index_dir, embeddings)
+    build_ivf(index_dir, nlist=8)
+    brute = LocalVectorRetriever(index_dir, None, 'brute')
+    ivf = LocalVectorRetriever(index_dir, None, 'ivf', nprobe=8)
+    query = embeddings[17] + 0.01
+    brute_rows, brute_distances = brute.nearest(query, 10)
+    ivf_rows, ivf_distances = ivf.nearest(query, 10)
+    assert brute_rows[0] == 17
+    assert list(ivf_rows) == list(brute_rows)
+    assert np.allclose(ivf_distances, brute_distances, atol=1e-4)
+
+
+def test_empty_lists_near_the_query_widen_the_probe(tmp_path, embeddings):
+    index_dir = str(tmp_path / 'index')
+    write_index(index_dir, embeddings)
+    # Two empty clusters closest to the query, then one holding every row
+    far = np.full(8, 100.0)
+    write_ivf(index_dir, [far, far + 1, np.zeros(8)], [[], [], list(range(200))])
+    retriever = LocalVectorRetriever(index_dir, lambda text: far, 'ivf', nprobe=1)
+    rows, distances = retriever.nearest(far, 5)
+    assert len(rows) == 5
+    assert list(distances) == sorted(distances)
+    assert [hit['name'] for hit in retriever.search("query", top_k=5)] == [str(row + 1) for row in rows]
+
+
+@pytest.mark.parametrize('index_type', ['brute', 'ivf'])
+def test_no_results_are_asked_for_or_available(tmp_path, embeddings, index_type):
+    index_dir = str(tmp_path / 'index')
+    write_index(index_dir, embeddings)
+    write_ivf(index_dir, [np.zeros(8), np.ones(8)], [list(range(200)), []])
+    retriever = LocalVectorRetriever(index_dir, None, index_type)
+    rows, distances = retriever.nearest(np.ones(8), 0)
+    assert len(rows) == 0 and len(distances) == 0
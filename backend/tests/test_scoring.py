@@ -0,0 +1,184 @@
+import math
+import re
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from scoring import FeatureTable, rank_order, resolve_weights, score_articles, score_table
+
+
+def normalize_journal_score(sjr):
+    if not sjr:
+        return 0
+    return min(math.log(sjr + 1) * 5, 25)
+
+
+def baseline_points(metadata):
+    """calculate_points as it was before scoring was vectorised, kept as the reference."""
+    points = 0
+    breakdown = {}
+    if metadata.get('journal_title') and metadata.get('journal_sjr'):
+        sjr = float(metadata['journal_sjr'])
+        if sjr > 0:
+            impact_points = normalize_journal_score(sjr)
+            points += impact_points
+            breakdown['journal_impact'] = impact_points
+    if metadata.get('year'):
+        try:
+            year_points = -5 * (datetime.now().year - int(metadata.get('year')))
+            points += year_points
+            breakdown['year'] = year_points
+        except (ValueError, TypeError):
+            pass
+    if metadata.get('disease_match'):
+        points += 50
+        breakdown['disease_match'] = 50
+    if metadata.get('pediatric_focus'):
+        points += 20
+        breakdown['pediatric_focus'] = 20
+    paper_type = metadata.get('paper_type', '').lower()
+    if 'clinical trial' in paper_type:
+        points += 40
+        breakdown['paper_type'] = 40
+    elif 'review' in paper_type:
+        points -= 5
+        breakdown['paper_type'] = -5
+    matched_events = sum(1 for event in metadata.get('actionable_events', []) if event.get('matches_query', False))
+    if matched_events > 0:
+        points += matched_events * 15
+        breakdown['actionable_events'] = matched_events * 15
+    for field, value in [('drugs_tested', 5), ('treatment_shown', 50), ('cell_studies', 5), ('mice_studies', 10),
+                         ('case_report', 5), ('series_of_case_reports', 10), ('clinical_study', 15),
+                         ('clinical_study_on_children', 20), ('novelty', 10)]:
+        if metadata.get(field):
+            points += value
+            breakdown[field] = value
+    return points, breakdown
+
+
+FULL = {
+    'journal_title': 'Blood', 'journal_sjr': 3.123, 'year': '2019', 'disease_match': True, 'pediatric_focus': True,
+    'paper_type': 'Randomized Clinical Trial', 'drugs_tested': True, 'treatment_shown': True, 'cell_studies': True,
+    'mice_studies': True, 'case_report': True, 'series_of_case_reports': True, 'clinical_study': True,
+    'clinical_study_on_children': True, 'novelty': True,
+    'actionable_events': [{'event': 'NRAS Q61K', 'matches_query': True}, {'event': 'KRAS G12D', 'matches_query': True}],
+}
+
+METADATA = [
+    FULL,
+    {},
+    {'journal_title': 'Blood'},
+    # SJR without a journal title, a zero, negative, string or uncapped/capped SJR
+    {'journal_sjr': 8.0},
+    {'journal_title': 'Blood', 'journal_sjr': 0},
+    {'journal_title': 'Blood', 'journal_sjr': '0'},
+    {'journal_title': 'Blood', 'journal_sjr': -2.5},
+    {'journal_title': 'Blood', 'journal_sjr': '12.345'},
+    {'journal_title': 'Blood', 'journal_sjr': 0.001},
+    {'journal_title': 'Blood', 'journal_sjr': 147.0},
+    {'journal_title': 'Blood', 'journal_sjr': 106094},
+    {'journal_title': 'Blood', 'journal_sjr': float('nan')},
+    # Years as ints, floats, padded, unparseable or in the future
+    {'year': 2015},
+    {'year': 2015.9},
+    {'year': ' 2021 '},
+    {'year': '2020.5'},
+    {'year': 'unknown'},
+    {'year': ''},
+    {'year': 0},
+    {'year': str(datetime.now().year + 1)},
+    # Paper types, including both keywords at once
+    {'paper_type': 'Review'},
+    {'paper_type': 'systematic review of clinical trials'},
+    {'paper_type': 'Clinical Trial; Review'},
+    {'paper_type': 'Case Report'},
+    # Events without matches_query, and truthy values that are not booleans
+    {'actionable_events': [{'event': 'FLT3'}, {'event': 'NPM1', 'matches_query': False}, {'event': 'IDH1', 'matches_query': 1}]},
+    {'actionable_events': []},
+    {'disease_match': 'yes', 'novelty': 'false', 'cell_studies': 0, 'mice_studies': [], 'case_report': ['x']},
+    {**FULL, 'journal_sjr': 0.5, 'year': '1999', 'paper_type': 'review'},
+]
+
+
+@pytest.mark.parametrize('metadata', METADATA)
+def test_scores_and_breakdowns_match_the_original_calculation(metadata):
+    points, breakdown = score_articles([metadata])[0]
+    expected_points, expected_breakdown = baseline_points(metadata)
+    assert points == expected_points
+    assert breakdown == expected_breakdown
+    assert list(breakdown) == list(expected_breakdown)
+
+
+def test_a_table_scores_each_article_like_a_single_one():
+    scored = score_articles(METADATA)
+    assert scored == [baseline_points(metadata) for metadata in METADATA]
+
+
+def test_journal_points_match_to_the_last_bit_across_sjr_values():
+    # NumPy's vectorised log differs from math.log in the last bit for some of these
+    metadatas = [{'journal_title': 'J', 'journal_sjr': i * 0.0137} for i in range(1, 5000)]
+    assert score_articles(metadatas) == [baseline_points(metadata) for metadata in metadatas]
+
+
+def test_metadata_the_original_rejected_is_scored_leniently():
+    points, breakdown = score_articles([{'paper_type': None, 'actionable_events': None}])[0]
+    assert (points, breakdown) == (0, {})
+    points, breakdown = score_articles([{'actionable_events': ['NRAS Q61K', {'matches_query': True}]}])[0]
+    assert (points, breakdown) == (15, {'actionable_events': 15})
+
+
+def test_weight_overrides_change_only_their_components():
+    weights = resolve_weights({'review': -20, 'novelty': 0})
+    points, breakdown = score_articles([{'paper_type': 'Review', 'novelty': True, 'disease_match': True}], weights)[0]
+    assert breakdown == {'disease_match': 50, 'paper_type': -20, 'novelty': 0}
+    assert points == 30
+
+
+@pytest.mark.parametrize('weights, message', [
+    ('aggressive', 'Unknown weight profile'),
+    ({'impact': 1}, 'Unknown weights'),
+    ({'review': True}, 'must be a number'),
+    ([1, 2], 'profile name or an object'),
+])
+def test_invalid_weights_are_rejected(weights, message):
+    with pytest.raises(ValueError, match=message):
+        resolve_weights(weights)
+
+
+def test_ties_keep_their_table_order():
+    table = FeatureTable.from_metadata([{'novelty': True}, {'disease_match': True}, {'novelty': True}])
+    totals, _ = score_table(table, resolve_weights())
+    assert list(rank_order(totals)) == [1, 0, 2]
+    assert np.array_equal(totals, [10, 50, 10])
+
+
+def post_rescore(main, body):
+    import flask
+    with flask.Flask(__name__).test_request_context(method='POST', json=body):
+        response, status, _ = main.rescore_articles(flask.request)
+        return response.get_json(), status
+
+
+def test_rescore_endpoint_ranks_posted_articles(main):
+    articles = [
+        {'analysis': {'article_metadata': {'PMID': '1', 'novelty': True}}},
+        {'article_metadata': {'PMID': '2', 'disease_match': True}},
+        {'PMID': '3', 'paper_type': 'Review', 'journal_sjr': 0},
+    ]
+    body, status = post_rescore(main, {'articles': articles})
+    assert status == 200
+    assert [(article['PMID'], article['overall_points']) for article in body['articles']] == [('2', 50), ('1', 10), ('3', -5)]
+
+
+@pytest.mark.parametrize('body, message', [
+    ({'articles': {'PMID': '1'}}, 'articles must be a list'),
+    ({'articles': [{'PMID': '1'}, 'PMID 2']}, r'articles\[1\] must be an object'),
+    ({'articles': [{'analysis': None}]}, r'articles\[0\] must be an object'),
+    ({'articles': [{'article_metadata': ['novelty']}]}, r'articles\[0\] must be an object'),
+    ({'pmids': '12345'}, 'pmids must be a list'),
+])
+def test_rescore_endpoint_rejects_malformed_articles(main, body, message):
+    response, status = post_rescore(main, body)
+    assert status == 400
+    assert re.search(message, response['error'])
@@ -0,0 +1,100 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from structured_output import close_json, merge_metadata, missing_fields, parse_article_metadata, repair_json_text
+
+COMPLETE = {'article_metadata': {'title': 'T', 'year': '2020', 'actionable_events': [{'event': 'NRAS Q61K', 'matches_query': True}]}}
+
+
+def test_complete_json_is_returned_unchanged():
+    assert repair_json_text(json.dumps(COMPLETE)) == COMPLETE
+
+
+def test_fenced_and_prefixed_json_is_found():
+    assert repair_json_text("Here it is:\n```json\n" + json.dumps(COMPLETE) + "\n```") == COMPLETE
+    assert repair_json_text("Result: " + json.dumps(COMPLETE) + " trailing text") == COMPLETE
+
+
+@pytest.mark.parametrize('text, expected', [
+    # Cut off inside a string value: that member is dropped
+    ('{"article_metadata": {"title": "T", "year": "20', {'article_metadata': {'title': 'T'}}),
+    # Cut off after a key or a colon
+    ('{"article_metadata": {"title": "T", "year"', {'article_metadata': {'title': 'T'}}),
+    ('{"article_metadata": {"title": "T", "year": ', {'article_metadata': {'title': 'T'}}),
+    # Cut off inside a nested array of objects
+    ('{"article_metadata": {"title": "T", "actionable_events": [{"event": "NRAS", "matches_query": true}, {"event": "KR',
+     {'article_metadata': {'title': 'T', 'actionable_events': [{'event': 'NRAS', 'matches_query': True}]}}),
+    # Cut off right after a complete member
+    ('{"article_metadata": {"title": "T", "cancer_focus": true,', {'article_metadata': {'title': 'T', 'cancer_focus': True}}),
+    # Fence opened but never closed
+    ('```json\n{"title": "T", "novelty": fal', {'title': 'T'}),
+])
+def test_truncated_json_is_repaired(text, expected):
+    assert repair_json_text(text) == expected
+
+
+def test_brackets_and_quotes_inside_strings_are_not_structure():
+    text = '{"title": "A {tricky}, [title] with \\"quotes\\"", "year": "2019", "paper_type": "rev'
+    assert repair_json_text(text) == {'title': 'A {tricky}, [title] with "quotes"', 'year': '2019'}
+
+
+@pytest.mark.parametrize('text', ['', 'no json here', '{"title": "never closed', None])
+def test_unrepairable_text_gives_none(text):
+    assert repair_json_text(text) is None
+
+
+def test_close_json_appends_the_missing_brackets():
+    assert close_json('{"a": [1, 2, {"b": 3') == '{"a": [1, 2, {"b": 3}]}'
+    assert close_json('{"a": "cut') is None
+
+
+def test_metadata_values_are_coerced_or_left_unset():
+    metadata = parse_article_metadata({'article_metadata': {
+        'title': ' T ', 'year': 2020, 'cancer_focus': 'yes', 'pediatric_focus': 'sometimes',
+        'actionable_events': ['NRAS Q61K', {'event': 'KRAS', 'matches_query': 'true'}, {'matches_query': True}],
+        'drug_results': 'complete remission',
+    }})
+    assert metadata.title == 'T'
+    assert metadata.year == '2020'
+    assert metadata.cancer_focus is True
+    assert metadata.pediatric_focus is None
+    assert [event.model_dump() for event in metadata.actionable_events] == [
+        {'event': 'NRAS Q61K', 'matches_query': False}, {'event': 'KRAS', 'matches_query': True}]
+    assert metadata.drug_results == ['complete remission']
+    assert missing_fields(metadata) == ['journal_title', 'type_of_cancer', 'paper_type']
+
+
+def test_re_ask_fills_only_the_missing_fields():
+    metadata = parse_article_metadata({'title': 'T', 'paper_type': 'review'})
+    patch = parse_article_metadata({'title': 'Other', 'journal_title': 'Blood', 'type_of_cancer': 'AML'})
+    merged = merge_metadata(metadata, patch)
+    assert merged.title == 'T'
+    assert merged.journal_title == 'Blood'
+    assert merged.type_of_cancer == 'AML'
+
+
+def test_truncated_structured_response_is_completed_with_one_re_ask(main, fakes, monkeypatch):
+    """A response cut off mid-answer is repaired, and one re-ask supplies the fields it lost."""
+    models = fakes['genai'].models
+    respond = models.generate_content
+    calls = []
+
+    def truncated_first(model, contents, config=None):
+        response = respond(model, contents, config)
+        calls.append(config.response_schema)
+        if len(calls) == 1:
+            # Cut the answer just after the title
+            text = response.text
+            return SimpleNamespace(text=text[:text.index('"year"')], usage_metadata=response.usage_metadata)
+        return response
+
+    monkeypatch.setattr(models, 'generate_content', truncated_first)
+    article = next(iter(fakes['bigquery'].corpus.values()))
+    analysis = main.generate_structured_analysis(None, f"<Article>\n{article}\n</Article>", '1', article, use_cache=False)
+    metadata = analysis['article_metadata']
+    assert len(calls) == 2
+    re_asked = set(calls[1].properties['article_metadata'].properties)
+    assert re_asked == {'journal_title', 'cancer_focus', 'type_of_cancer', 'paper_type', 'actionable_events'}
+    assert metadata['title'] and metadata['journal_title'] and metadata['type_of_cancer']
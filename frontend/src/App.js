@@ -5,7 +5,7 @@ import ArticleTable from './components/ArticleTable';
 import EditPromptModal from './components/modals/EditPromptModal';
 import EditMethodologyModal from './components/modals/EditMethodologyModal';
 import ArticleModal from './components/modals/ArticleModal';
-import { extractEvents, extractDisease, retrieveAndRankArticles } from './services/api';
+import { analyzeCase, extractCase, retrieveAndRankArticles } from './services/api';
 
 function App() {
   // Case notes state
@@ -44,12 +44,6 @@ The patient's disease is: {disease}
 
 The patient's actionable events are: {events}
 
-Journal Impact Data (SJR scores):
-The following is a list of journal titles and their SJR scores. When extracting the journal title from the article, find the best matching title from this list and use its SJR score. If no match is found, use 0 as the SJR score.
-
-Journal Titles and Scores:
-{journal_context}
-
 <Article>
 {article_text}
 </Article>
@@ -96,8 +90,8 @@ Please analyze the article and provide a JSON response with the following struct
 {
   "article_metadata": {
     "title": "...",
-    "journal_title": "...",  // Extract the journal title from the article
-    "journal_sjr": 0,        // Look up the SJR score from the provided list. Use the score of the best matching journal title, or 0 if no match found
+    "journal_title": "...",  // Extract the full journal title from the article
+    "journal_issn": "...",   // The journal ISSN if printed in the article, otherwise ""
     "year": "...",
     "cancer_focus": true/false,
     "pediatric_focus": true/false,
@@ -170,12 +164,9 @@ Extract actionable events from the provided patient information, such as gene fu
   const handleExtract = async () => {
     try {
       setIsProcessing(true);
-      const [disease, events] = await Promise.all([
-        extractDisease(caseNotes),
-        extractEvents(caseNotes, promptContent)
-      ]);
+      const { disease, events } = await extractCase(caseNotes, promptContent);
       setExtractedDisease(disease);
-      setExtractedEvents(events);
+      setExtractedEvents(events.map(({ event }) => event));
     } catch (error) {
       console.error('Error:', error);
       setExtractedDisease('Error extracting disease. Please try again.');
@@ -185,86 +176,106 @@ Extract actionable events from the provided patient information, such as gene fu
     }
   };
 
+  // Handles one event of an analysis stream
+  const handleStreamEvent = (data) => {
+    if (data.type === 'extraction') {
+      setExtractedDisease(data.data.disease);
+      setExtractedEvents(data.data.events.map(({ event }) => event));
+    }
+    else if (data.type === 'retrieval') {
+      setCurrentTotalArticles(data.data.total_articles);
+      setOutput(`### Retrieving articles...\n\nFound ${data.data.total_articles} relevant articles to analyze.\n\n`);
+    }
+    else if (data.type === 'metadata') {
+      if (data.data.status === 'processing') {
+        const totalArticles = data.data.total_articles;
+        setCurrentTotalArticles(totalArticles);
+        setOutput(`### Analyzing articles...\n\nFound ${totalArticles} relevant articles to analyze.\n\n`);
+      } else if (data.data.status === 'complete') {
+        const successfulArticles = articles.length;
+        const failedArticles = currentTotalArticles - successfulArticles;
+        
+        let markdown = `### Analysis complete\n\n`;
+        markdown += `Successfully analyzed ${successfulArticles} of ${currentTotalArticles} articles`;
+        if (failedArticles > 0) {
+          markdown += ` (${failedArticles} failed)`;
+        }
+        markdown += '.\n\n';
+        
+        setOutput(markdown);
+        setIsProcessing(false);
+      }
+    }
+    else if (data.type === 'article_analysis') {
+      try {
+        const analysis = data.data.analysis.article_metadata;
+        if (!analysis || !analysis.PMID || !analysis.title) {
+          console.error("Invalid article metadata:", analysis);
+          return;
+        }
+        
+        const articleData = {
+          pmid: analysis.PMID,
+          link: analysis.link || `https://pubmed.ncbi.nlm.nih.gov/${analysis.PMID}/`,
+          title: analysis.title,
+          year: analysis.year || 'N/A',
+          cancer: analysis.type_of_cancer || 'N/A',
+          type: analysis.paper_type || 'N/A',
+          events: analysis.actionable_events.map(event => ({
+            event: typeof event === 'object' ? event.event : event,
+            matches_query: typeof event === 'object' ? event.matches_query : false
+          })) || [],
+          drugs_tested: analysis.drugs_tested || false,
+          drug_results: analysis.drug_results || [],
+          points: analysis.overall_points || 0,
+          point_breakdown: analysis.point_breakdown || {},
+          fullText: data.data.analysis.full_article_text,
+          journal_title: analysis.journal_title || 'N/A',
+          journal_sjr: analysis.journal_sjr || 0
+        };
+        
+        setArticles(current => {
+          if (current.some(article => article.pmid === articleData.pmid)) {
+            return current;
+          }
+          const updatedArticles = [...current, articleData];
+          setOutput(`### Processing article ${data.data.progress.article_number} of ${currentTotalArticles}`);
+          return updatedArticles;
+        });
+      } catch (e) {
+        console.error("Error processing article analysis:", e);
+        setOutput(current => 
+          current + `Error processing article ${data.data.progress.article_number}: ${e.message}\n`
+        );
+      }
+    }
+    else if (data.type === 'rank_update') {
+      const bestSoFar = data.data.top
+        .map(entry => `${entry.position}. ${entry.title || entry.pmid} (${Math.round(entry.points)} points)`)
+        .join('\n');
+      setOutput(`### Processing article ${data.data.article_number} of ${currentTotalArticles}\n\n**Best so far**\n\n${bestSoFar}`);
+    }
+    else if (data.type === 'error') {
+      console.error("Server error:", data.data.message);
+      if (data.data.article_number) {
+        setOutput(current => 
+          current + `Error processing article ${data.data.article_number} of ${data.data.total_articles}: ${data.data.message}\n`
+        );
+      } else {
+        setOutput(current => current + `\nError: ${data.data.message}\n`);
+      }
+    }
+  };
+
   const handleRetrieveAndRank = async () => {
     try {
       setOutput('');
       setArticles([]);
       setIsProcessing(true);
 
-      const queryText = `${extractedDisease}\n${extractedEvents.join('\n')}`;
-
-      await retrieveAndRankArticles(queryText, methodologyContent, extractedDisease, (data) => {
-        if (data.type === 'metadata') {
-          if (data.data.status === 'processing') {
-            const totalArticles = data.data.total_articles;
-            setCurrentTotalArticles(totalArticles);
-            setOutput(`### Analyzing articles...\n\nFound ${totalArticles} relevant articles to analyze.\n\n`);
-          } else if (data.data.status === 'complete') {
-            const successfulArticles = articles.length;
-            const failedArticles = currentTotalArticles - successfulArticles;
-            
-            let markdown = `### Analysis complete\n\n`;
-            markdown += `Successfully analyzed ${successfulArticles} of ${currentTotalArticles} articles`;
-            if (failedArticles > 0) {
-              markdown += ` (${failedArticles} failed)`;
-            }
-            markdown += '.\n\n';
-            
-            setOutput(markdown);
-            setIsProcessing(false);
-          }
-        }
-        else if (data.type === 'article_analysis') {
-          try {
-            const analysis = data.data.analysis.article_metadata;
-            if (!analysis || !analysis.PMID || !analysis.title) {
-              console.error("Invalid article metadata:", analysis);
-              return;
-            }
-            
-            const articleData = {
-              pmid: analysis.PMID,
-              link: analysis.link || `https://pubmed.ncbi.nlm.nih.gov/${analysis.PMID}/`,
-              title: analysis.title,
-              year: analysis.year || 'N/A',
-              cancer: analysis.type_of_cancer || 'N/A',
-              type: analysis.paper_type || 'N/A',
-              events: analysis.actionable_events.map(event => ({
-                event: typeof event === 'object' ? event.event : event,
-                matches_query: typeof event === 'object' ? event.matches_query : false
-              })) || [],
-              drugs_tested: analysis.drugs_tested || false,
-              drug_results: analysis.drug_results || [],
-              points: analysis.overall_points || 0,
-              point_breakdown: analysis.point_breakdown || {},
-              fullText: data.data.analysis.full_article_text || '',
-              journal_title: analysis.journal_title || 'N/A',
-              journal_sjr: analysis.journal_sjr || 0
-            };
-            
-            setArticles(current => {
-              const updatedArticles = [...current, articleData];
-              setOutput(`### Processing article ${data.data.progress.article_number} of ${currentTotalArticles}`);
-              return updatedArticles;
-            });
-          } catch (e) {
-            console.error("Error processing article analysis:", e);
-            setOutput(current => 
-              current + `Error processing article ${data.data.progress.article_number}: ${e.message}\n`
-            );
-          }
-        }
-        else if (data.type === 'error') {
-          console.error("Server error:", data.data.message);
-          if (data.data.article_number) {
-            setOutput(current => 
-              current + `Error processing article ${data.data.article_number} of ${data.data.total_articles}: ${data.data.message}\n`
-            );
-          } else {
-            setOutput(current => current + `\nError: ${data.data.message}\n`);
-          }
-        }
-      });
+      const queryText = `${extractedDisease}\n${extractedEvents.filter(event => event.trim()).join('\n')}`;
+
+      await retrieveAndRankArticles(queryText, methodologyContent, extractedDisease, handleStreamEvent);
     } catch (error) {
       console.error('Error:', error);
       setOutput('Error retrieving and ranking articles. Please try again.');
@@ -273,6 +284,20 @@ Extract actionable events from the provided patient information, such as gene fu
     }
   };
 
+  const handleAnalyzeCase = async () => {
+    try {
+      setOutput('');
+      setArticles([]);
+      setIsProcessing(true);
+      await analyzeCase(caseNotes, promptContent, methodologyContent, handleStreamEvent);
+    } catch (error) {
+      console.error('Error:', error);
+      setOutput('Error analyzing case notes. Please try again.');
+    } finally {
+      setIsProcessing(false);
+    }
+  };
+
   return (
     <div className="min-h-screen bg-gray-100">
       {/* Header */}
@@ -302,13 +327,22 @@ Extract actionable events from the provided patient information, such as gene fu
             <div className="bg-white shadow rounded-lg p-6">
               <div className="flex justify-between items-center mb-4">
                 <h2 className="text-lg font-medium text-gray-700">2. Extract actionable events</h2>
-                <button
-                  onClick={handleExtract}
-                  disabled={isProcessing}
-                  className={`px-4 py-2 bg-blue-500 text-white rounded hover:bg-blue-600 focus:outline-none focus:ring-2 focus:ring-blue-500 focus:ring-offset-2 ${isProcessing ? 'opacity-50 cursor-not-allowed' : ''}`}
-                >
-                  {isProcessing ? 'Extracting...' : 'Extract'}
-                </button>
+                <div className="flex gap-2">
+                  <button
+                    onClick={handleExtract}
+                    disabled={isProcessing}
+                    className={`px-4 py-2 bg-blue-500 text-white rounded hover:bg-blue-600 focus:outline-none focus:ring-2 focus:ring-blue-500 focus:ring-offset-2 ${isProcessing ? 'opacity-50 cursor-not-allowed' : ''}`}
+                  >
+                    {isProcessing ? 'Extracting...' : 'Extract'}
+                  </button>
+                  <button
+                    onClick={handleAnalyzeCase}
+                    disabled={isProcessing || !caseNotes.trim()}
+                    className={`px-4 py-2 bg-blue-500 text-white rounded hover:bg-blue-600 focus:outline-none focus:ring-2 focus:ring-blue-500 focus:ring-offset-2 ${(isProcessing || !caseNotes.trim()) ? 'opacity-50 cursor-not-allowed' : ''}`}
+                  >
+                    {isProcessing ? 'Processing...' : 'Extract, retrieve and rank'}
+                  </button>
+                </div>
               </div>
               <div className="relative">
                 <div className="min-h-[100px] max-h-[200px] p-3 bg-gray-50 rounded-lg whitespace-pre-wrap text-sm overflow-y-auto">
@@ -352,12 +386,8 @@ Extract actionable events from the provided patient information, such as gene fu
                   <div className="min-h-[100px] p-3 bg-gray-50 rounded-lg">
                     {extractedEvents.length > 0 ? (
                       <textarea
-                        value={extractedEvents.join('" "')}
-                        onChange={(e) => {
-                          const text = e.target.value;
-                          const events = text.split('"').filter(event => event.trim() && event !== ' ');
-                          setExtractedEvents(events);
-                        }}
+                        value={extractedEvents.join('\n')}
+                        onChange={(e) => setExtractedEvents(e.target.value.split('\n'))}
                         className="w-full bg-transparent border-none focus:ring-0 p-0 min-h-[80px]"
                       />
                     ) : (
@@ -1,6 +1,7 @@
 import React from 'react';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
+import { fetchArticleText } from '../services/api';
 
 const ArticleTable = ({ articles, currentArticle, totalArticles }) => {
   const openInNewWindow = (content, type) => {
@@ -26,7 +27,7 @@ const ArticleTable = ({ articles, currentArticle, totalArticles }) => {
               <div class="max-w-4xl mx-auto bg-white rounded-lg shadow-md p-6">
                 <button onclick="window.close()" class="mb-4 text-blue-500 hover:text-blue-700">← Back to Table</button>
                 <div class="prose max-w-none">
-                  <p class="whitespace-pre-wrap text-gray-700 text-lg leading-relaxed">${content}</p>
+                  <p id="article-text" class="whitespace-pre-wrap text-gray-700 text-lg leading-relaxed">${content}</p>
                 </div>
               </div>
             </div>
@@ -68,6 +69,22 @@ const ArticleTable = ({ articles, currentArticle, totalArticles }) => {
       `);
     }
     newWindow.document.close();
+    return newWindow;
+  };
+
+  const viewArticle = async (article) => {
+    // Open the window before fetching so the popup is not blocked
+    const newWindow = openInNewWindow('Loading article...', 'article');
+    let text;
+    try {
+      text = article.fullText || await fetchArticleText(article.pmid);
+    } catch (e) {
+      text = `Could not load article ${article.pmid}: ${e.message}`;
+    }
+    const element = newWindow.document.getElementById('article-text');
+    if (element) {
+      element.textContent = text;
+    }
   };
 
   const sortedArticles = articles.sort((a, b) => b.points - a.points);
@@ -125,7 +142,7 @@ const ArticleTable = ({ articles, currentArticle, totalArticles }) => {
                 <td className="px-4 py-2 text-sm border-t text-gray-500">{article.drug_results?.join(', ') || 'None'}</td>
                 <td className="px-4 py-2 text-sm border-t text-gray-500">
                   <button
-                    onClick={() => openInNewWindow(article.fullText, 'article')}
+                    onClick={() => viewArticle(article)}
                     className="px-3 py-1 bg-blue-500 text-white rounded hover:bg-blue-600 transition-colors"
                   >
                     View Article
@@ -1,7 +1,24 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { X } from 'lucide-react';
+import { fetchArticleText } from '../../services/api';
 
 const ArticleModal = ({ isOpen, onClose, article }) => {
+  const [fullText, setFullText] = useState('');
+
+  useEffect(() => {
+    if (!isOpen || !article) return;
+    if (article.fullText) {
+      setFullText(article.fullText);
+      return;
+    }
+    let cancelled = false;
+    setFullText('Loading article...');
+    fetchArticleText(article.pmid)
+      .then(text => { if (!cancelled) setFullText(text); })
+      .catch(e => { if (!cancelled) setFullText(`Could not load article ${article.pmid}: ${e.message}`); });
+    return () => { cancelled = true; };
+  }, [isOpen, article]);
+
   if (!isOpen || !article) return null;
 
   return (
@@ -17,7 +34,7 @@ const ArticleModal = ({ isOpen, onClose, article }) => {
         </div>
         <div className="flex-1 overflow-y-auto p-6">
           <div className="prose max-w-none">
-            <p className="whitespace-pre-wrap">{article.fullText}</p>
+            <p className="whitespace-pre-wrap">{fullText}</p>
           </div>
         </div>
       </div>
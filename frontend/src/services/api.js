@@ -1,60 +1,138 @@
 const API_BASE_URL = 'https://us-central1-gemini-med-lit-review.cloudfunctions.net';
 
-export const extractDisease = async (text) => {
+export const extractCase = async (text, promptContent) => {
   try {
-    const response = await fetch(`${API_BASE_URL}/pubmed-search-tester-extract-disease`, {
+    const response = await fetch(`${API_BASE_URL}/pubmed-search-tester-extract-case`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ text }),
+      body: JSON.stringify({ text, events_prompt: promptContent }),
     });
 
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`);
     }
 
-    const data = await response.text();
-    return data.trim();
+    // { disease, events: [{ event, type }], cached, grounding, model }
+    return await response.json();
   } catch (error) {
     console.error('Error:', error);
     throw error;
   }
 };
 
-export const extractEvents = async (text, promptContent) => {
-  try {
-    const response = await fetch(`${API_BASE_URL}/pubmed-search-tester-extract-events`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ text: `${promptContent}\n\nCase input:\n${text}` }),
-    });
+// Reads an NDJSON stream and passes each event to onProgress
+const readEventStream = async (response, onProgress) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
 
-    if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`);
-    }
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
 
-    const data = await response.text();
-    return data.split('"').filter(event => event.trim() && event !== ' ');
-  } catch (error) {
-    console.error('Error:', error);
-    throw error;
+    buffer += decoder.decode(value);
+
+    while (buffer.includes('\n')) {
+      const newlineIndex = buffer.indexOf('\n');
+      const line = buffer.slice(0, newlineIndex);
+      buffer = buffer.slice(newlineIndex + 1);
+
+      if (!line.trim()) continue;
+
+      try {
+        const data = JSON.parse(line);
+        onProgress(data);
+      } catch (e) {
+        console.error('Error processing stream chunk:', e);
+        console.error('Line that caused error:', line);
+      }
+    }
   }
 };
 
+// The analysis runs as a server-side job; if the connection drops, the stream
+// is resumed from the last event received instead of starting over. Jobs only
+// exist on the instance running them, so when a reconnect lands on another
+// instance (404) the request is submitted again there; onProgress then sees
+// articles it already received, which callers skip by PMID
+const MAX_RECONNECTS = 5;
+
 export const retrieveAndRankArticles = async (eventsText, methodologyContent, disease, onProgress) => {
+  let jobId = null;
+  let lastEventId = 0;
+  let finished = false;
+
+  const handleEvent = (data) => {
+    if (data.type === 'job') {
+      jobId = data.data.job_id;
+      finished = data.data.status !== 'running';
+      return;
+    }
+    if (data.id !== undefined) {
+      if (data.id <= lastEventId) return;
+      lastEventId = data.id;
+    }
+    onProgress(data);
+  };
+
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const body = jobId ? { job_id: jobId, last_event_id: lastEventId, compress: true } : {
+        events_text: eventsText,
+        methodology_content: methodologyContent,
+        disease: disease,
+        rank_updates: true,
+        compress: true
+      };
+      const response = await fetch(`${API_BASE_URL}/pubmed-search-tester-analysis-job`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(body),
+      });
+
+      if (response.status === 404 && jobId) {
+        console.warn(`Analysis job ${jobId} not found, submitting the analysis again`);
+        jobId = null;
+        lastEventId = 0;
+        continue;
+      }
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      await readEventStream(response, handleEvent);
+      if (finished) return;
+      throw new Error('Stream ended before the analysis finished');
+    } catch (error) {
+      if (!jobId || attempt >= MAX_RECONNECTS) {
+        console.error('Error:', error);
+        throw error;
+      }
+      console.warn(`Reconnecting to analysis job ${jobId} after event ${lastEventId}:`, error);
+      await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+  }
+};
+
+// Extraction, retrieval and analysis in one request: the stream starts with
+// an 'extraction' and a 'retrieval' event, followed by the analyze-articles events
+export const analyzeCase = async (caseNotes, promptContent, methodologyContent, onProgress) => {
   try {
-    const response = await fetch(`${API_BASE_URL}/pubmed-search-tester-analyze-articles`, {
+    const response = await fetch(`${API_BASE_URL}/pubmed-search-tester-analyze-case`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ 
-        events_text: eventsText,
+      body: JSON.stringify({
+        case_notes: caseNotes,
+        events_prompt: promptContent,
         methodology_content: methodologyContent,
-        disease: disease
+        rank_updates: true,
+        compress: true
       }),
     });
 
@@ -62,32 +140,30 @@ export const retrieveAndRankArticles = async (eventsText, methodologyContent, di
       throw new Error(`HTTP error! status: ${response.status}`);
     }
 
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
-    let buffer = '';
-
-    while (true) {
-      const { value, done } = await reader.read();
-      if (done) break;
-
-      buffer += decoder.decode(value);
+    await readEventStream(response, onProgress);
+  } catch (error) {
+    console.error('Error:', error);
+    throw error;
+  }
+};
 
-      while (buffer.includes('\n')) {
-        const newlineIndex = buffer.indexOf('\n');
-        const line = buffer.slice(0, newlineIndex);
-        buffer = buffer.slice(newlineIndex + 1);
+// Full article text is fetched on demand; the browser revalidates repeat requests with the ETag
+const articleTextCache = new Map();
 
-        if (!line.trim()) continue;
+export const fetchArticleText = async (pmid) => {
+  if (articleTextCache.has(pmid)) {
+    return articleTextCache.get(pmid);
+  }
+  try {
+    const response = await fetch(`${API_BASE_URL}/pubmed-search-tester-article-text?pmid=${encodeURIComponent(pmid)}`);
 
-        try {
-          const data = JSON.parse(line);
-          onProgress(data);
-        } catch (e) {
-          console.error('Error processing stream chunk:', e);
-          console.error('Line that caused error:', line);
-        }
-      }
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
     }
+
+    const text = await response.text();
+    articleTextCache.set(pmid, text);
+    return text;
   } catch (error) {
     console.error('Error:', error);
     throw error;